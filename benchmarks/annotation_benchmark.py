@@ -0,0 +1,111 @@
+"""Compares per image and batched annotation of Mask R-CNN predictions
+
+Builds synthetic predictions for busy scenes, with many detections of which
+confident_fraction are above the confidence threshold, and annotates them once
+image by image with add_annotations and once as a batch with annotate_batch.
+Reports the latency per image of each and the fraction of pixels on which
+their outputs differ, which comes from overlapping instances.
+Needs maskrcnn_benchmark and OpenCV. Run from the root of the repo with:
+    PYTHONPATH=src python benchmarks/annotation_benchmark.py --detections 25,100,200
+"""
+from timeit import default_timer
+
+import fire
+import numpy as np
+import torch
+import torch.nn.functional as F
+from maskrcnn_benchmark.structures.bounding_box import BoxList
+
+from maskrcnn.annotate import annotate_batch
+from maskrcnn.model import add_annotations
+
+
+def create_prediction(detections, height, width, confident_fraction, mask_size=28):
+    """A BoxList like the model returns for an image scaled to height, width"""
+    top_left = torch.rand(detections, 2) * torch.tensor([width, height])
+    box_size = torch.rand(detections, 2) * torch.tensor([width, height]) / 4 + 8
+    boxes = torch.cat([top_left, top_left + box_size], dim=1)
+    boxes[:, 0::2] = boxes[:, 0::2].clamp(0, width - 1)
+    boxes[:, 1::2] = boxes[:, 1::2].clamp(0, height - 1)
+    prediction = BoxList(boxes, (width, height), mode="xyxy")
+    confident = torch.rand(detections) < confident_fraction
+    scores = torch.where(
+        confident, 0.7 + 0.3 * torch.rand(detections), 0.7 * torch.rand(detections)
+    )
+    prediction.add_field("scores", scores)
+    prediction.add_field("labels", torch.randint(1, 81, (detections,)))
+    # smooth blobs rather than noise so contours look like those of objects
+    masks = F.interpolate(
+        torch.rand(detections, 1, 7, 7),
+        size=(mask_size, mask_size),
+        mode="bilinear",
+        align_corners=False,
+    )
+    prediction.add_field("mask", masks)
+    return prediction
+
+
+def _time(func, repeats):
+    durations = []
+    for _ in range(repeats):
+        start = default_timer()
+        output = func()
+        durations.append(default_timer() - start)
+    return min(durations), output
+
+
+def run(
+    detections=(25, 100, 200),
+    batch_size=4,
+    height=1080,
+    width=1920,
+    model_height=800,
+    model_width=1333,
+    confident_fraction=0.5,
+    repeats=3,
+    threads=None,
+):
+    if threads:
+        torch.set_num_threads(threads)
+    if isinstance(detections, int):
+        detections = (detections,)
+    print(
+        "{:>11} {:>18} {:>18} {:>8} {:>12}".format(
+            "detections", "per image ms/img", "batched ms/img", "speedup", "pixels diff"
+        )
+    )
+    for count in detections:
+        images = [
+            np.random.randint(0, 255, (height, width, 3), dtype=np.uint8)
+            for _ in range(batch_size)
+        ]
+        predictions = [
+            create_prediction(count, model_height, model_width, confident_fraction)
+            for _ in range(batch_size)
+        ]
+        per_image, reference = _time(
+            lambda: [
+                add_annotations(image, prediction)
+                for image, prediction in zip(images, predictions)
+            ],
+            repeats,
+        )
+        batched, annotated = _time(
+            lambda: annotate_batch(images, predictions), repeats
+        )
+        differ = np.mean(
+            [(a != b).any(axis=2).mean() for a, b in zip(annotated, reference)]
+        )
+        print(
+            "{:>11} {:>18.1f} {:>18.1f} {:>8.1f} {:>11.3f}%".format(
+                count,
+                per_image * 1000 / batch_size,
+                batched * 1000 / batch_size,
+                per_image / batched,
+                differ * 100,
+            )
+        )
+
+
+if __name__ == "__main__":
+    fire.Fire(run)
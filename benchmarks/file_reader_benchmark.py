@@ -0,0 +1,62 @@
+"""Measures the cost of polling an input folder with each FileReader mode
+
+Run from the root of the repo with:
+    PYTHONPATH=src python benchmarks/file_reader_benchmark.py --sizes 1000,10000,100000
+"""
+import logging
+import os
+import tempfile
+from timeit import default_timer
+
+import fire
+
+from style_transfer import create_file_reader
+
+
+def _populate(folder, start, stop):
+    for i in range(start, stop):
+        open(os.path.join(folder, "{:08d}.jpg".format(i)), "w").close()
+
+
+def _time_polls(file_reader, polls):
+    start = default_timer()
+    for _ in range(polls):
+        file_reader.new_files()
+    return (default_timer() - start) / polls
+
+
+def _time_new_file(file_reader, folder, index):
+    _populate(folder, index, index + 1)
+    start = default_timer()
+    new_files = file_reader.new_files()
+    assert len(new_files) == 1, "Expected one new file got {}".format(len(new_files))
+    return default_timer() - start
+
+
+def run(sizes=(1000, 10000, 100000), modes=("glob", "scan", "inotify"), polls=10):
+    logging.basicConfig(level=logging.WARNING)
+    sizes = [int(s) for s in sizes]
+    print(
+        "{:>10} {:>8} {:>14} {:>14}".format(
+            "files", "mode", "idle poll ms", "new file ms"
+        )
+    )
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            _populate(folder, 0, size)
+            for index, mode in enumerate(modes):
+                file_reader = create_file_reader(
+                    os.path.join(folder, "*.jpg"), mode=mode
+                )
+                file_reader.new_files()  # initial listing
+                idle = _time_polls(file_reader, polls)
+                new_file = _time_new_file(file_reader, folder, size + index)
+                print(
+                    "{:>10} {:>8} {:>14.3f} {:>14.3f}".format(
+                        size, mode, idle * 1000, new_file * 1000
+                    )
+                )
+
+
+if __name__ == "__main__":
+    fire.Fire(run)
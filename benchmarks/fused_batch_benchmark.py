@@ -0,0 +1,53 @@
+"""Compares the graph and fused execution modes of the style transfer pipeline
+
+Runs on CPU against a LocalCluster with a randomly initialised TransformerNet.
+Run from the root of the repo with:
+    PYTHONPATH=src python benchmarks/fused_batch_benchmark.py --count 64 --size 256
+"""
+import logging
+import os
+import tempfile
+from timeit import default_timer
+
+import fire
+from dask.distributed import Client, LocalCluster
+
+from style_transfer.dask_pipeline import run_style_transfer_pipeline
+from synthetic import create_images, create_model
+
+
+def run(count=64, size=256, batch_size=4, n_workers=2, threads_per_worker=1):
+    logging.basicConfig(level=logging.WARNING)
+    with tempfile.TemporaryDirectory() as folder:
+        input_path = os.path.join(folder, "input")
+        os.makedirs(input_path)
+        create_images(input_path, count, size, size)
+        style = create_model(folder)
+
+        with LocalCluster(
+            n_workers=n_workers, threads_per_worker=threads_per_worker
+        ) as cluster, Client(cluster) as client:
+            print("{:>8} {:>10} {:>12}".format("mode", "seconds", "images/sec"))
+            for mode in ("graph", "fused"):
+                output_path = os.path.join(folder, mode)
+                os.makedirs(output_path)
+                start = default_timer()
+                run_style_transfer_pipeline(
+                    client,
+                    folder,
+                    style,
+                    input_path,
+                    output_path,
+                    patience=0,
+                    batch_size=batch_size,
+                    execution_mode=mode,
+                    cuda=False,
+                )
+                duration = default_timer() - start
+                print(
+                    "{:>8} {:>10.2f} {:>12.2f}".format(mode, duration, count / duration)
+                )
+
+
+if __name__ == "__main__":
+    fire.Fire(run)
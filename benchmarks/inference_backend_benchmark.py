@@ -0,0 +1,116 @@
+"""Compares the inference backends and precisions of stylize_batch on CPU
+
+Runs a randomly initialised TransformerNet through stylize_batch with each
+combination of backend and precision and reports its latency together with the
+PSNR and SSIM of its output against eager fp32. int8 models are calibrated on
+a few synthetic images. Models are prepared before timing starts, so only
+steady state latency is reported.
+Run from the root of the repo with:
+    PYTHONPATH=src python benchmarks/inference_backend_benchmark.py --batch_sizes 1,4,8
+"""
+import glob
+import os
+import tempfile
+from itertools import product
+from timeit import default_timer
+
+import fire
+import numpy as np
+import torch
+
+from style_transfer.accuracy import compare_outputs
+from style_transfer.model import (
+    INFERENCE_BACKENDS,
+    PRECISIONS,
+    load_model,
+    stylize_batch,
+)
+from synthetic import create_images, create_model
+
+
+def _models(folder, backends, precisions, calibration_images, height, width):
+    style = create_model(folder)
+    create_images(folder, calibration_images, height, width)
+    calibration_paths = sorted(glob.glob(os.path.join(folder, "*.jpg")))
+    models = {}
+    for backend, precision in product(backends, precisions):
+        style_model = load_model(
+            folder,
+            style,
+            cuda=False,
+            backend=backend,
+            precision=precision,
+            calibration_paths=calibration_paths,
+        )
+        if hasattr(style_model, "prepare"):
+            style_model.prepare()
+        models[backend, precision] = style_model
+    return models
+
+
+def _time(style_model, img_batch, repeats):
+    durations = []
+    for _ in range(repeats):
+        start = default_timer()
+        output = stylize_batch(style_model, img_batch, cuda=False)
+        durations.append(default_timer() - start)
+    return min(durations), output
+
+
+def run(
+    batch_sizes=(1, 4, 8),
+    height=512,
+    width=512,
+    backends=INFERENCE_BACKENDS,
+    precisions=PRECISIONS,
+    calibration_images=8,
+    threads=None,
+    repeats=3,
+):
+    if threads:
+        torch.set_num_threads(threads)
+    if isinstance(backends, str):
+        backends = (backends,)
+    if isinstance(precisions, str):
+        precisions = (precisions,)
+    with tempfile.TemporaryDirectory() as folder:
+        models = _models(
+            folder, backends, precisions, calibration_images, height, width
+        )
+        reference_model = load_model(folder, "random", cuda=False)
+    print("Using {} intra-op threads".format(torch.get_num_threads()))
+    print(
+        "{:>6} {:>10} {:>10} {:>12} {:>12} {:>10} {:>8}".format(
+            "batch",
+            "backend",
+            "precision",
+            "latency ms",
+            "images/sec",
+            "PSNR dB",
+            "SSIM",
+        )
+    )
+    for batch_size in batch_sizes:
+        img_batch = np.random.randint(
+            0, 255, (batch_size, 3, height, width), dtype=np.uint8
+        )
+        reference = stylize_batch(reference_model, img_batch, cuda=False)
+        for (backend, precision), style_model in models.items():
+            stylize_batch(style_model, img_batch, cuda=False)  # warm up
+            duration, output = _time(style_model, img_batch, repeats)
+            psnr, ssim = compare_outputs(reference, output)
+            print(
+                "{:>6} {:>10} {:>10} {:>12.1f} {:>12.2f} {:>10.2f} {:>8.4f}".format(
+                    batch_size,
+                    backend,
+                    precision,
+                    duration * 1000,
+                    batch_size / duration,
+                    psnr.min().item(),
+                    ssim.min().item(),
+                )
+            )
+
+
+if __name__ == "__main__":
+    fire.Fire(run)
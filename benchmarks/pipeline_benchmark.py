@@ -0,0 +1,208 @@
+"""End to end throughput benchmark of the style transfer pipeline on CPU
+
+Generates a synthetic JPEG corpus, starts a LocalCluster and runs
+run_style_transfer_pipeline with a randomly initialised TransformerNet once per
+execution mode. For each run it reports images/sec, latency percentiles of each
+stage taken from the task stream, the number of tasks the scheduler ran and the
+peak memory of each worker. Results are written as JSON so runs can be compared.
+Run from the root of the repo with:
+    PYTHONPATH=src python benchmarks/pipeline_benchmark.py --count 256 --output results.json
+"""
+import json
+import logging
+import os
+import platform
+import resource
+import tempfile
+from collections import defaultdict
+from timeit import default_timer
+
+import dask
+import fire
+import numpy as np
+import torch
+from dask.distributed import Client, LocalCluster, get_task_stream
+from dask.utils import key_split
+
+from style_transfer.dask_pipeline import run_style_transfer_pipeline
+from synthetic import create_images, create_model
+
+PERCENTILES = (50, 90, 99)
+
+
+def _peak_memory():
+    # peak resident set size of the worker process, reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _compute_intervals(task_stream):
+    for record in task_stream:
+        for startstop in record["startstops"]:
+            # older versions of distributed report (action, start, stop) tuples
+            if isinstance(startstop, dict):
+                action, start, stop = (
+                    startstop["action"],
+                    startstop["start"],
+                    startstop["stop"],
+                )
+            else:
+                action, start, stop = startstop
+            if action == "compute":
+                yield key_split(record["key"]), stop - start
+
+
+def _stage_latencies(task_stream):
+    durations = defaultdict(list)
+    for stage, duration in _compute_intervals(task_stream):
+        durations[stage].append(duration)
+    return {
+        stage: dict(
+            count=len(values),
+            total=float(np.sum(values)),
+            **{
+                "p{}".format(p): float(np.percentile(values, p))
+                for p in PERCENTILES
+            }
+        )
+        for stage, values in durations.items()
+    }
+
+
+def _cluster_options(threads, io_threads):
+    # mirrors dask_mpi, I/O threads are added on top of the compute threads
+    if not io_threads:
+        return {"threads_per_worker": threads}
+    return {
+        "threads_per_worker": threads + io_threads,
+        "resources": {"compute": threads, "io": io_threads},
+    }
+
+
+def _run_once(
+    folder, style, input_path, count, mode, n_workers, threads, io_threads, kwargs
+):
+    output_path = os.path.join(folder, "output_{}".format(mode))
+    os.makedirs(output_path)
+    with LocalCluster(
+        n_workers=n_workers, **_cluster_options(threads, io_threads)
+    ) as cluster, Client(cluster) as client:
+        with get_task_stream(client) as task_stream:
+            start = default_timer()
+            run_style_transfer_pipeline(
+                client,
+                folder,
+                style,
+                input_path,
+                output_path,
+                patience=0,
+                execution_mode=mode,
+                cuda=False,
+                io_resources=io_threads > 0,
+                **kwargs
+            )
+            duration = default_timer() - start
+        peak_memory = client.run(_peak_memory)
+    return {
+        "execution_mode": mode,
+        "images": count,
+        "seconds": duration,
+        "images_per_sec": count / duration,
+        "tasks": len(task_stream.data),
+        "stages": _stage_latencies(task_stream.data),
+        "peak_worker_memory": peak_memory,
+    }
+
+
+def _print_run(result):
+    print(
+        "{execution_mode}: {images_per_sec:.2f} images/sec | {tasks} tasks | "
+        "{seconds:.2f} seconds".format(**result)
+    )
+    for stage, latencies in sorted(result["stages"].items()):
+        print(
+            "    {:<28} n={:<6} p50={:.4f}s p90={:.4f}s p99={:.4f}s".format(
+                stage,
+                latencies["count"],
+                latencies["p50"],
+                latencies["p90"],
+                latencies["p99"],
+            )
+        )
+    print(
+        "    peak worker memory {:.1f} MB".format(
+            max(result["peak_worker_memory"].values()) / 2 ** 20
+        )
+    )
+
+
+def run(
+    count=128,
+    height=256,
+    width=256,
+    batch_size=4,
+    modes=("graph", "fused"),
+    n_workers=2,
+    threads_per_worker=1,
+    io_threads=0,
+    output=None,
+    **pipeline_kwargs
+):
+    """Benchmarks the style transfer pipeline
+
+    With io_threads each worker gets that many threads for loading and writing
+    on top of its threads_per_worker compute threads, as with dask_mpi.
+    Any extra keyword arguments, for example --bucket_by padded or --autotune, are
+    passed on to run_style_transfer_pipeline.
+    """
+    logging.basicConfig(level=logging.WARNING)
+    if isinstance(modes, str):
+        modes = (modes,)
+    config = dict(
+        count=count,
+        height=height,
+        width=width,
+        batch_size=batch_size,
+        n_workers=n_workers,
+        threads_per_worker=threads_per_worker,
+        io_threads=io_threads,
+        **pipeline_kwargs
+    )
+    results = {
+        "config": config,
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "dask": dask.__version__,
+            "cpus": os.cpu_count(),
+        },
+        "runs": [],
+    }
+    with tempfile.TemporaryDirectory() as folder:
+        input_path = os.path.join(folder, "input")
+        os.makedirs(input_path)
+        create_images(input_path, count, height, width)
+        style = create_model(folder)
+        pipeline_kwargs["batch_size"] = batch_size
+        for mode in modes:
+            result = _run_once(
+                folder,
+                style,
+                input_path,
+                count,
+                mode,
+                n_workers,
+                threads_per_worker,
+                io_threads,
+                pipeline_kwargs,
+            )
+            _print_run(result)
+            results["runs"].append(result)
+
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        print("Results written to {}".format(output))
+
+
+if __name__ == "__main__":
+    fire.Fire(run)
@@ -0,0 +1,121 @@
+"""Compares the per image PIL transforms and the batched tensor preprocessing of
+Mask R-CNN
+
+For each batch size a batch of random BGR images is preprocessed in a fresh
+process so that the reported peak resident memory belongs to that run alone.
+The transforms path is build_transforms applied to each image followed by
+to_image_list, which is what scoring did with its output. The batched path is
+build_batch_transform, whose ImageBatch scoring uses as it is. Afterwards the
+largest difference between their outputs is reported in 0-255 intensity levels.
+Needs maskrcnn_benchmark. Run from the root of the repo with:
+    PYTHONPATH=src python benchmarks/preprocessing_benchmark.py --batch_sizes 1,4,8
+"""
+import multiprocessing
+import resource
+from timeit import default_timer
+
+import fire
+import numpy as np
+import torch
+from maskrcnn_benchmark.config import cfg
+from maskrcnn_benchmark.structures.image_list import to_image_list
+
+from maskrcnn.model import build_batch_transform, build_transforms
+
+
+def _transforms(cfg):
+    transform = build_transforms(cfg)
+    return lambda images: to_image_list([transform(img) for img in images], 32)
+
+
+PREPROCESSING = {"transforms": _transforms, "batched": build_batch_transform}
+
+
+def _peak_memory():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _images(batch_size, height, width):
+    rng = np.random.RandomState(0)
+    return [
+        rng.randint(0, 255, (height, width, 3), dtype=np.uint8)
+        for _ in range(batch_size)
+    ]
+
+
+def _measure(mode, config_file, batch_size, height, width, repeats, threads, queue):
+    if threads:
+        torch.set_num_threads(threads)
+    if config_file:
+        cfg.merge_from_file(config_file)
+    preprocessing = PREPROCESSING[mode](cfg)
+    images = _images(batch_size, height, width)
+    baseline = _peak_memory()
+    durations = []
+    for _ in range(repeats):
+        start = default_timer()
+        image_list = preprocessing(images)
+        durations.append(default_timer() - start)
+    queue.put((min(durations), _peak_memory() - baseline))
+
+
+def run(
+    batch_sizes=(1, 4, 8),
+    height=1080,
+    width=1920,
+    config_file=None,
+    repeats=3,
+    threads=None,
+):
+    ctx = multiprocessing.get_context("spawn")
+    if isinstance(batch_sizes, int):
+        batch_sizes = (batch_sizes,)
+    print(
+        "{:>6} {:>11} {:>12} {:>14}".format(
+            "batch", "mode", "latency ms", "peak mem MB"
+        )
+    )
+    for batch_size in batch_sizes:
+        for mode in PREPROCESSING:
+            queue = ctx.Queue()
+            process = ctx.Process(
+                target=_measure,
+                args=(
+                    mode,
+                    config_file,
+                    batch_size,
+                    height,
+                    width,
+                    repeats,
+                    threads,
+                    queue,
+                ),
+            )
+            process.start()
+            duration, peak_memory = queue.get()
+            process.join()
+            print(
+                "{:>6} {:>11} {:>12.1f} {:>14.1f}".format(
+                    batch_size, mode, duration * 1000, peak_memory / 2 ** 20
+                )
+            )
+
+    # compared only now, the processes above would inherit the peak memory of
+    # this one
+    if config_file:
+        cfg.merge_from_file(config_file)
+    images = _images(2, height, width)
+    outputs = [PREPROCESSING[mode](cfg)(images).tensors for mode in PREPROCESSING]
+    # one intensity level in units of the normalized output
+    level = 1 / min(cfg.INPUT.PIXEL_STD)
+    if not cfg.INPUT.TO_BGR255:
+        level /= 255
+    print(
+        "Largest difference from the transforms: {:.2f} intensity levels".format(
+            float((outputs[1] - outputs[0]).abs().max()) / level
+        )
+    )
+
+
+if __name__ == "__main__":
+    fire.Fire(run)
@@ -0,0 +1,85 @@
+"""Compares the old and the uint8 ingestion paths of stylize_batch
+
+For each batch size the batch is converted and moved to the device in a fresh
+process so that the reported peak resident memory belongs to that run alone.
+By default only the ingestion is timed, pass --forward to include the forward
+pass of a randomly initialised TransformerNet.
+Run from the root of the repo with:
+    PYTHONPATH=src python benchmarks/stylize_batch_benchmark.py --batch_sizes 1,2,4,8,16,32
+"""
+import multiprocessing
+import resource
+from timeit import default_timer
+
+import fire
+import numpy as np
+import torch
+
+from style_transfer.model import TransformerNet, batch_to_device
+
+
+def _legacy_batch_to_device(img_batch, device):
+    return torch.FloatTensor(img_batch).mul(1 / 255).to(device)
+
+
+INGESTION = {"legacy": _legacy_batch_to_device, "uint8": batch_to_device}
+
+
+def _peak_memory(cuda):
+    if cuda:
+        return torch.cuda.max_memory_allocated()
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _measure(mode, batch_size, height, width, cuda, forward, repeats, queue):
+    device = torch.device("cuda" if cuda else "cpu")
+    style_model = TransformerNet().to(device) if forward else None
+    img_batch = np.random.randint(
+        0, 255, (batch_size, 3, height, width), dtype=np.uint8
+    )
+    baseline = _peak_memory(cuda)
+    durations = []
+    with torch.no_grad():
+        for _ in range(repeats):
+            start = default_timer()
+            content_image = INGESTION[mode](img_batch, device)
+            if forward:
+                content_image = style_model(content_image)
+            if cuda:
+                torch.cuda.synchronize()
+            durations.append(default_timer() - start)
+            del content_image
+    queue.put((min(durations), _peak_memory(cuda) - baseline))
+
+
+def run(
+    batch_sizes=(1, 2, 4, 8, 16, 32),
+    height=1080,
+    width=1920,
+    cuda=False,
+    forward=False,
+    repeats=3,
+):
+    ctx = multiprocessing.get_context("spawn")
+    print(
+        "{:>6} {:>8} {:>12} {:>14}".format("batch", "mode", "latency ms", "peak mem MB")
+    )
+    for batch_size in batch_sizes:
+        for mode in INGESTION:
+            queue = ctx.Queue()
+            process = ctx.Process(
+                target=_measure,
+                args=(mode, batch_size, height, width, cuda, forward, repeats, queue),
+            )
+            process.start()
+            duration, peak_memory = queue.get()
+            process.join()
+            print(
+                "{:>6} {:>8} {:>12.1f} {:>14.1f}".format(
+                    batch_size, mode, duration * 1000, peak_memory / 2 ** 20
+                )
+            )
+
+
+if __name__ == "__main__":
+    fire.Fire(run)
@@ -0,0 +1,23 @@
+"""Synthetic inputs shared by the benchmarks"""
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+
+from style_transfer.model import TransformerNet
+
+
+def create_images(folder, count, height, width, seed=42):
+    """Writes count random JPEGs of height x width to folder"""
+    rng = np.random.RandomState(seed)
+    for i in range(count):
+        img = rng.randint(0, 255, (height, width, 3), dtype=np.uint8)
+        Image.fromarray(img).save(os.path.join(folder, "{:06d}.jpg".format(i)))
+
+
+def create_model(folder, style="random", seed=42):
+    """Saves a randomly initialised TransformerNet as folder/style.pth"""
+    torch.manual_seed(seed)
+    torch.save(TransformerNet().state_dict(), os.path.join(folder, style + ".pth"))
+    return style
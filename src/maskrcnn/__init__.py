@@ -1,4 +1,9 @@
+import fnmatch
 import glob
+import hashlib
+import io
+import os
+import time
 from timeit import default_timer
 
 import numpy as np
@@ -6,16 +11,29 @@ from PIL import Image
 from toolz import curry, pipe
 import logging
 
+from maskrcnn.decode import decode_batch
+from maskrcnn.metrics import measure
+
 logger = logging.getLogger(__name__)
 
 
 def save_image(filename, data):
+    """Saves a BGR image to filename and returns the SHA-256 of the file"""
     img= data[:,:,[2,1,0]]
     # img = data.clone().clamp(0, 255).numpy()
     # img = img.transpose(1, 2, 0).astype("uint8")
     img=img.astype("uint8")
     img = Image.fromarray(img)
-    img.save(filename)
+    # encoded in memory so the file is written in one go and its hash is free
+    buffer = io.BytesIO()
+    img.save(
+        buffer,
+        format=Image.registered_extensions()[os.path.splitext(filename)[1].lower()],
+    )
+    encoded = buffer.getvalue()
+    with open(filename, "wb") as f:
+        f.write(encoded)
+    return hashlib.sha256(encoded).hexdigest()
 
 
 def pil_loader(path):
@@ -25,6 +43,12 @@ def pil_loader(path):
         return img.convert("RGB")
 
 
+def image_size(path):
+    # only reads the header, the image is not decoded
+    with Image.open(path) as img:
+        return img.size
+
+
 @curry
 def resize(pil_img, size, interpolation=Image.BILINEAR):
     return pil_img.resize(size, interpolation)
@@ -55,6 +79,171 @@ class FileReader(object):
         return new_files
 
 
+class ScanFileReader(object):
+    """Incremental file reader based on os.scandir
+
+    Each directory is listed only when its own mtime has changed since its last
+    listing, and every matching name a listing finds for the first time is
+    reported, whatever the mtime of the file. Files moved in with a preserved
+    mtime, as mv, cp -p, rsync -t and azcopy leave them, are therefore found
+    too. Entries created within the same timestamp tick as a listing do not
+    change the directory mtime, so on file systems with whole second mtimes a
+    directory is listed again until settle_period seconds have passed.
+
+    The names of the matching files of each directory at its last listing are
+    kept to tell new files from old ones. Unlike FileReader no full paths are
+    kept and no set of every file is rebuilt on each poll, and only directories
+    that changed are listed, so an idle poll costs a stat per directory.
+    """
+
+    def __init__(self, path, recursive=False, settle_period=2.0):
+        self._root, self._pattern = os.path.split(path)
+        self._recursive = recursive
+        self._settle_period = settle_period
+        self._dirs = {}
+        self._names = {}
+
+    def _dirs_to_list(self, force=False):
+        stack = [self._root]
+        while stack:
+            dirpath = stack.pop()
+            try:
+                mtime = os.stat(dirpath).st_mtime
+            except FileNotFoundError:
+                self._dirs.pop(dirpath, None)
+                self._names.pop(dirpath, None)
+                continue
+            listed_mtime, listed_at = self._dirs.get(dirpath, (None, None))
+            # entries created within the same timestamp tick as the last listing
+            # do not change the directory mtime so keep listing until it passes
+            tick = self._settle_period if mtime.is_integer() else 0.05
+            if force or mtime != listed_mtime or listed_at - mtime <= tick:
+                self._dirs[dirpath] = (mtime, time.time())
+                yield dirpath
+            if self._recursive:
+                stack.extend(
+                    entry.path
+                    for entry in os.scandir(dirpath)
+                    if entry.is_dir(follow_symlinks=False)
+                )
+
+    def _scan(self, force=False):
+        for dirpath in self._dirs_to_list(force=force):
+            listed = self._names.get(dirpath, frozenset())
+            names = set()
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    if entry.is_file() and fnmatch.fnmatch(entry.name, self._pattern):
+                        names.add(entry.name)
+            # names removed since the last listing are forgotten with it
+            self._names[dirpath] = names
+            for name in names.difference(listed):
+                yield os.path.join(dirpath, name)
+
+    def is_seen(self, path):
+        dirpath, name = os.path.split(path)
+        return name in self._names.get(dirpath, ())
+
+    def mark_seen(self, path):
+        dirpath, name = os.path.split(path)
+        self._names.setdefault(dirpath, set()).add(name)
+
+    def forget(self, path):
+        dirpath, name = os.path.split(path)
+        self._names.get(dirpath, set()).discard(name)
+
+    def new_files(self, force=False):
+        new_files = set(self._scan(force=force))
+        if len(new_files) > 0:
+            logger.info("Found {} new files".format(len(new_files)))
+        return new_files
+
+
+class InotifyFileReader(object):
+    """File reader driven by inotify events
+
+    Existing files are picked up with an initial directory scan, after that only
+    files that have been closed after writing or moved into the directory are
+    reported. If the kernel event queue overflows the directory is rescanned.
+    Files deleted or moved out of the directory are forgotten, so the names kept
+    are those of the files in it. Note that inotify does not see files written
+    by other hosts on network or FUSE mounts such as blobfuse, use
+    ScanFileReader there.
+    """
+
+    def __init__(self, path, settle_period=2.0):
+        import inotify_simple
+
+        self._flags = inotify_simple.flags
+        self._root, self._pattern = os.path.split(path)
+        self._scanner = ScanFileReader(path, settle_period=settle_period)
+        self._inotify = inotify_simple.INotify()
+        self._inotify.add_watch(
+            self._root,
+            self._flags.CLOSE_WRITE
+            | self._flags.MOVED_TO
+            | self._flags.DELETE
+            | self._flags.MOVED_FROM,
+        )
+        self._initialised = False
+
+    def new_files(self):
+        if not self._initialised:
+            self._initialised = True
+            return self._scanner.new_files(force=True)
+
+        new_files = set()
+        for event in self._inotify.read(timeout=0):
+            if event.mask & self._flags.Q_OVERFLOW:
+                logger.warning("Inotify event queue overflowed, rescanning")
+                new_files.update(self._scanner.new_files(force=True))
+                continue
+            if not fnmatch.fnmatch(event.name, self._pattern):
+                continue
+            filepath = os.path.join(self._root, event.name)
+            if event.mask & (self._flags.DELETE | self._flags.MOVED_FROM):
+                self._scanner.forget(filepath)
+                new_files.discard(filepath)
+                continue
+            if self._scanner.is_seen(filepath):
+                continue
+            self._scanner.mark_seen(filepath)
+            new_files.add(filepath)
+        if len(new_files) > 0:
+            logger.info("Found {} new files".format(len(new_files)))
+        return new_files
+
+    def close(self):
+        self._inotify.close()
+
+
+def create_file_reader(path, mode="scan", recursive=False):
+    """Creates a file reader for the glob pattern given in path
+
+    Args:
+        path: glob pattern such as /data/images/*.jpg
+        mode: one of glob, scan, inotify or auto. glob re-lists everything on each
+            poll, scan lists only changed directories and inotify uses kernel
+            events. auto uses inotify where it is available and falls back to
+            scan.
+        recursive: whether to look in subdirectories as well
+    """
+    if mode == "glob":
+        return FileReader(path, recursive=recursive)
+    if mode in ("inotify", "auto") and not recursive:
+        try:
+            return InotifyFileReader(path)
+        except (ImportError, OSError) as e:
+            if mode == "inotify":
+                raise
+            logger.info("Inotify not available ({}), falling back to scan".format(e))
+    elif mode == "inotify":
+        raise ValueError("Inotify file reader does not support recursive watching")
+    if mode not in ("scan", "auto", "inotify"):
+        raise ValueError("Unknown file reader mode {}".format(mode))
+    return ScanFileReader(path, recursive=recursive)
+
+
 class CountdownTimer(object):
     def __init__(self, duration=60):
         self._duration = duration
@@ -74,3 +263,13 @@ class CountdownTimer(object):
 
 def load_image(filepath):
     return pipe(filepath, pil_loader, np.array, _convert_to_bgr)
+
+
+def load_images(filepaths, min_size=None):
+    with measure("load") as sample:
+        img_list = [
+            _convert_to_bgr(img) for img in decode_batch(filepaths, min_size=min_size)
+        ]
+        sample.images = len(img_list)
+        sample.nbytes = sum(img.nbytes for img in img_list)
+    return img_list
@@ -0,0 +1,201 @@
+"""Batched annotation of Mask R-CNN predictions
+
+add_annotations draws each box, contour and label of an image with its own
+OpenCV call. annotate_batch gives the same annotations for a whole batch with
+far less work. Like add_annotations it prunes the detections with the
+prediction filter of the run before any mask is pasted. It then pastes the
+masks of every image of the batch in one vectorized pass into a label map per
+image, and draws boxes and contours with array operations. Only the class
+names are still drawn one at a time, with cv2.putText.
+
+Masks are pasted the way the Masker of maskrcnn_benchmark pastes them, so the
+instance shapes match those of add_annotations. Where instances overlap, the
+label map keeps the more confident one. The contour between them is therefore
+drawn once, in its color, instead of one contour being drawn over the other.
+"""
+import cv2
+import numpy as np
+import torch
+
+from maskrcnn.masks import paste_masks, pasted_masks
+from maskrcnn.model import (
+    CATEGORIES,
+    compute_colors_for_labels,
+    select_top_predictions,
+)
+
+def _ranges(starts, lengths):
+    """Concatenation of arange(start, start + length) for each start and length"""
+    offsets = torch.repeat_interleave(torch.cumsum(lengths, 0) - lengths, lengths)
+    return torch.repeat_interleave(starts, lengths) + (
+        torch.arange(int(lengths.sum())) - offsets
+    )
+
+
+_NEIGHBOURS = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+# cv2.drawContours with a thickness of 3 covers the pixels within two pixels of
+# a contour pixel, as OpenCV rounds the radius of thick lines up to
+# (thickness + 1) // 2
+_CONTOUR_WIDTH = np.array(
+    [[dy * dy + dx * dx <= 4 for dx in range(-2, 3)] for dy in range(-2, 3)],
+    dtype=np.uint8,
+)
+
+
+def _contours(label_map):
+    """Label map of the contours of the instances of label_map drawn 3 pixels
+    wide, like the contours cv2.drawContours draws with a thickness of 3"""
+    # 16 bit labels so OpenCV morphology applies, counted from 0 so pixels
+    # without an instance wrap around to the top value
+    labels = label_map.astype(np.uint16)
+    labels -= 1
+    empty = np.iinfo(np.uint16).max
+    border = {"borderType": cv2.BORDER_CONSTANT, "borderValue": int(empty)}
+    # a pixel is on a contour when its neighbours are not all of its instance
+    boundary = cv2.erode(labels, _NEIGHBOURS, **border) != cv2.dilate(
+        labels, _NEIGHBOURS, **border
+    )
+    np.putmask(labels, ~boundary, empty)
+    # labels count up as confidence falls so the most confident instance wins
+    thick = cv2.erode(labels, _CONTOUR_WIDTH, **border)
+    thick += 1
+    return thick
+
+
+def _draw_boxes(image, boxes, colors):
+    """Draws one pixel wide rectangles like cv2.rectangle"""
+    height, width = image.shape[:2]
+    boxes = torch.as_tensor(boxes).to(torch.int64)
+    x_0, y_0, x_1, y_1 = boxes.unbind(1)
+    detections = torch.arange(len(boxes))
+    lines = []
+    # horizontal edges then vertical edges, clipped to the image
+    for row, start, stop in ((y_0, x_0, x_1), (y_1, x_0, x_1)):
+        start, stop = start.clamp(min=0), stop.clamp(max=width - 1)
+        lengths = ((stop - start + 1) * ((row >= 0) & (row < height))).clamp(min=0)
+        lines.append(
+            (
+                torch.repeat_interleave(row, lengths),
+                _ranges(start, lengths),
+                torch.repeat_interleave(detections, lengths),
+            )
+        )
+    for column, start, stop in ((x_0, y_0, y_1), (x_1, y_0, y_1)):
+        start, stop = start.clamp(min=0), stop.clamp(max=height - 1)
+        lengths = ((stop - start + 1) * ((column >= 0) & (column < width))).clamp(
+            min=0
+        )
+        lines.append(
+            (
+                _ranges(start, lengths),
+                torch.repeat_interleave(column, lengths),
+                torch.repeat_interleave(detections, lengths),
+            )
+        )
+    y, x, detection = (torch.cat(parts).numpy() for parts in zip(*lines))
+    image[y, x] = colors[detection]
+    return image
+
+
+def _draw_class_names(image, boxes, scores, labels):
+    template = "{}: {:.2f}"
+    for box, score, label in zip(boxes.tolist(), scores.tolist(), labels.tolist()):
+        cv2.putText(
+            image,
+            template.format(CATEGORIES[label], score),
+            (int(box[0]), int(box[1])),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.5,
+            (255, 255, 255),
+            1,
+        )
+    return image
+
+
+def select_detections(prediction, height, width, prediction_filter):
+    """Detections of prediction kept by prediction_filter in order of
+    confidence, with boxes scaled to the (height, width) of the original image"""
+    prediction = prediction_filter(prediction)
+    prediction_width, prediction_height = prediction.size
+    scale = torch.tensor(
+        [width / prediction_width, height / prediction_height] * 2,
+        dtype=prediction.bbox.dtype,
+    )
+    selected = {
+        "boxes": prediction.bbox * scale,
+        "scores": prediction.get_field("scores"),
+        "labels": prediction.get_field("labels"),
+    }
+    if prediction.has_field("mask"):
+        selected["masks"] = prediction.get_field("mask")
+    return selected
+
+
+def select_batch(predictions, sizes, prediction_filter=None, mask_on=True):
+    """Detections of each prediction kept by prediction_filter, as
+    select_detections selects them for the image of the matching (height,
+    width) of sizes, and their masks pasted by pasted_masks
+
+    The pasted masks are None if mask_on is False or a prediction has no masks.
+    annotate_selected and detections.selected_records both take the selection,
+    so a batch that is annotated and recorded selects and pastes it once.
+    """
+    if prediction_filter is None:
+        prediction_filter = select_top_predictions
+    selected = [
+        select_detections(prediction, height, width, prediction_filter)
+        for prediction, (height, width) in zip(predictions, sizes)
+    ]
+    pasted = None
+    if mask_on and all("masks" in detections for detections in selected):
+        pasted = pasted_masks(
+            [detections["masks"] for detections in selected],
+            [detections["boxes"] for detections in selected],
+            sizes,
+        )
+    return selected, pasted
+
+
+def annotate_selected(orig_images, selected, pasted):
+    """Draws the detections selected by select_batch on a copy of each of
+    orig_images, with mask contours if pasted holds their masks"""
+    sizes = [orig_image.shape[:2] for orig_image in orig_images]
+    if pasted is not None:
+        label_maps = paste_masks(
+            [detections["masks"] for detections in selected],
+            [detections["boxes"] for detections in selected],
+            sizes,
+            pasted=pasted,
+        )
+    results = []
+    for i, (orig_image, detections) in enumerate(zip(orig_images, selected)):
+        result = orig_image.copy()
+        if len(detections["scores"]) == 0:
+            results.append(result)
+            continue
+        colors = compute_colors_for_labels(detections["labels"])
+        result = _draw_boxes(result, detections["boxes"], colors)
+        if pasted is not None:
+            contours = _contours(label_maps[i])
+            drawn = np.flatnonzero(contours)
+            result.reshape(-1, 3)[drawn] = colors[contours.ravel()[drawn] - 1]
+        results.append(
+            _draw_class_names(
+                result, detections["boxes"], detections["scores"], detections["labels"]
+            )
+        )
+    return results
+
+
+def annotate_batch(orig_images, predictions, mask_on=True, prediction_filter=None):
+    """Draws the boxes, mask contours and class names of the detections kept by
+    prediction_filter on a copy of each of orig_images
+
+    See model.create_prediction_filter. By default the detections above a
+    confidence of 0.7 are kept.
+    """
+    sizes = [orig_image.shape[:2] for orig_image in orig_images]
+    selected, pasted = select_batch(
+        predictions, sizes, prediction_filter=prediction_filter, mask_on=mask_on
+    )
+    return annotate_selected(orig_images, selected, pasted)
@@ -0,0 +1,121 @@
+import logging
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class _TuningState(object):
+    def __init__(self, max_batch_size):
+        self.candidate = 1
+        self.max_batch_size = max_batch_size
+        self.durations = []
+        self.best_size = 1
+        self.best_throughput = 0
+        self.converged = False
+
+
+class BatchSizeTuner(object):
+    """Finds the batch size with the highest throughput under a memory ceiling
+
+    Batch sizes are tried in powers of two starting from one. Each candidate is
+    timed over a few batches and the search stops once throughput no longer
+    improves, the peak memory goes over memory_limit or the maximum batch size is
+    reached. A separate search is run for each key so that a change of input
+    resolution starts tuning again for that resolution.
+    """
+
+    def __init__(self, max_batch_size=32, memory_limit=None, trials=2, tolerance=0.05):
+        self._max_batch_size = max_batch_size
+        self._memory_limit = memory_limit
+        self._trials = trials
+        self._tolerance = tolerance
+        self._states = {}
+        self._lock = Lock()
+
+    def _state(self, key):
+        if key not in self._states:
+            logger.info("Tuning batch size for inputs of shape {}".format(key))
+            self._states[key] = _TuningState(self._max_batch_size)
+        return self._states[key]
+
+    def batch_size(self, key, available):
+        with self._lock:
+            state = self._state(key)
+            size = state.best_size if state.converged else state.candidate
+            return min(size, available)
+
+    def _converge(self, key, state, reason):
+        state.converged = True
+        logger.info(
+            "Batch size for inputs of shape {} set to {} | {:.2f} images/sec | "
+            "{}".format(key, state.best_size, state.best_throughput, reason)
+        )
+
+    def record(self, key, batch_size, duration, peak_memory=None):
+        with self._lock:
+            state = self._state(key)
+            if state.converged or batch_size != state.candidate:
+                return
+            if self._memory_limit and peak_memory and peak_memory > self._memory_limit:
+                self._converge(
+                    key,
+                    state,
+                    "batch size {} used {} bytes over the limit of {}".format(
+                        batch_size, peak_memory, self._memory_limit
+                    ),
+                )
+                return
+
+            state.durations.append(duration)
+            if len(state.durations) < self._trials:
+                return
+
+            throughput = batch_size / sorted(state.durations)[len(state.durations) // 2]
+            state.durations = []
+            logger.debug(
+                "Batch size {} for inputs of shape {}: {:.2f} images/sec".format(
+                    batch_size, key, throughput
+                )
+            )
+            if throughput < state.best_throughput * (1 + self._tolerance):
+                self._converge(
+                    key, state, "batch size {} was not faster".format(batch_size)
+                )
+                return
+
+            state.best_size = batch_size
+            state.best_throughput = throughput
+            if batch_size * 2 > state.max_batch_size:
+                self._converge(key, state, "reached maximum batch size")
+            else:
+                state.candidate = batch_size * 2
+
+    def out_of_memory(self, key, batch_size):
+        with self._lock:
+            state = self._state(key)
+            state.max_batch_size = max(1, batch_size // 2)
+            state.best_size = min(state.best_size, state.max_batch_size)
+            state.durations = []
+            self._converge(
+                key, state, "batch size {} ran out of memory".format(batch_size)
+            )
+
+
+_tuners = {}
+_tuners_lock = Lock()
+
+
+def get_tuner(max_batch_size=32, memory_limit=None):
+    """Returns the tuner of this worker process for max_batch_size and
+    memory_limit, creating it on first use
+
+    Runs with a different batch size or memory limit get a tuner of their own,
+    so the bounds of one run never cap the search of the next.
+    """
+    key = (max_batch_size, memory_limit)
+    with _tuners_lock:
+        if key not in _tuners:
+            _tuners[key] = BatchSizeTuner(
+                max_batch_size=max_batch_size, memory_limit=memory_limit
+            )
+        return _tuners[key]
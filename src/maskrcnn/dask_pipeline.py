@@ -1,21 +1,37 @@
 import logging
 import os
-from threading import Thread
-from time import sleep
+import shutil
+from collections import deque, OrderedDict
+from threading import Event, Thread
 from timeit import default_timer
 
 import dask
+import numpy as np
 from dask.distributed import as_completed, Client
 from maskrcnn_benchmark.config import cfg
 from toolz import curry
 
-from maskrcnn import CountdownTimer, FileReader, save_image, load_image
+from maskrcnn import CountdownTimer, create_file_reader, save_image, load_images
+from maskrcnn.annotate import annotate_batch, annotate_selected, select_batch
+from maskrcnn.detections import detection_records, selected_records, DetectionSink
+from maskrcnn.manifest import Manifest
+from maskrcnn.metrics import measure, nbytes, MetricsReporter, PipelineMetrics
+from maskrcnn.video import (
+    concat_segments,
+    probe,
+    read_frames,
+    segment_path,
+    segments,
+    SegmentWriter,
+)
 from maskrcnn.model import (
     score_batch,
-    add_annotations,
-    create_preprocessing,
+    score_batch_autotuned,
+    create_prediction_filter,
+    create_batch_preprocessing,
     load_model,
     clean_gpu_mem,
+    padded_input_size,
 )
 
 
@@ -24,61 +40,454 @@ def chunks(l, n):
         yield l[i:i + n]
 
 
+class BucketBatcher(object):
+    """Groups files into batches of images that share a bucket key
+
+    key_func maps a filepath to its bucket, for example the padded size of the
+    image read from the header, so that batches need little padding. Full
+    batches are released straight away, partial batches once their oldest file
+    has waited max_wait seconds. Without a key_func all files share one bucket
+    which is the same as chunking the files in the order they arrived.
+    """
+
+    def __init__(self, batch_size, key_func=None, max_wait=0):
+        self._batch_size = batch_size
+        self._key_func = key_func
+        self._max_wait = max_wait
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return sum(len(files) for _, files in self._buckets.values())
+
+    def _key(self, filepath):
+        if self._key_func is None:
+            return None
+        try:
+            return self._key_func(filepath)
+        except OSError as e:
+            # let the batch fail on the worker where the error is recorded
+            logger = logging.getLogger(__name__)
+            logger.warning("Could not read header of {}: {}".format(filepath, e))
+            return filepath
+
+    def add(self, filenames):
+        now = default_timer()
+        for filepath in filenames:
+            bucket = self._buckets.setdefault(self._key(filepath), (now, []))
+            bucket[1].append(filepath)
+
+    def batches(self, flush=False):
+        now = default_timer()
+        for key in list(self._buckets):
+            started, files = self._buckets.pop(key)
+            full = len(files) - len(files) % self._batch_size
+            for batch in chunks(files[:full], self._batch_size):
+                yield batch
+            files = files[full:]
+            if not files:
+                continue
+            if flush or now - started >= self._max_wait:
+                yield files
+            else:
+                self._buckets[key] = (started, files)
+
+
+# images of a bucket share their orientation and aspect ratio, and so their
+# size once preprocessing has resized them
+BUCKET_KEYS = {None: None, "aspect_ratio": padded_input_size}
+
+
+def output_file(output_folder, filepath):
+    return os.path.join(output_folder, os.path.split(filepath)[-1])
+
+
 @curry
 def write(output_folder, filename, img_array):
-    filename = os.path.split(filename)[-1]
-    outpath = os.path.join(output_folder, filename)
-    save_image(outpath, img_array)
-    return 1
+    """Writes img_array to output_folder and returns an (input, output, sha256)
+    record of it"""
+    outpath = output_file(output_folder, filename)
+    return filename, outpath, save_image(outpath, img_array)
 
 
-def loop_annotations(orig_image_list, prediction_list):
-    return [
-        add_annotations(orig_image, prediction)
-        for orig_image, prediction in zip(orig_image_list, prediction_list)
-    ]
+def loop_annotations(orig_image_list, prediction_list, prediction_filter=None):
+    with measure("annotate") as sample:
+        annotated = annotate_batch(
+            orig_image_list, prediction_list, prediction_filter=prediction_filter
+        )
+        sample.images, sample.nbytes = len(annotated), nbytes(annotated)
+    return annotated
+
+
+def annotate_and_record(
+    filenames, orig_image_list, prediction_list, prediction_filter=None
+):
+    """Annotated images and detection records of a batch, which select and
+    paste its detections once for both"""
+    with measure("annotate") as sample:
+        sizes = [orig_image.shape[:2] for orig_image in orig_image_list]
+        selected, pasted = select_batch(
+            prediction_list, sizes, prediction_filter=prediction_filter
+        )
+        annotated = annotate_selected(orig_image_list, selected, pasted)
+        sample.images, sample.nbytes = len(annotated), nbytes(annotated)
+    with measure("record") as sample:
+        records = selected_records(filenames, sizes, selected, pasted)
+        sample.images = len(filenames)
+        sample.nbytes = nbytes(list(records["columns"].values()))
+    return annotated, records
 
 
 @curry
 def loop_write(output_path, batch_list, results_list):
-    for batch, results in zip(batch_list, results_list):
-        write(output_path, batch, results)
-    return True
+    with measure("write") as sample:
+        records = [
+            write(output_path, batch, results)
+            for batch, results in zip(batch_list, results_list)
+        ]
+        sample.images = len(records)
+        sample.nbytes = sum(os.path.getsize(outpath) for _, outpath, _ in records)
+    return records
+
+
+def preprocess_images(preprocessing, img_list):
+    with measure("preprocess") as sample:
+        preprocessed = preprocessing(img_list)
+        sample.images, sample.nbytes = len(preprocessed), nbytes(preprocessed)
+        sample.padding_bytes = preprocessed.padding_nbytes
+    return preprocessed
+
+
+def _score_func(autotune, max_batch_size=32):
+    if autotune:
+        return curry(score_batch_autotuned, max_batch_size=max_batch_size)
+    return score_batch
+
+
+def _stage_resources(io_resources):
+    """Submit options of the I/O and compute stages of a batch"""
+    if not io_resources:
+        return {}, {}
+    return {"resources": {"io": 1}}, {"resources": {"compute": 1}}
+
+
+@curry
+def process_batch(
+    client,
+    style_model,
+    preprocessing,
+    output_path,
+    batch,
+    autotune=False,
+    max_batch_size=32,
+    min_size=None,
+    io_resources=False,
+    prediction_filter=None,
+    render=True,
+    records=False,
+):
+    """Submits the tasks of batch and returns a future of its (written, records)
+
+    written are the (input, output, sha256) records of the annotated images if
+    render is True, otherwise it is empty. records are the detection records of
+    the batch if records is True, otherwise None.
+    """
+    io, compute = _stage_resources(io_resources)
+    img_array_f = client.submit(load_images, batch, min_size=min_size, **io)
+    pre_img_array_f = client.submit(preprocess_images, preprocessing, img_array_f)
+    score_func = _score_func(autotune, max_batch_size)
+    styled_array_f = client.submit(
+        score_func, style_model, pre_img_array_f, **compute
+    )
+    written_f = []
+    records_f = None
+    if render and records:
+        outputs_f = client.submit(
+            annotate_and_record,
+            batch,
+            img_array_f,
+            styled_array_f,
+            prediction_filter=prediction_filter,
+            **compute,
+        )
+        results_f = client.submit(_first, outputs_f)
+        records_f = client.submit(_second, outputs_f)
+        written_f = client.submit(loop_write(output_path), batch, results_f, **io)
+    elif render:
+        results_f = client.submit(
+            loop_annotations,
+            img_array_f,
+            styled_array_f,
+            prediction_filter=prediction_filter,
+            **compute,
+        )
+        written_f = client.submit(loop_write(output_path), batch, results_f, **io)
+    elif records:
+        records_f = client.submit(
+            detection_records,
+            batch,
+            img_array_f,
+            styled_array_f,
+            prediction_filter=prediction_filter,
+            **compute,
+        )
+    return client.submit(_batch_outputs, written_f, records_f)
+
+
+def _batch_outputs(written, records):
+    return written, records
+
+
+def _first(pair):
+    return pair[0]
+
+
+def _second(pair):
+    return pair[1]
+
+
+def process_segment(
+    model,
+    preprocessing,
+    video_path,
+    info,
+    segment,
+    segment_folder,
+    batch_size=4,
+    crf=20,
+    autotune=False,
+    prediction_filter=None,
+):
+    """Annotates one (first frame, number of frames) segment of video_path and
+    encodes it to its own file in segment_folder, returning the file's path"""
+    first_frame, frames = segment
+    path = segment_path(segment_folder, first_frame)
+    score_func = _score_func(autotune, batch_size)
+    with SegmentWriter(
+        path, info["width"], info["height"], info["fps"], crf=crf
+    ) as writer:
+        for frame_batch in read_frames(
+            video_path, info, first_frame, frames, batch_size=batch_size
+        ):
+            # the model and annotations work on BGR images
+            img_list = [frame[:, :, [2, 1, 0]] for frame in frame_batch]
+            predictions = score_func(model, preprocess_images(preprocessing, img_list))
+            annotated = loop_annotations(
+                img_list, predictions, prediction_filter=prediction_filter
+            )
+            writer.write(np.stack(annotated)[:, :, :, [2, 1, 0]])
+    return path
+
+
+def _batch_nbytes(batch):
+    return sum(os.path.getsize(filepath) for filepath in batch)
+
+
+class BatchTracker(object):
+    """Keeps track of in-flight batches and retires them as they complete
+
+    Completed futures are drained from an as_completed queue so retiring a batch
+    is O(1) regardless of how many batches are in flight. Completed batches are
+    only counted in completed, so the state kept on the client does not grow
+    with the length of a run. Failed batches are kept in errors together with
+    their exception.
+
+    Batches are queued with enqueue and only submitted by submit_pending while
+    there are fewer than max_in_flight batches, or fewer than max_in_flight_bytes
+    of input files, in flight. A batch is always admitted when nothing is in
+    flight so a single oversized batch can not stall the pipeline.
+
+    If on_result is given it is called with the result of each batch that
+    completes successfully, the result is not kept afterwards.
+    """
+
+    def __init__(self, max_in_flight=None, max_in_flight_bytes=None, on_result=None):
+        self._completed = as_completed()
+        self._batches = {}
+        self._pending = deque()
+        self._ready = Event()
+        self._max_in_flight = max_in_flight
+        self._max_in_flight_bytes = max_in_flight_bytes
+        self._on_result = on_result
+        self.in_flight_bytes = 0
+        self.completed = 0
+        self.errors = []
+
+    def __len__(self):
+        return len(self._batches)
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    def enqueue(self, batch):
+        self._pending.append(batch)
+
+    def _has_capacity(self, nbytes):
+        if len(self._batches) == 0:
+            return True
+        if self._max_in_flight and len(self._batches) >= self._max_in_flight:
+            return False
+        if (
+            self._max_in_flight_bytes
+            and self.in_flight_bytes + nbytes > self._max_in_flight_bytes
+        ):
+            return False
+        return True
+
+    def submit_pending(self, processing_func):
+        """Submits queued batches while there is capacity. Returns the number of
+        batches submitted"""
+        submitted = 0
+        while self._pending:
+            batch = self._pending[0]
+            nbytes = _batch_nbytes(batch) if self._max_in_flight_bytes else 0
+            if not self._has_capacity(nbytes):
+                break
+            self._pending.popleft()
+            self.add(processing_func(batch), batch, nbytes=nbytes)
+            submitted += 1
+        return submitted
+
+    def add(self, future, batch, nbytes=0):
+        self._batches[future] = (batch, nbytes)
+        self.in_flight_bytes += nbytes
+        self._completed.add(future)
+        future.add_done_callback(lambda _: self._ready.set())
+
+    def _retire(self, future):
+        batch, nbytes = self._batches.pop(future)
+        self.in_flight_bytes -= nbytes
+        if future.status == "error":
+            exception = future.exception()
+            logger = logging.getLogger(__name__)
+            logger.error("Batch of {} failed: {}".format(len(batch), exception))
+            self.errors.append((batch, exception))
+        else:
+            self.completed += 1
+            if self._on_result is not None:
+                self._on_result(future.result())
+
+    def wait(self, timeout):
+        """Waits up to timeout seconds for a batch to complete and retires all
+        completed batches. Returns the number of batches retired"""
+        self._ready.wait(timeout)
+        self._ready.clear()
+        completed = self._completed.next_batch(block=False)
+        for future in completed:
+            self._retire(future)
+        return len(completed)
 
 
 @curry
-def process_batch(client, style_model, preprocessing, output_path, batch):
-    remote_batch_f = client.scatter(batch)
-    img_array_f = client.map(load_image, remote_batch_f)
-    pre_img_array_f = client.map(preprocessing, img_array_f)
-    styled_array_f = client.submit(score_batch, style_model, pre_img_array_f)
-    results_f = client.submit(loop_annotations, img_array_f, styled_array_f)
-    return client.submit(loop_write(output_path), batch, results_f)
+def _batch_completed(manifest, sink, outputs):
+    written, records = outputs
+    if manifest is not None and written:
+        # the detection files of the inputs are recorded once written
+        manifest.record(written, keep_pending=sink is not None)
+    if sink is not None and records is not None:
+        sink.write(records)
+
+
+@curry
+def _record_detections(manifest, detections_path, inputs):
+    manifest.record([(filename, detections_path, None) for filename in inputs])
+
+
+def _remove_completed(filenames, manifest, output_paths):
+    remaining = [
+        filename
+        for filename in filenames
+        if not manifest.is_complete(filename, output_paths(filename))
+    ]
+    if len(remaining) < len(filenames):
+        logger = logging.getLogger(__name__)
+        logger.info(
+            "Skipping {} files completed by a previous run".format(
+                len(filenames) - len(remaining)
+            )
+        )
+    return remaining
 
 
 def score_images(
-    processing_func, file_reader, batch_size=4, sleep_period=0.1, patience=60
+    processing_func,
+    file_reader,
+    batch_size=4,
+    sleep_period=0.1,
+    patience=60,
+    max_in_flight=None,
+    max_in_flight_bytes=None,
+    report_period=10,
+    bucket_key=None,
+    max_wait=0,
+    manifest=None,
+    output_paths=None,
+    sink=None,
 ):
+    """Processes the files found by file_reader in batches until no new files
+    have been found for patience seconds
+
+    processing_func returns a future of the (written, records) of a batch, see
+    process_batch. If a manifest is given files whose outputs, as given by
+    output_paths, it records as complete are skipped, and the written outputs
+    of each completed batch are recorded. If a sink is given the detection
+    records of each completed batch are written to it.
+    """
     logger = logging.getLogger(__name__)
     patience_timer = CountdownTimer(duration=patience)
-    all_res = []
+    report_timer = CountdownTimer(duration=report_period)
+    batcher = BucketBatcher(batch_size, key_func=bucket_key, max_wait=max_wait)
+    tracker = BatchTracker(
+        max_in_flight=max_in_flight,
+        max_in_flight_bytes=max_in_flight_bytes,
+        on_result=_batch_completed(manifest, sink),
+    )
     while True:
         new_files = file_reader.new_files()
         if len(new_files) > 0:
             patience_timer.reset()
-            new_res = list(map(processing_func, chunks(list(new_files), batch_size)))
-            all_res.extend(new_res)
+        if manifest is not None and len(new_files) > 0:
+            new_files = _remove_completed(new_files, manifest, output_paths)
+            manifest.add_pending(new_files)
+        if len(new_files) > 0:
+            batcher.add(sorted(new_files))
+        for batch in batcher.batches(flush=patience_timer.is_expired()):
+            tracker.enqueue(batch)
+        tracker.submit_pending(processing_func)
 
-        for res in all_res:
-            if res.done():
-                all_res.remove(res)
-        logger.debug("Batches remaining {}".format(len(all_res)))
+        # wakes up as soon as a batch completes rather than on the next tick
+        if tracker.wait(sleep_period) > 0:
+            logger.debug("Batches remaining {}".format(len(tracker)))
 
-        if patience_timer.is_expired() and len(all_res) == 0:
-            logger.info("Finished processing images")
+        if report_timer.is_expired() and (tracker.queue_depth > 0 or len(tracker) > 0):
+            report_timer.reset()
+            logger.info(
+                "Queue depth {} batches | {} batches in flight ({} bytes)".format(
+                    tracker.queue_depth, len(tracker), tracker.in_flight_bytes
+                )
+            )
+
+        if (
+            patience_timer.is_expired()
+            and len(batcher) == 0
+            and tracker.queue_depth == 0
+            and len(tracker) == 0
+        ):
+            logger.info(
+                "Finished processing images | {} batches failed".format(
+                    len(tracker.errors)
+                )
+            )
             break
+    return tracker
+
 
-        sleep(sleep_period)
+def _register_worker_plugin(client, plugin):
+    # register_worker_plugin was renamed to register_plugin in newer versions
+    register = getattr(client, "register_plugin", None)
+    if register is None:
+        return client.register_worker_plugin(plugin, name=plugin.name)
+    return register(plugin, name=plugin.name)
 
 
 def _distribute_model_to_workers(client, config):
@@ -95,8 +504,83 @@ def _distribute_model_to_workers(client, config):
 
 
 def run_maskrcnn_pipeline(
-    client, config_file, filepath, output_path, patience=60, batch_size=4
+    client,
+    config_file,
+    filepath,
+    output_path,
+    patience=60,
+    batch_size=4,
+    watch_mode="scan",
+    max_in_flight=None,
+    max_in_flight_bytes=None,
+    autotune=False,
+    decode_min_size=None,
+    manifest_path=None,
+    io_resources=False,
+    metrics_port=None,
+    metrics_path=None,
+    metrics_interval=30,
+    confidence_threshold=0.7,
+    classes=None,
+    exclude_classes=None,
+    top_k=None,
+    bucket_by=None,
+    max_wait=0,
+    render=True,
+    detections_path=None,
+    detections_format="parquet",
+    images_per_file=1000,
 ):
+    """Runs Mask-RCNN over the jpg files found in filepath
+
+    If autotune is True the workers score each batch in sub-batches whose size
+    they tune for throughput, batch_size is then the upper bound of that size.
+    If decode_min_size is given large JPEGs are downscaled while decoding as long
+    as their shortest side stays at least decode_min_size, so the annotated
+    images are written at that reduced size. Setting it to the test size of the
+    model, cfg.INPUT.MIN_SIZE_TEST, avoids decoding pixels that preprocessing
+    throws away.
+
+    If manifest_path is given every image written is recorded in a SQLite
+    manifest there, see Manifest. Rerunning with the same manifest skips the
+    inputs that are already complete, so an interrupted run resumes where it
+    stopped.
+
+    With io_resources=True images are loaded and written on the "io" resources
+    of the workers and scored and annotated on their "compute" resources, so
+    inference never waits behind slow storage. Every worker then needs both
+    resources, as dask_mpi.start gives them with io_threads.
+
+    The workers time the load, preprocess, infer, annotate, write and record
+    stages of every batch and a summary of each stage is logged at the end of
+    the run. If metrics_port is given the stage metrics are served in the
+    Prometheus text format at /metrics on that port during the run. If
+    metrics_path is given they are written there as JSON every metrics_interval
+    seconds. See MetricsReporter.
+
+    Only the detections scoring above confidence_threshold are annotated. If
+    classes is given only detections of those categories are annotated, and
+    detections of exclude_classes never are. Categories are given by name, such
+    as "person", or label id. If top_k is given at most the top_k most confident
+    detections of each image are annotated. Detections are pruned before their
+    masks are pasted, so pruning also saves the work of pasting them.
+
+    Images of a batch are padded to its largest height and width. With
+    bucket_by="aspect_ratio" files are batched with files of the same
+    orientation and aspect ratio, read from their headers, so that little of a
+    batch is padding. A partial batch is submitted once its oldest file has
+    waited max_wait seconds. The share of the preprocessed bytes that is padding
+    is reported with the metrics of the preprocess stage.
+
+    If detections_path is given the boxes, labels, scores and RLE encoded masks
+    of the detections are written to files of the folder detections_path, in
+    the detections_format "parquet" or "arrow", each covering images_per_file
+    images. See DetectionSink. With render=False no annotated images are drawn
+    or written, so a run that only needs the detections skips that work. The
+    manifest then records the inputs of each detection file once it is written.
+    """
+    if not render and detections_path is None:
+        raise ValueError("A run without rendering needs a detections_path")
     logger = logging.getLogger(__name__)
     logger.info("Running Mask-RCNN")
     logger.info(f"Loading config {config_file}")
@@ -106,22 +590,77 @@ def run_maskrcnn_pipeline(
 
     filepath = os.path.join(filepath, "*.jpg")
     logger.info("Reading files from {}".format(filepath))
-    file_reader = FileReader(filepath)
+    file_reader = create_file_reader(filepath, mode=watch_mode)
 
-    logger.info("Writing files to {}".format(output_path))
+    prediction_filter = create_prediction_filter(
+        confidence_threshold=confidence_threshold,
+        classes=classes,
+        exclude_classes=exclude_classes,
+        top_k=top_k,
+    )
+    if render:
+        logger.info("Writing files to {}".format(output_path))
     processing_func = process_batch(
-        client, maskrcnn_model, create_preprocessing(cfg), output_path
+        client,
+        maskrcnn_model,
+        create_batch_preprocessing(cfg),
+        output_path,
+        autotune=autotune,
+        max_batch_size=batch_size,
+        min_size=decode_min_size,
+        io_resources=io_resources,
+        prediction_filter=prediction_filter,
+        render=render,
+        records=detections_path is not None,
     )
 
+    manifest = Manifest(manifest_path) if manifest_path else None
+    sink = None
+    if detections_path is not None:
+        logger.info("Writing detections to {}".format(detections_path))
+        sink = DetectionSink(
+            detections_path,
+            file_format=detections_format,
+            images_per_file=images_per_file,
+            on_write=(
+                _record_detections(manifest, detections_path)
+                if manifest is not None
+                else None
+            ),
+        )
+
+    def output_paths(filename):
+        paths = [output_file(output_path, filename)] if render else []
+        return paths + ([detections_path] if sink is not None else [])
+
     load_thread = Thread(
         target=score_images,
         args=(processing_func, file_reader),
-        kwargs={"patience": patience, "batch_size": batch_size},
+        kwargs={
+            "patience": patience,
+            "batch_size": batch_size,
+            "max_in_flight": max_in_flight,
+            "max_in_flight_bytes": max_in_flight_bytes,
+            "bucket_key": BUCKET_KEYS[bucket_by],
+            "max_wait": max_wait,
+            "manifest": manifest,
+            "output_paths": output_paths,
+            "sink": sink,
+        },
     )
+    _register_worker_plugin(client, PipelineMetrics())
+    metrics = MetricsReporter(
+        client, port=metrics_port, path=metrics_path, interval=metrics_interval
+    ).start()
     start = default_timer()
     load_thread.start()
     load_thread.join()
     logger.info("Finished processing images in {}".format(default_timer() - start))
+    if sink is not None:
+        sink.close()
+    metrics.stop()
+    if manifest is not None:
+        manifest.close()
 
     # Delete model and clear GPU memory
     logger.info("Clearing model from GPU")
@@ -129,9 +668,151 @@ def run_maskrcnn_pipeline(
     client.run(clean_gpu_mem)
 
 
+def run_maskrcnn_video_pipeline(
+    client,
+    config_file,
+    video_path,
+    output_file,
+    segment_duration=10,
+    batch_size=4,
+    crf=20,
+    autotune=False,
+    confidence_threshold=0.7,
+    classes=None,
+    exclude_classes=None,
+    top_k=None,
+):
+    """Runs Mask-RCNN over the frames of video_path and writes the annotated
+    video to output_file
+
+    The video is split into segments of segment_duration seconds that the
+    workers decode, score, annotate and encode in parallel, frames never touch
+    the disk as images. The segments are then joined in order with the audio of
+    video_path. Detections are pruned as in run_maskrcnn_pipeline.
+    """
+    logger = logging.getLogger(__name__)
+    info = probe(video_path)
+    video_segments = segments(info["frames"], info["fps"], segment_duration)
+    logger.info(
+        "Running Mask-RCNN over {} | {} frames at {} fps in {} segments".format(
+            video_path, info["frames"], info["fps"], len(video_segments)
+        )
+    )
+    logger.info(f"Loading config {config_file}")
+    cfg.merge_from_file(config_file)
+    maskrcnn_model = _distribute_model_to_workers(client, cfg)
+    preprocessing = create_batch_preprocessing(cfg)
+    prediction_filter = create_prediction_filter(
+        confidence_threshold=confidence_threshold,
+        classes=classes,
+        exclude_classes=exclude_classes,
+        top_k=top_k,
+    )
+
+    segment_folder = output_file + ".segments"
+    os.makedirs(segment_folder, exist_ok=True)
+    start = default_timer()
+    segment_futures = [
+        client.submit(
+            process_segment,
+            maskrcnn_model,
+            preprocessing,
+            video_path,
+            info,
+            segment,
+            segment_folder,
+            batch_size=batch_size,
+            crf=crf,
+            autotune=autotune,
+            prediction_filter=prediction_filter,
+            pure=False,
+        )
+        for segment in video_segments
+    ]
+    for completed, future in enumerate(as_completed(segment_futures), 1):
+        logger.info(
+            "Encoded {} | {} of {} segments".format(
+                future.result(), completed, len(segment_futures)
+            )
+        )
+    # futures are in segment order so the sink joins them in order whatever
+    # order they completed in
+    concat_segments(
+        [future.result() for future in segment_futures],
+        output_file,
+        audio_source=video_path,
+    )
+    shutil.rmtree(segment_folder)
+    logger.info("Wrote {} in {} seconds".format(output_file, default_timer() - start))
+
+    logger.info("Clearing model from GPU")
+    del maskrcnn_model, segment_futures
+    client.run(clean_gpu_mem)
+
+
+@curry
+def start_video(
+    config_file,
+    video_path,
+    output_file,
+    scheduler_address,
+    segment_duration=10,
+    batch_size=4,
+    crf=20,
+    autotune=False,
+    confidence_threshold=0.7,
+    classes=None,
+    exclude_classes=None,
+    top_k=None,
+):
+    client = Client(scheduler_address)
+    logger = logging.getLogger(__name__)
+    logger.info(str(client))
+    run_maskrcnn_video_pipeline(
+        client,
+        config_file,
+        video_path,
+        output_file,
+        segment_duration=segment_duration,
+        batch_size=batch_size,
+        crf=crf,
+        autotune=autotune,
+        confidence_threshold=confidence_threshold,
+        classes=classes,
+        exclude_classes=exclude_classes,
+        top_k=top_k,
+    )
+    client.close()
+
+
 @curry
 def start(
-    config_file, filepath, output_path, scheduler_address, patience=60, batch_size=4
+    config_file,
+    filepath,
+    output_path,
+    scheduler_address,
+    patience=60,
+    batch_size=4,
+    watch_mode="scan",
+    max_in_flight=None,
+    max_in_flight_bytes=None,
+    autotune=False,
+    decode_min_size=None,
+    manifest_path=None,
+    io_resources=False,
+    metrics_port=None,
+    metrics_path=None,
+    metrics_interval=30,
+    confidence_threshold=0.7,
+    classes=None,
+    exclude_classes=None,
+    top_k=None,
+    bucket_by=None,
+    max_wait=0,
+    render=True,
+    detections_path=None,
+    detections_format="parquet",
+    images_per_file=1000,
 ):
     client = Client(scheduler_address)
     logger = logging.getLogger(__name__)
@@ -143,5 +824,25 @@ def start(
         output_path,
         patience=patience,
         batch_size=batch_size,
+        watch_mode=watch_mode,
+        max_in_flight=max_in_flight,
+        max_in_flight_bytes=max_in_flight_bytes,
+        autotune=autotune,
+        decode_min_size=decode_min_size,
+        manifest_path=manifest_path,
+        io_resources=io_resources,
+        metrics_port=metrics_port,
+        metrics_path=metrics_path,
+        metrics_interval=metrics_interval,
+        confidence_threshold=confidence_threshold,
+        classes=classes,
+        exclude_classes=exclude_classes,
+        top_k=top_k,
+        bucket_by=bucket_by,
+        max_wait=max_wait,
+        render=render,
+        detections_path=detections_path,
+        detections_format=detections_format,
+        images_per_file=images_per_file,
     )
     client.close()
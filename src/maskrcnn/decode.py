@@ -0,0 +1,50 @@
+"""Thread pool for decoding batches of images on a worker
+
+PIL releases the GIL while decoding so the images of a batch are decoded
+concurrently. When min_size is given JPEGs are decoded with draft which lets the
+decoder downscale in the DCT domain by 1/2, 1/4 or 1/8 as long as the shortest
+side stays at least min_size.
+"""
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import numpy as np
+from PIL import Image
+from toolz import curry
+
+_pool = None
+_pool_lock = Lock()
+
+
+def _get_pool(max_workers=None):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            max_workers = max_workers or min(8, os.cpu_count() or 1)
+            _pool = ThreadPoolExecutor(max_workers=max_workers)
+        return _pool
+
+
+def _draft_size(size, min_size):
+    scale = min_size / min(size)
+    return tuple(int(math.ceil(dim * scale)) for dim in size)
+
+
+@curry
+def decode_image(path, min_size=None):
+    """Decodes the image in path into an RGB HWC uint8 array"""
+    # open path as file to avoid ResourceWarning (https://github.com/python-pillow/Pillow/issues/835)
+    with open(path, "rb") as f:
+        img = Image.open(f)
+        if min_size is not None and min(img.size) > min_size:
+            img.draft("RGB", _draft_size(img.size, min_size))
+        return np.array(img.convert("RGB"))
+
+
+def decode_batch(paths, min_size=None):
+    """Decodes paths concurrently, returning the arrays in the same order"""
+    if len(paths) == 1:
+        return [decode_image(paths[0], min_size=min_size)]
+    return list(_get_pool().map(decode_image(min_size=min_size), paths))
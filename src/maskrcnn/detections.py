@@ -0,0 +1,193 @@
+"""Detections of the Mask R-CNN pipeline as columnar records
+
+detection_records turns the predictions of a batch into columns with a row for
+each detection kept by the prediction filter of the run: its input file, the
+height and width of that image, and the detection's rank by confidence, label,
+category, score, box and mask. Boxes are xyxy in the pixels of the input image.
+Masks are the uncompressed RLE of COCO, see masks.encode_masks, and decode
+with masks.decode_mask. Images without detections have no rows.
+
+DetectionSink collects the records of completed batches on the client and
+writes them to Parquet or Arrow IPC files. It needs pyarrow, which is only
+imported when a sink is created.
+"""
+import logging
+import os
+import time
+
+import numpy as np
+
+from maskrcnn.annotate import select_batch
+from maskrcnn.masks import encode_masks
+from maskrcnn.metrics import measure, nbytes
+from maskrcnn.model import CATEGORIES
+
+logger = logging.getLogger(__name__)
+
+FILE_EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def selected_records(filenames, sizes, selected, pasted):
+    """Columns of the detections selected by annotate.select_batch for the
+    images of filenames, whose (height, width) are in sizes, with the RLE of
+    their masks if pasted holds them"""
+    counts = [len(detections["scores"]) for detections in selected]
+    boxes = np.concatenate(
+        [detections["boxes"].numpy() for detections in selected]
+    ).reshape(-1, 4)
+    labels = np.concatenate([detections["labels"].numpy() for detections in selected])
+    columns = {
+        "input": np.repeat(filenames, counts).astype(object),
+        "image_height": np.repeat([height for height, _ in sizes], counts),
+        "image_width": np.repeat([width for _, width in sizes], counts),
+        "rank": np.concatenate([np.arange(count) for count in counts]),
+        "label": labels,
+        "category": np.array(CATEGORIES, dtype=object)[labels],
+        "score": np.concatenate(
+            [detections["scores"].numpy() for detections in selected]
+        ),
+        "x0": boxes[:, 0],
+        "y0": boxes[:, 1],
+        "x1": boxes[:, 2],
+        "y1": boxes[:, 3],
+    }
+    if pasted is not None:
+        columns["mask"] = [
+            mask
+            for image_masks in encode_masks(
+                [detections["masks"] for detections in selected],
+                [detections["boxes"] for detections in selected],
+                sizes,
+                pasted=pasted,
+            )
+            for mask in image_masks
+        ]
+    return {"inputs": list(filenames), "columns": columns}
+
+
+def detection_records(filenames, orig_images, predictions, prediction_filter=None):
+    """Columns of the detections of predictions made for the images of
+    filenames, which orig_images holds
+
+    Returns a dict with the inputs of the batch and the columns of its
+    detections as arrays.
+    """
+    with measure("record") as sample:
+        sizes = [orig_image.shape[:2] for orig_image in orig_images]
+        selected, pasted = select_batch(
+            predictions, sizes, prediction_filter=prediction_filter
+        )
+        records = selected_records(filenames, sizes, selected, pasted)
+        sample.images = len(filenames)
+        sample.nbytes = nbytes(list(records["columns"].values()))
+    return records
+
+
+def _schema(pa):
+    return pa.schema(
+        [
+            ("input", pa.string()),
+            ("image_height", pa.int32()),
+            ("image_width", pa.int32()),
+            ("rank", pa.int32()),
+            ("label", pa.int16()),
+            ("category", pa.string()),
+            ("score", pa.float32()),
+            ("x0", pa.float32()),
+            ("y0", pa.float32()),
+            ("x1", pa.float32()),
+            ("y1", pa.float32()),
+            ("mask", pa.list_(pa.int32())),
+        ]
+    )
+
+
+class DetectionSink(object):
+    """Writes detection records to columnar files in folder
+
+    Records are buffered and written to a new file once they cover
+    images_per_file images, and once more on close. Each file is a complete
+    Parquet file, or Arrow IPC file with file_format="arrow", written under a
+    temporary name and renamed so readers never see a partial file. The folder
+    can be read as one dataset, for example with pyarrow.dataset.
+
+    If on_write is given it is called with the inputs of each file once the
+    file is written, for example to record them in a Manifest.
+    """
+
+    def __init__(
+        self, folder, file_format="parquet", images_per_file=1000, on_write=None
+    ):
+        import pyarrow
+
+        if file_format not in FILE_EXTENSIONS:
+            raise ValueError("Unknown detection file format {}".format(file_format))
+        self._pa = pyarrow
+        self._schema = _schema(pyarrow)
+        self._folder = folder
+        self._file_format = file_format
+        self._images_per_file = images_per_file
+        self._on_write = on_write
+        # files of earlier runs into the same folder are kept
+        self._prefix = "detections-{}-{}".format(
+            time.strftime("%Y%m%d-%H%M%S"), os.getpid()
+        )
+        self._files = 0
+        self._inputs = []
+        self._tables = []
+        os.makedirs(folder, exist_ok=True)
+
+    def write(self, records):
+        self._inputs.extend(records["inputs"])
+        self._tables.append(self._table(records["columns"]))
+        if len(self._inputs) >= self._images_per_file:
+            self.flush()
+
+    def _table(self, columns):
+        arrays = []
+        for field in self._schema:
+            column = columns.get(field.name)
+            if column is None:
+                arrays.append(self._pa.nulls(len(columns["input"]), field.type))
+            else:
+                arrays.append(self._pa.array(column, type=field.type))
+        return self._pa.Table.from_arrays(arrays, schema=self._schema)
+
+    def _write_table(self, table, path):
+        if self._file_format == "parquet":
+            import pyarrow.parquet as pq
+
+            pq.write_table(table, path)
+        else:
+            with self._pa.OSFile(path, "wb") as sink:
+                with self._pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+
+    def flush(self):
+        """Writes the buffered records to a new file and returns its path"""
+        if not self._inputs:
+            return None
+        table = self._pa.concat_tables(self._tables)
+        path = os.path.join(
+            self._folder,
+            "{}-{:05d}{}".format(
+                self._prefix, self._files, FILE_EXTENSIONS[self._file_format]
+            ),
+        )
+        tmp_path = path + ".tmp"
+        self._write_table(table.combine_chunks(), tmp_path)
+        os.replace(tmp_path, path)
+        logger.info(
+            "Wrote {} detections of {} images to {}".format(
+                table.num_rows, len(self._inputs), path
+            )
+        )
+        inputs = self._inputs
+        self._files += 1
+        self._inputs, self._tables = [], []
+        if self._on_write is not None:
+            self._on_write(inputs)
+        return path
+
+    def close(self):
+        return self.flush()
@@ -0,0 +1,137 @@
+"""Durable record of the inputs a pipeline has completed
+
+The manifest is a SQLite database with a row for every output written. Each row
+holds the input the output was made from, with that input's size and
+modification time, and the SHA-256 of the output. The rows of a batch are
+committed as soon as the batch completes. A restarted run can therefore skip
+inputs that have every output recorded and present and have not changed since,
+instead of processing the whole backlog again.
+"""
+import logging
+import os
+import sqlite3
+import time
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    input TEXT NOT NULL,
+    output TEXT NOT NULL,
+    input_size INTEGER NOT NULL,
+    input_mtime_ns INTEGER NOT NULL,
+    sha256 TEXT,
+    completed_at REAL NOT NULL,
+    PRIMARY KEY (input, output)
+)
+"""
+
+
+class Manifest(object):
+    """Completed inputs of a pipeline kept in the SQLite database at path
+
+    The recorded outputs are also held in memory, so checking whether an input
+    is complete only costs a stat of inputs that appear in the manifest and of
+    their outputs.
+
+    The version of an input is taken by add_pending when it is queued, before
+    it is read, so an input modified during the run is processed again by the
+    next one.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(_SCHEMA)
+        self._completed = {}
+        self._pending = {}
+        rows = self._connection.execute(
+            "SELECT input, output, input_size, input_mtime_ns FROM outputs"
+        )
+        for input_path, output_path, size, mtime_ns in rows:
+            self._completed.setdefault(input_path, {})[output_path] = (size, mtime_ns)
+        logger.info(
+            "Manifest {} has {} completed inputs".format(path, len(self._completed))
+        )
+
+    def __len__(self):
+        return len(self._completed)
+
+    def is_complete(self, input_path, output_paths):
+        """True if every one of output_paths was recorded for the current
+        version of input_path"""
+        recorded = self._completed.get(input_path)
+        if not recorded:
+            return False
+        try:
+            stat = os.stat(input_path)
+        except OSError:
+            return False
+        version = (stat.st_size, stat.st_mtime_ns)
+        return all(
+            recorded.get(output_path) == version and os.path.exists(output_path)
+            for output_path in output_paths
+        )
+
+    def add_pending(self, input_paths):
+        """Takes the version of each of input_paths before it is read, which
+        record then stores with its outputs"""
+        for input_path in input_paths:
+            try:
+                stat = os.stat(input_path)
+            except OSError:
+                continue
+            self._pending[input_path] = (stat.st_size, stat.st_mtime_ns)
+
+    def _version(self, input_path):
+        version = self._pending.get(input_path)
+        if version is not None:
+            return version
+        try:
+            stat = os.stat(input_path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def record(self, records, keep_pending=False):
+        """Records (input, output, sha256) tuples and commits them
+
+        The versions add_pending took of the inputs are dropped once they are
+        recorded, unless keep_pending is True because more of their outputs
+        are recorded later. Inputs without a pending version are recorded at
+        their current version, and skipped if they no longer exist.
+        """
+        rows = []
+        completed_at = time.time()
+        for input_path, output_path, sha256 in records:
+            version = self._version(input_path)
+            if version is None:
+                logger.warning(
+                    "Not recording {}, its input {} no longer exists".format(
+                        output_path, input_path
+                    )
+                )
+                continue
+            size, mtime_ns = version
+            rows.append(
+                (input_path, output_path, size, mtime_ns, sha256, completed_at)
+            )
+        if not keep_pending:
+            for input_path, _, _ in records:
+                self._pending.pop(input_path, None)
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            for input_path, output_path, size, mtime_ns, _, _ in rows:
+                self._completed.setdefault(input_path, {})[output_path] = (
+                    size,
+                    mtime_ns,
+                )
+        return len(rows)
+
+    def close(self):
+        self._connection.close()
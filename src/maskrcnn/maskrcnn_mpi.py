@@ -12,23 +12,89 @@ def run(
     memory_limit="auto",
     patience=60,
     batch_size=4,
+    watch_mode="scan",
+    max_in_flight=None,
+    max_in_flight_bytes=None,
+    autotune=False,
+    decode_min_size=None,
+    manifest_path=None,
+    segment_duration=10,
+    crf=20,
+    io_threads=0,
+    metrics_port=None,
+    metrics_path=None,
+    metrics_interval=30,
+    confidence_threshold=0.7,
+    classes=None,
+    exclude_classes=None,
+    top_k=None,
+    bucket_by=None,
+    max_wait=0,
+    render=True,
+    detections_path=None,
+    detections_format="parquet",
+    images_per_file=1000,
 ):
     logging.config.fileConfig(os.getenv("LOG_CONFIG", "logging.ini"))
 
     from maskrcnn import dask_mpi
     from maskrcnn import dask_pipeline
+    from maskrcnn.video import is_video
 
     logger = logging.getLogger(__name__)
     logger.debug(os.environ)
 
     os.makedirs(output_path, exist_ok=True)
 
+    if is_video(filepath):
+        # a video is streamed to a video of the same name in output_path
+        pipeline = dask_pipeline.start_video(
+            config_file,
+            filepath,
+            os.path.join(output_path, os.path.basename(filepath)),
+            segment_duration=segment_duration,
+            batch_size=batch_size,
+            crf=crf,
+            autotune=autotune,
+            confidence_threshold=confidence_threshold,
+            classes=classes,
+            exclude_classes=exclude_classes,
+            top_k=top_k,
+        )
+    else:
+        pipeline = dask_pipeline.start(
+            config_file,
+            filepath,
+            output_path,
+            patience=patience,
+            batch_size=batch_size,
+            watch_mode=watch_mode,
+            max_in_flight=max_in_flight,
+            max_in_flight_bytes=max_in_flight_bytes,
+            autotune=autotune,
+            decode_min_size=decode_min_size,
+            manifest_path=manifest_path,
+            io_resources=io_threads > 0,
+            metrics_port=metrics_port,
+            metrics_path=metrics_path,
+            metrics_interval=metrics_interval,
+            confidence_threshold=confidence_threshold,
+            classes=classes,
+            exclude_classes=exclude_classes,
+            top_k=top_k,
+            bucket_by=bucket_by,
+            max_wait=max_wait,
+            render=render,
+            detections_path=detections_path,
+            detections_format=detections_format,
+            images_per_file=images_per_file,
+        )
+
     dask_mpi.start(
-        dask_pipeline.start(
-            config_file, filepath, output_path, patience=patience, batch_size=batch_size
-        ),
+        pipeline,
         cores_per_worker=cores_per_worker,
         memory_limit=memory_limit,
+        io_threads=io_threads,
     )
 
 
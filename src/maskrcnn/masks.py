@@ -0,0 +1,219 @@
+"""Pasting and run length encoding of Mask R-CNN masks
+
+The Masker of maskrcnn_benchmark resizes and pastes the mask of each detection
+into its own full image tensor. paste_masks pastes the masks of a whole batch
+the same way into one label map per image, and encode_masks encodes each of
+them in the uncompressed RLE of COCO without a full image mask per detection.
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# pixels resized at once by paste_masks, which bounds its temporary tensors to
+# about a hundred MB
+MAX_PASTE_PIXELS = 2 ** 22
+
+
+def _expand_boxes(boxes, scale):
+    half_size = (boxes[:, 2:] - boxes[:, :2]) * 0.5 * scale
+    center = (boxes[:, 2:] + boxes[:, :2]) * 0.5
+    return torch.cat([center - half_size, center + half_size], dim=1)
+
+
+def _interpolation_matrices(starts, stops, box_starts, box_lengths, size):
+    """Bilinear interpolation weights along one axis from the size samples of
+    each mask to the pixels from start to stop of its image, as n x L x size
+    matrices padded with zero rows to the longest range L
+
+    Source coordinates are those of F.interpolate with align_corners=False,
+    resizing the mask to its box as Masker does.
+    """
+    pixel = starts[:, None] + torch.arange(int((stops - starts).max()))[None, :]
+    source = (
+        (pixel - box_starts[:, None]).float() + 0.5
+    ) * (size / box_lengths[:, None].float()) - 0.5
+    # padding pixels past stop get zero weights, clamping keeps them in range
+    source = source.clamp(0, size - 1)
+    low = source.long()
+    high = (low + 1).clamp(max=size - 1)
+    weight = (source - low.float()) * (pixel < stops[:, None])
+    low_weight = (1 - weight) * (pixel < stops[:, None])
+    matrices = torch.zeros(pixel.shape + (size,))
+    matrices.scatter_add_(2, low[..., None], low_weight[..., None])
+    matrices.scatter_add_(2, high[..., None], weight[..., None])
+    return matrices
+
+
+def pasted_masks(masks, boxes, image_sizes, threshold=0.5, padding=1):
+    """Masks of a batch pasted into their images
+
+    Takes the arguments of paste_masks and returns a (detection, y, x, mask)
+    tuple for each detection of the batch, where mask is a boolean array of the
+    pixels above threshold of the region of its image starting at (y, x). The
+    masks are views of the resized masks of their chunk.
+    """
+    counts = torch.tensor(
+        [len(image_masks) for image_masks in masks], dtype=torch.int64
+    )
+    if counts.sum() == 0:
+        return []
+    sizes = torch.tensor(image_sizes, dtype=torch.int64).reshape(-1, 2)
+    masks = torch.cat(masks).float()
+    size = masks.shape[-1] + 2 * padding
+    masks = F.pad(masks[:, 0], [padding] * 4)
+    # the box grows with the padding so the mask keeps its scale
+    scale = size / (size - 2 * padding)
+    boxes = _expand_boxes(torch.cat(boxes).float(), scale)
+    boxes = boxes.to(torch.int32).long()
+    box_sizes = (boxes[:, 2:] - boxes[:, :2] + 1).clamp(min=1)
+    image = torch.repeat_interleave(torch.arange(len(counts)), counts)
+    # the pixels of each box that lie within its image
+    starts = boxes[:, :2].clamp(min=0)
+    stops = torch.max(torch.min(boxes[:, 2:] + 1, sizes[image].flip(1)), starts)
+    # detections of similar size share chunks so little of the padded matrices
+    # is wasted
+    order = torch.argsort((stops - starts).prod(1))
+    extents = (stops - starts)[order].tolist()
+    corners = starts[order].tolist()
+    pasted = []
+    start = 0
+    while start < len(order):
+        height, width = extents[start]
+        stop = start + 1
+        while stop < len(order):
+            height = max(height, extents[stop][0])
+            width = max(width, extents[stop][1])
+            if (stop + 1 - start) * height * width > MAX_PASTE_PIXELS:
+                break
+            stop += 1
+        chunk = order[start:stop]
+        x_0, y_0 = starts[chunk].unbind(1)
+        rows = _interpolation_matrices(
+            y_0, stops[chunk, 1], boxes[chunk, 1], box_sizes[chunk, 1], size
+        )
+        columns = _interpolation_matrices(
+            x_0, stops[chunk, 0], boxes[chunk, 0], box_sizes[chunk, 0], size
+        )
+        values = torch.bmm(torch.bmm(rows, masks[chunk]), columns.transpose(1, 2))
+        above = (values > threshold).numpy()
+        for i, detection in enumerate(chunk.tolist()):
+            (x, y), (width, height) = corners[start + i], extents[start + i]
+            pasted.append((detection, y, x, above[i, :height, :width]))
+        start = stop
+    return pasted
+
+
+def paste_masks(masks, boxes, image_sizes, threshold=0.5, padding=1, pasted=None):
+    """Pastes the mask probabilities of the detections of a batch into a label
+    map for each image
+
+    masks and boxes hold an N x 1 x M x M tensor and an N x 4 xyxy tensor for
+    each image, with boxes in the coordinates of the (height, width) in
+    image_sizes. The detections of each image are expected in order of
+    confidence. Returns an int32 label map for each image that is 0 where no
+    mask is above threshold and i + 1 where detection i is the most confident
+    one above it.
+
+    Bilinear resizing is separable, so every mask of a chunk of detections of
+    similar size is resized to its box with two batched matrix products. Each
+    mask is then written into the region of its box. If pasted is given, as
+    pasted_masks returns it for the same arguments, the masks are not pasted
+    again.
+    """
+    label_maps = [np.zeros(image_size, dtype=np.int32) for image_size in image_sizes]
+    image_detections = [
+        (i, label)
+        for i, image_masks in enumerate(masks)
+        for label in range(1, len(image_masks) + 1)
+    ]
+    if pasted is None:
+        pasted = pasted_masks(
+            masks, boxes, image_sizes, threshold=threshold, padding=padding
+        )
+    # the most confident detection is written last so it ends up on top
+    for detection, y, x, mask in sorted(pasted, reverse=True):
+        i, label = image_detections[detection]
+        height, width = mask.shape
+        label_maps[i][y : y + height, x : x + width][mask] = label
+    return label_maps
+
+
+def encode_masks(masks, boxes, image_sizes, threshold=0.5, padding=1, pasted=None):
+    """Pastes the masks of the detections of a batch like paste_masks and run
+    length encodes each of them on its own
+
+    Returns a list for each image with the counts of each of its detections in
+    the uncompressed RLE of COCO. The pixels of the image are taken column by
+    column, and counts alternate between runs outside and inside the mask,
+    starting with a run outside it that may be empty. pasted is taken as by
+    paste_masks.
+    """
+    counts = torch.tensor(
+        [len(image_masks) for image_masks in masks], dtype=torch.int64
+    )
+    sizes = torch.tensor(image_sizes, dtype=torch.int64).reshape(-1, 2)
+    image = torch.repeat_interleave(torch.arange(len(counts)), counts)
+    heights = sizes[image, 0].tolist()
+    areas = (sizes[:, 0] * sizes[:, 1])[image]
+    if pasted is None:
+        pasted = pasted_masks(
+            masks, boxes, image_sizes, threshold=threshold, padding=padding
+        )
+    detections, positions = [], []
+    for detection, y, x, mask in pasted:
+        # column by column, as the pixels of the image are taken
+        column, row = np.nonzero(mask.T)
+        position = (x + column) * heights[detection] + y + row
+        detections.append(np.full(len(position), detection))
+        positions.append(position)
+    if positions:
+        detection = torch.from_numpy(np.concatenate(detections))
+        position = torch.from_numpy(np.concatenate(positions))
+    else:
+        detection = position = torch.zeros(0, dtype=torch.int64)
+    # sorted by detection then position, so runs are the sequences of
+    # consecutive positions within a detection
+    order = torch.argsort(detection * int(areas.max() if len(areas) else 0) + position)
+    detection, position = detection[order], position[order]
+    run_start = torch.ones(len(position), dtype=torch.bool)
+    run_start[1:] = (position[1:] != position[:-1] + 1) | (
+        detection[1:] != detection[:-1]
+    )
+    starts = torch.nonzero(run_start).squeeze(1)
+    lengths = torch.cat([starts[1:], torch.tensor([len(position)])]) - starts
+    run_detection = detection[starts]
+    run_position = position[starts]
+    run_end = run_position + lengths
+    # each run is preceded by the pixels since the end of the previous run of
+    # its detection, or since the first pixel for the first run
+    first_run = torch.ones(len(starts), dtype=torch.bool)
+    first_run[1:] = run_detection[1:] != run_detection[:-1]
+    previous_end = torch.zeros(len(starts), dtype=torch.int64)
+    previous_end[1:] = run_end[:-1]
+    previous_end[first_run] = 0
+    gaps = run_position - previous_end
+    runs = torch.stack([gaps, lengths], dim=1).reshape(-1).numpy()
+    run_counts = torch.bincount(run_detection, minlength=len(image))
+    # the runs of a detection are in order so its last one ends last
+    last_run = torch.cumsum(run_counts, 0) - 1
+    with_runs = run_counts > 0
+    last_end = torch.zeros(len(image), dtype=torch.int64)
+    last_end[with_runs] = run_end[last_run[with_runs]]
+    tails = (areas - last_end).tolist()
+    detection_runs = np.split(runs, (2 * torch.cumsum(run_counts, 0))[:-1].numpy())
+    encoded = [
+        np.append(detection_run, [tail] if tail else []).astype(np.int32)
+        for detection_run, tail in zip(detection_runs, tails)
+    ]
+    return [
+        encoded[first : first + count]
+        for first, count in zip(
+            (torch.cumsum(counts, 0) - counts).tolist(), counts.tolist()
+        )
+    ]
+
+
+def decode_mask(counts, height, width):
+    """Binary height x width mask from its counts as encode_masks returns them"""
+    values = np.arange(len(counts)) % 2
+    return np.repeat(values, counts).astype(np.uint8).reshape(width, height).T
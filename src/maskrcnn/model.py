@@ -1,12 +1,29 @@
+import inspect
+import math
+from timeit import default_timer
+
 from torchvision import transforms as T
 from maskrcnn_benchmark.modeling.roi_heads.mask_head.inference import Masker
 import cv2
 from maskrcnn_benchmark.utils import cv2_util
 
-from maskrcnn_benchmark.structures.image_list import to_image_list
+from maskrcnn_benchmark.structures.image_list import ImageList, to_image_list
 from maskrcnn_benchmark.utils.checkpoint import DetectronCheckpointer
 from maskrcnn_benchmark.modeling.detector import build_detection_model
+import numpy as np
 import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from maskrcnn import image_size
+from maskrcnn.autotune import get_tuner
+from maskrcnn.metrics import measured
+
+# F.interpolate antialiases from torch 1.11, older versions resize through PIL
+_INTERPOLATE_ANTIALIAS = "antialias" in inspect.signature(F.interpolate).parameters
+
+# Fraction of the device or worker memory the autotuner may use
+AUTOTUNE_MEMORY_FRACTION = 0.8
 
 CATEGORIES = [
     "__background",
@@ -119,13 +136,190 @@ def build_transforms(cfg, min_image_size=800):
     return transform
 
 
-def select_top_predictions(predictions, confidence_threshold=0.7):
-    scores = predictions.get_field("scores")
-    keep = torch.nonzero(scores > confidence_threshold).squeeze(1)
-    predictions = predictions[keep]
+def _resized_size(height, width, min_image_size):
+    """(height, width) that T.Resize(min_image_size) resizes an image to"""
+    short, long = min(height, width), max(height, width)
+    long = int(min_image_size * long / short)
+    if width <= height:
+        return long, min_image_size
+    return min_image_size, long
+
+
+def _padded(length, size_divisibility):
+    if size_divisibility > 0:
+        return int(math.ceil(length / size_divisibility) * size_divisibility)
+    return length
+
+
+def padded_input_size(path, min_image_size=800, size_divisibility=32):
+    """(height, width) of the image in path once build_batch_transform has
+    resized it and padded it on its own, read from the header of the file
+
+    The shortest side is always resized to min_image_size, so images only share
+    it when their orientation and aspect ratio match closely enough that no
+    padding beyond size_divisibility is needed to batch them.
+    """
+    width, height = image_size(path)
+    return tuple(
+        _padded(length, size_divisibility)
+        for length in _resized_size(height, width, min_image_size)
+    )
+
+
+class ImageBatch(ImageList):
+    """ImageList of images preprocessed together into one padded tensor
+
+    It can be sliced, iterated and measured like the list of image tensors it
+    replaces, so the scoring functions take either.
+    """
+
+    def __len__(self):
+        return len(self.image_sizes)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return ImageBatch(self.tensors[item], self.image_sizes[item])
+        height, width = self.image_sizes[item]
+        return self.tensors[item, :, :height, :width]
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    @property
+    def nbytes(self):
+        return self.tensors.numel() * self.tensors.element_size()
+
+    @property
+    def padding_nbytes(self):
+        """Bytes of the tensor that pad the images to the shape of the batch"""
+        pixels = sum(height * width for height, width in self.image_sizes)
+        channels = self.tensors.shape[1]
+        return self.nbytes - pixels * channels * self.tensors.element_size()
+
+
+def _resized_pixels(image, height, width):
+    """CHW uint8 tensor of a HWC image resized to height and width
+
+    The antialiased bilinear interpolation of torch 1.11 resizes several times
+    faster than PIL and within an intensity level of it. Older versions, which
+    the maskrcnn_benchmark build is pinned to, resize with PIL as T.Resize does.
+    """
+    if image.shape[:2] != (height, width) and not _INTERPOLATE_ANTIALIAS:
+        image = np.array(
+            Image.fromarray(image).resize((width, height), Image.BILINEAR)
+        )
+    # a HWC array is already a channels last NCHW tensor
+    pixels = torch.from_numpy(np.ascontiguousarray(image)).permute(2, 0, 1)
+    if pixels.shape[1:] != (height, width):
+        pixels = F.interpolate(
+            pixels[None],
+            size=(height, width),
+            mode="bilinear",
+            align_corners=False,
+            antialias=True,
+        )[0]
+    return pixels
+
+
+def build_batch_transform(cfg, min_image_size=800, size_divisibility=32):
+    """Batched equivalent of build_transforms that returns an ImageBatch
+
+    Each uint8 image is resized as it is, with the antialiased bilinear filter
+    T.Resize applies through PIL, and converted and normalized in a single pass
+    straight into its place in a zero padded float tensor allocated once for the
+    batch. Its height and width are padded to multiples of size_divisibility, as
+    to_image_list pads them, so scoring uses the tensor without copying it.
+    """
+    # ToTensor, the BGR255 conversion and Normalize folded into one scale and
+    # shift per output channel
+    std = torch.tensor(cfg.INPUT.PIXEL_STD)
+    shift = (-torch.tensor(cfg.INPUT.PIXEL_MEAN) / std)[:, None, None]
+    if cfg.INPUT.TO_BGR255:
+        channels, scale = [0, 1, 2], 1 / std
+    else:
+        channels, scale = [2, 1, 0], 1 / (255 * std)
+    scale = scale[:, None, None]
+
+    def transform(images):
+        sizes = [
+            _resized_size(image.shape[0], image.shape[1], min_image_size)
+            for image in images
+        ]
+        height, width = (
+            _padded(max(lengths), size_divisibility) for lengths in zip(*sizes)
+        )
+        batch = torch.zeros(len(images), 3, height, width)
+        for image, (image_height, image_width), padded in zip(images, sizes, batch):
+            pixels = _resized_pixels(image, image_height, image_width)
+            padded = padded[:, :image_height, :image_width]
+            padded.copy_(pixels[channels]).mul_(scale).add_(shift)
+        return ImageBatch(batch, sizes)
+
+    return transform
+
+
+def _label_ids(classes):
+    """Label ids of classes given as category names or ids"""
+    if classes is None:
+        return None
+    if isinstance(classes, (str, int)):
+        classes = [classes]
+    ids = []
+    for name in classes:
+        if isinstance(name, str):
+            if name not in CATEGORIES:
+                raise ValueError("Unknown category {}".format(name))
+            ids.append(CATEGORIES.index(name))
+        else:
+            ids.append(int(name))
+    return ids
+
+
+def select_top_predictions(
+    predictions,
+    confidence_threshold=0.7,
+    classes=None,
+    exclude_classes=None,
+    top_k=None,
+):
+    """Predictions scoring above confidence_threshold in order of confidence
+
+    If classes is given only predictions of those categories are kept, and
+    predictions of exclude_classes are dropped. Categories are given by name or
+    label id. If top_k is given at most the top_k most confident predictions
+    are kept.
+    """
     scores = predictions.get_field("scores")
-    _, idx = scores.sort(0, descending=True)
-    return predictions[idx]
+    keep = scores > confidence_threshold
+    labels = predictions.get_field("labels")
+    # compared with every id rather than with torch.isin, which the torch of the
+    # worker image does not have
+    if classes is not None:
+        keep &= (labels[:, None] == torch.tensor(_label_ids(classes))).any(1)
+    if exclude_classes is not None:
+        keep &= ~(labels[:, None] == torch.tensor(_label_ids(exclude_classes))).any(1)
+    keep = torch.nonzero(keep).squeeze(1)
+    _, idx = scores[keep].sort(0, descending=True)
+    return predictions[keep[idx][:top_k]]
+
+
+def create_prediction_filter(
+    confidence_threshold=0.7, classes=None, exclude_classes=None, top_k=None
+):
+    """Returns a function pruning predictions with select_top_predictions, with
+    the categories checked once here rather than for every image"""
+    classes, exclude_classes = _label_ids(classes), _label_ids(exclude_classes)
+
+    def prediction_filter(predictions):
+        return select_top_predictions(
+            predictions,
+            confidence_threshold=confidence_threshold,
+            classes=classes,
+            exclude_classes=exclude_classes,
+            top_k=top_k,
+        )
+
+    return prediction_filter
 
 
 def overlay_boxes(image, predictions):
@@ -207,9 +401,11 @@ def overlay_class_names(image, predictions):
 
     template = "{}: {:.2f}"
     for box, score, label in zip(boxes, scores, labels):
-        x, y = box[:2]
+        x, y = box[:2].tolist()
         s = template.format(label, score)
-        cv2.putText(image, s, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        cv2.putText(
+            image, s, (int(x), int(y)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1
+        )
 
     return image
 
@@ -223,6 +419,10 @@ def create_preprocessing(cfg):
     return preprocess
 
 
+def create_batch_preprocessing(cfg):
+    return build_batch_transform(cfg)
+
+
 def load_model(cfg, cuda=True):
     device = torch.device("cuda" if cuda else "cpu")
     cfg = cfg.clone()
@@ -236,6 +436,7 @@ def load_model(cfg, cuda=True):
     return model
 
 
+@measured("infer")
 def score_batch(model, img_batch, size_divisibility=32, cuda=True):
     device = torch.device("cuda" if cuda else "cpu")
     cpu = torch.device("cpu")
@@ -246,21 +447,115 @@ def score_batch(model, img_batch, size_divisibility=32, cuda=True):
         return [o.to(cpu) for o in output]
 
 
-def add_annotations(orig_image, prediction, mask_on=True):
-    show_mask_heatmaps = False
-    mask_threshold = -1 if show_mask_heatmaps else 0.5
-    masker = Masker(threshold=mask_threshold, padding=1)
+def _autotune_memory_limit(cuda):
+    if cuda:
+        total_memory = torch.cuda.get_device_properties(0).total_memory
+        return total_memory * AUTOTUNE_MEMORY_FRACTION
+    try:
+        from distributed import get_worker
+
+        worker = get_worker()
+    except (ImportError, ValueError):
+        return None
+    # the memory limit moved to the memory manager in newer versions of
+    # distributed
+    memory_limit = getattr(worker, "memory_limit", None) or getattr(
+        getattr(worker, "memory_manager", None), "memory_limit", None
+    )
+    return memory_limit * AUTOTUNE_MEMORY_FRACTION if memory_limit else None
+
+
+def _reset_peak_memory(cuda):
+    """Starts measuring the peak memory of a sub-batch, returns False if it
+    cannot be measured"""
+    if cuda:
+        torch.cuda.reset_max_memory_allocated()
+        return True
+    # resets the peak resident set size of the process, Linux only
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def _peak_memory(cuda):
+    if cuda:
+        return torch.cuda.max_memory_allocated()
+    # peak resident set size of the process since _reset_peak_memory
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+@measured("infer")
+def score_batch_autotuned(
+    model, img_batch, size_divisibility=32, cuda=True, max_batch_size=32
+):
+    """Scores img_batch in sub-batches sized by the batch size tuner of the worker
+
+    The tuner measures the latency and peak memory of each sub-batch and settles
+    on the batch size with the highest throughput for the largest image size in
+    img_batch.
+    """
+    tuner = get_tuner(
+        max_batch_size=max_batch_size, memory_limit=_autotune_memory_limit(cuda)
+    )
+    key = tuple(max(sizes) for sizes in zip(*[img.shape[1:] for img in img_batch]))
+    outputs = []
+    start = 0
+    while start < len(img_batch):
+        batch_size = tuner.batch_size(key, len(img_batch) - start)
+        measure_memory = _reset_peak_memory(cuda)
+        batch_start = default_timer()
+        try:
+            output = score_batch(
+                model,
+                img_batch[start : start + batch_size],
+                size_divisibility=size_divisibility,
+                cuda=cuda,
+            )
+        except RuntimeError as e:
+            if "out of memory" not in str(e) or batch_size == 1:
+                raise
+            tuner.out_of_memory(key, batch_size)
+            clean_gpu_mem()
+            continue
+        duration = default_timer() - batch_start
+        peak_memory = _peak_memory(cuda) if measure_memory else None
+        tuner.record(key, batch_size, duration, peak_memory)
+        outputs.extend(output)
+        start += batch_size
+    return outputs
+
+
+# Masker holds no state so a single one serves every call
+_masker = Masker(threshold=0.5, padding=1)
+
+
+def add_annotations(orig_image, prediction, mask_on=True, prediction_filter=None):
+    """Annotates a single image, see annotate.annotate_batch for whole batches
+
+    Predictions are pruned with prediction_filter, see create_prediction_filter,
+    before their masks are pasted. By default those above a confidence of 0.7
+    are kept.
+    """
+    if prediction_filter is None:
+        prediction_filter = select_top_predictions
+    top_preds = prediction_filter(prediction)
     # reshape prediction (a BoxList) into the original image size
     height, width = orig_image.shape[:-1]
-    prediction = prediction.resize((width, height))
-    if prediction.has_field("mask"):
+    top_preds = top_preds.resize((width, height))
+    if top_preds.has_field("mask"):
         # if we have masks, paste the masks in the right position
         # in the image, as defined by the bounding boxes
-        masks = prediction.get_field("mask")
+        masks = top_preds.get_field("mask")
         # always single image is passed at a time
-        masks = masker([masks], [prediction])[0]
-        prediction.add_field("mask", masks)
-    top_preds = select_top_predictions(prediction)
+        masks = _masker([masks], [top_preds])[0]
+        top_preds.add_field("mask", masks)
     result = orig_image.copy()
     result = overlay_boxes(result, top_preds)
     if mask_on:  # cfg.MODEL.MASK_ON:
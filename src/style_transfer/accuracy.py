@@ -0,0 +1,95 @@
+"""Fidelity of reduced precision inference measured against fp32
+
+precision_report stylizes a set of reference images with the fp32 model and with
+the model at the reduced precision, and reports the PSNR and SSIM of the reduced
+precision outputs. Both metrics are computed on the 0-255 outputs the pipeline
+writes, higher is closer to fp32.
+"""
+import torch
+import torch.nn.functional as F
+
+from style_transfer import load_images
+from style_transfer.model import load_model, stylize_batch
+
+
+def psnr(reference, output, data_range=255.0):
+    """Peak signal to noise ratio in dB of each image of two NCHW batches"""
+    mse = ((reference - output) ** 2).flatten(1).mean(1)
+    return 10 * torch.log10(data_range ** 2 / mse.clamp(min=1e-10))
+
+
+def _gaussian_window(window_size, sigma, channels):
+    coords = torch.arange(window_size, dtype=torch.float32) - window_size // 2
+    gauss = torch.exp(-(coords ** 2) / (2 * sigma ** 2))
+    gauss = gauss / gauss.sum()
+    window = gauss[:, None] * gauss[None, :]
+    return window.expand(channels, 1, window_size, window_size).contiguous()
+
+
+def ssim(reference, output, data_range=255.0, window_size=11, sigma=1.5):
+    """Structural similarity of each image of two NCHW batches
+
+    Uses the gaussian window and constants of Wang et al. 2004, averaged over the
+    channels.
+    """
+    channels = reference.shape[1]
+    window = _gaussian_window(window_size, sigma, channels)
+    c1 = (0.01 * data_range) ** 2
+    c2 = (0.03 * data_range) ** 2
+
+    def blur(x):
+        return F.conv2d(x, window, groups=channels)
+
+    mu_x, mu_y = blur(reference), blur(output)
+    sigma_xx = blur(reference * reference) - mu_x ** 2
+    sigma_yy = blur(output * output) - mu_y ** 2
+    sigma_xy = blur(reference * output) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)) / (
+        (mu_x ** 2 + mu_y ** 2 + c1) * (sigma_xx + sigma_yy + c2)
+    )
+    return ssim_map.flatten(1).mean(1)
+
+
+def compare_outputs(reference, output):
+    reference = reference.float().clamp(0, 255)
+    output = output.float().clamp(0, 255)
+    return psnr(reference, output), ssim(reference, output)
+
+
+def precision_report(
+    model_dir, style, reference_paths, precision, backend="eager", cuda=True
+):
+    """Compares the outputs of style at precision with its fp32 outputs
+
+    int8 models are calibrated on the same reference images, so for an unbiased
+    estimate keep them representative of the inputs rather than drawn from them.
+    """
+    if not reference_paths:
+        raise ValueError("No reference images to compare {} on".format(precision))
+    reference_model = load_model(model_dir, style, cuda=cuda)
+    style_model = load_model(
+        model_dir,
+        style,
+        cuda=cuda,
+        backend=backend,
+        precision=precision,
+        calibration_paths=reference_paths,
+    )
+    psnrs, ssims = [], []
+    for img in load_images(reference_paths):
+        img_psnr, img_ssim = compare_outputs(
+            stylize_batch(reference_model, img[None], cuda=cuda),
+            stylize_batch(style_model, img[None], cuda=cuda),
+        )
+        psnrs.append(img_psnr)
+        ssims.append(img_ssim)
+    psnrs, ssims = torch.cat(psnrs), torch.cat(ssims)
+    return {
+        "style": style,
+        "precision": precision,
+        "images": len(psnrs),
+        "psnr_mean": psnrs.mean().item(),
+        "psnr_min": psnrs.min().item(),
+        "ssim_mean": ssims.mean().item(),
+        "ssim_min": ssims.min().item(),
+    }
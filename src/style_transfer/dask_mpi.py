@@ -20,14 +20,24 @@ def _start_scheduler():
     return s
 
 
-def _create_worker(scheduler_str, ncores, memory_limit="auto"):
+def _worker_resources(ncores, io_threads):
+    # compute and I/O tasks each hold a resource so a slow read or write can
+    # only ever occupy one of the io_threads extra threads
+    if not io_threads:
+        return ncores, None
+    return ncores + io_threads, {"compute": ncores, "io": io_threads}
+
+
+def _create_worker(scheduler_str, ncores, memory_limit="auto", io_threads=0):
     logger.info("Creating worker...")
     loop = IOLoop.current()
+    ncores, resources = _worker_resources(ncores, io_threads)
     return Worker(
         "tcp://{}".format(scheduler_str),
         loop=loop,
         ncores=ncores,
         memory_limit=memory_limit,
+        resources=resources,
         reconnect=False,
     )
 
@@ -66,7 +76,7 @@ def _get_num_nodes():
     return int(os.getenv("AZUREML_NODE_COUNT", 1))
 
 
-def start(processing_func, cores_per_worker=None, memory_limit="auto"):
+def start(processing_func, cores_per_worker=None, memory_limit="auto", io_threads=0):
     comm = MPI.COMM_WORLD
     rank = comm.Get_rank()
     nprocs = comm.Get_size()
@@ -82,6 +92,8 @@ def start(processing_func, cores_per_worker=None, memory_limit="auto"):
         cores_per_worker if cores_per_worker else math.floor(ncpus * nnodes / nprocs)
     )
     logger.info("Setting {} cores per worker".format(cores_per_worker))
+    if io_threads:
+        logger.info("Adding {} I/O threads per worker".format(io_threads))
 
     scheduler_str = os.getenv("AZ_BATCH_MASTER_NODE", "10.0.0.4:6000")
     if scheduler_str is None:
@@ -96,7 +108,12 @@ def start(processing_func, cores_per_worker=None, memory_limit="auto"):
         t.start()
 
         scheduler = _start_scheduler()
-        worker = _create_worker(scheduler_str, cores_per_worker, memory_limit=memory_limit)
+        worker = _create_worker(
+            scheduler_str,
+            cores_per_worker,
+            memory_limit=memory_limit,
+            io_threads=io_threads,
+        )
         _start_worker(worker)
         processing_func(scheduler_str)
         t.join(timeout=10)
@@ -105,7 +122,12 @@ def start(processing_func, cores_per_worker=None, memory_limit="auto"):
         scheduler.stop()
         logger.info("Exiting client and scheduler")
     else:
-        worker = _create_worker(scheduler_str, cores_per_worker, memory_limit=memory_limit)
+        worker = _create_worker(
+            scheduler_str,
+            cores_per_worker,
+            memory_limit=memory_limit,
+            io_threads=io_threads,
+        )
         _start_and_monitor_worker(worker)
 
 
@@ -1,22 +1,71 @@
+import glob
 import logging
 import os
-from threading import Thread
-from time import sleep
+import shutil
+from collections import OrderedDict, deque
+from threading import Event, Thread
 from timeit import default_timer
 
 import dask
 import numpy as np
 from dask.distributed import as_completed, Client
-from toolz import curry
+from toolz import concat, curry
 
-from style_transfer import CountdownTimer, FileReader, save_image, load_image
-from style_transfer.model import stylize_batch, load_model, clean_gpu_mem
+from style_transfer import (
+    CountdownTimer,
+    create_file_reader,
+    load_images,
+    image_size,
+    padded_image_size,
+)
+from style_transfer.accuracy import precision_report
+from style_transfer.encode import save_batch, to_uint8_hwc
+from style_transfer.manifest import Manifest
+from style_transfer.metrics import measure, MetricsReporter, PipelineMetrics
+from style_transfer.model_cache import CachedStyleModel, ModelCache
+from style_transfer.model import (
+    stylize_batch,
+    stylize_batch_autotuned,
+    stylize_batch_tiled,
+    load_model,
+    clean_gpu_mem,
+    MappedStyleModel,
+    release_mapped_models,
+)
+from style_transfer.video import (
+    concat_segments,
+    probe,
+    read_frames,
+    segment_path,
+    segments,
+    SegmentWriter,
+)
+from style_transfer.weights import has_weights, weights_path
 
 logger = logging.getLogger(__name__)
 
 
-def stack(chunk):
-    return np.stack(chunk)
+def _pad_to(img, shape):
+    if img.shape == shape:
+        return img
+    padding = [(0, target - dim) for dim, target in zip(img.shape, shape)]
+    return np.pad(img, padding, mode="symmetric")
+
+
+def stack(chunk, pad=False):
+    """Stacks CHW images into a batch. If pad is True images of different sizes
+    are padded at the bottom and right to the largest height and width"""
+    with measure("stack") as sample:
+        if pad:
+            unpadded = sum(img.nbytes for img in chunk)
+            shape = tuple(np.max([img.shape for img in chunk], axis=0))
+            chunk = [_pad_to(img, shape) for img in chunk]
+        img_array = np.stack(chunk)
+        sample.images = len(img_array)
+        sample.nbytes = img_array.nbytes
+        if pad:
+            sample.padding_bytes = img_array.nbytes - unpadded
+    return img_array
 
 
 def chunks(l, n):
@@ -24,51 +73,458 @@ def chunks(l, n):
         yield l[i : i + n]
 
 
-def write(filenames, img_array, output_folder):
-    for filepath, img in zip(filenames, img_array):
-        filename = os.path.split(filepath)[-1]
-        outpath = os.path.join(output_folder, filename)
-        save_image(outpath, img)
-    return len(filenames)
+class BucketBatcher(object):
+    """Groups files into batches of images that share a bucket key
+
+    key_func maps a filepath to its bucket, for example the image size read from
+    the header, so that every batch can be stacked. Full batches are released
+    straight away, partial batches once their oldest file has waited max_wait
+    seconds. Without a key_func all files share one bucket which is the same as
+    chunking the files in the order they arrived.
+    """
+
+    def __init__(self, batch_size, key_func=None, max_wait=0):
+        self._batch_size = batch_size
+        self._key_func = key_func
+        self._max_wait = max_wait
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return sum(len(files) for _, files in self._buckets.values())
+
+    def _key(self, filepath):
+        if self._key_func is None:
+            return None
+        try:
+            return self._key_func(filepath)
+        except OSError as e:
+            # let the batch fail on the worker where the error is recorded
+            logger.warning("Could not read header of {}: {}".format(filepath, e))
+            return filepath
+
+    def add(self, filenames):
+        now = default_timer()
+        for filepath in filenames:
+            bucket = self._buckets.setdefault(self._key(filepath), (now, []))
+            bucket[1].append(filepath)
+
+    def batches(self, flush=False):
+        now = default_timer()
+        for key in list(self._buckets):
+            started, files = self._buckets.pop(key)
+            full = len(files) - len(files) % self._batch_size
+            for batch in chunks(files[:full], self._batch_size):
+                yield batch
+            files = files[full:]
+            if not files:
+                continue
+            if flush or now - started >= self._max_wait:
+                yield files
+            else:
+                self._buckets[key] = (started, files)
+
+
+BUCKET_KEYS = {None: None, "shape": image_size, "padded": padded_image_size}
+
+
+def image_shapes(img_list):
+    return [img.shape[1:] for img in img_list]
+
+
+def output_file(output_folder, filepath):
+    return os.path.join(output_folder, os.path.split(filepath)[-1])
+
+
+def write(filenames, img_array, output_folder, sizes=None, write_options=None):
+    """Writes each image to output_folder. If sizes are given each image is first
+    cropped to its (height, width) to remove the padding added by stack.
+    write_options are passed on to save_batch. Returns an (input, output, sha256)
+    record for each image written"""
+    outpaths = [output_file(output_folder, filepath) for filepath in filenames]
+    with measure("write") as sample:
+        hashes = save_batch(outpaths, img_array, sizes=sizes, **(write_options or {}))
+        sample.images = len(outpaths)
+        sample.nbytes = sum(os.path.getsize(outpath) for outpath in outpaths)
+    return list(zip(filenames, outpaths, hashes))
+
+
+def _concat(lists):
+    return list(concat(lists))
+
+
+def _stylize_func(autotune, tiling=None, max_batch_size=32):
+    if tiling:
+        return curry(stylize_batch_tiled, **tiling)
+    if autotune:
+        return curry(stylize_batch_autotuned, max_batch_size=max_batch_size)
+    return stylize_batch
+
+
+def _stage_resources(io_resources):
+    """Submit options of the I/O and compute stages of a batch"""
+    if not io_resources:
+        return {}, {}
+    return {"resources": {"io": 1}}, {"resources": {"compute": 1}}
+
+
+@curry
+def process_batch(
+    client,
+    targets,
+    batch,
+    cuda=True,
+    pad=False,
+    autotune=False,
+    max_batch_size=32,
+    min_size=None,
+    write_options=None,
+    tiling=None,
+    io_resources=False,
+):
+    """Loads and stacks the batch once and stylizes it with each
+    (style_model, output_path) pair in targets
+
+    If io_resources is True loading and writing hold an "io" resource and
+    stylizing a "compute" resource, see dask_mpi.start.
+    """
+    io, compute = _stage_resources(io_resources)
+    img_list_f = client.submit(load_images, batch, min_size=min_size, **io)
+    stacked_array_f = client.submit(stack, img_list_f, pad=pad)
+    sizes_f = client.submit(image_shapes, img_list_f) if pad else None
+    written_f = []
+    for style_model, output_path in targets:
+        styled_array_f = client.submit(
+            _stylize_func(autotune, tiling, max_batch_size),
+            style_model,
+            stacked_array_f,
+            cuda=cuda,
+            **compute
+        )
+        written_f.append(
+            client.submit(
+                write,
+                batch,
+                styled_array_f,
+                output_path,
+                sizes=sizes_f,
+                write_options=write_options,
+                **io
+            )
+        )
+    if len(written_f) == 1:
+        return written_f[0]
+    return client.submit(_concat, written_f)
+
+
+def process_files(
+    targets,
+    filenames,
+    cuda=True,
+    pad=False,
+    autotune=False,
+    max_batch_size=32,
+    min_size=None,
+    write_options=None,
+    tiling=None,
+):
+    img_list = load_images(filenames, min_size=min_size)
+    img_array = stack(img_list, pad=pad)
+    sizes = image_shapes(img_list) if pad else None
+    written = []
+    for style_model, output_folder in targets:
+        styled_array = _stylize_func(autotune, tiling, max_batch_size)(
+            style_model, img_array, cuda=cuda
+        )
+        written.extend(
+            write(
+                filenames,
+                styled_array,
+                output_folder,
+                sizes=sizes,
+                write_options=write_options,
+            )
+        )
+    return written
 
 
 @curry
-def process_batch(client, style_model, output_path, batch):
-    remote_batch_f = client.scatter(batch)
-    img_array_f = client.map(load_image, remote_batch_f)
-    stacked_array_f = client.submit(stack, img_array_f)
-    styled_array_f = client.submit(stylize_batch, style_model, stacked_array_f)
-    return client.submit(write, batch, styled_array_f, output_path)
+def process_batch_fused(
+    client,
+    targets,
+    batch,
+    cuda=True,
+    pad=False,
+    autotune=False,
+    max_batch_size=32,
+    min_size=None,
+    write_options=None,
+    tiling=None,
+    io_resources=False,
+):
+    """Processes the whole batch as a single task on one worker
+
+    The models are replicated on every worker so only the filenames are sent
+    with the task and the decoded images and styled outputs never leave the
+    worker. Each image is decoded once however many styles are in targets.
+    io_resources has no effect as the task already decodes and writes on the
+    decode and writer pools of the worker.
+    """
+    return client.submit(
+        process_files,
+        targets,
+        batch,
+        cuda=cuda,
+        pad=pad,
+        autotune=autotune,
+        max_batch_size=max_batch_size,
+        min_size=min_size,
+        write_options=write_options,
+        tiling=tiling,
+    )
+
+
+def process_segment(
+    style_model,
+    video_path,
+    info,
+    segment,
+    segment_folder,
+    cuda=True,
+    batch_size=4,
+    crf=20,
+    autotune=False,
+    tiling=None,
+):
+    """Stylizes one (first frame, number of frames) segment of video_path and
+    encodes it to its own file in segment_folder, returning the file's path
+
+    Frames are decoded, stylized and encoded batch_size at a time, so only a
+    few frames of the segment are held in memory at once.
+    """
+    first_frame, frames = segment
+    path = segment_path(segment_folder, first_frame)
+    stylize = _stylize_func(autotune, tiling, batch_size)
+    height, width = info["height"], info["width"]
+    with SegmentWriter(path, width, height, info["fps"], crf=crf) as writer:
+        for frame_batch in read_frames(
+            video_path, info, first_frame, frames, batch_size=batch_size
+        ):
+            img_batch = np.ascontiguousarray(frame_batch.transpose(0, 3, 1, 2))
+            styled_batch = stylize(style_model, img_batch, cuda=cuda)
+            writer.write(to_uint8_hwc(styled_batch)[:, :height, :width])
+    return path
+
+
+PROCESSING_MODES = {"graph": process_batch, "fused": process_batch_fused}
+
+
+def _batch_nbytes(batch):
+    return sum(os.path.getsize(filepath) for filepath in batch)
+
+
+class BatchTracker(object):
+    """Keeps track of in-flight batches and retires them as they complete
+
+    Completed futures are drained from an as_completed queue so retiring a batch
+    is O(1) regardless of how many batches are in flight. Completed batches are
+    only counted in completed, so the state kept on the client does not grow
+    with the length of a run. Failed batches are kept in errors together with
+    their exception.
+
+    Batches are queued with enqueue and only submitted by submit_pending while
+    there are fewer than max_in_flight batches, or fewer than max_in_flight_bytes
+    of input files, in flight. A batch is always admitted when nothing is in
+    flight so a single oversized batch can not stall the pipeline.
+
+    If on_result is given it is called with the result of each batch that
+    completes successfully, the result is not kept afterwards.
+    """
+
+    def __init__(self, max_in_flight=None, max_in_flight_bytes=None, on_result=None):
+        self._completed = as_completed()
+        self._batches = {}
+        self._pending = deque()
+        self._ready = Event()
+        self._max_in_flight = max_in_flight
+        self._max_in_flight_bytes = max_in_flight_bytes
+        self._on_result = on_result
+        self.in_flight_bytes = 0
+        self.completed = 0
+        self.errors = []
+
+    def __len__(self):
+        return len(self._batches)
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    def enqueue(self, batch):
+        self._pending.append(batch)
+
+    def _has_capacity(self, nbytes):
+        if len(self._batches) == 0:
+            return True
+        if self._max_in_flight and len(self._batches) >= self._max_in_flight:
+            return False
+        if (
+            self._max_in_flight_bytes
+            and self.in_flight_bytes + nbytes > self._max_in_flight_bytes
+        ):
+            return False
+        return True
+
+    def submit_pending(self, processing_func):
+        """Submits queued batches while there is capacity. Returns the number of
+        batches submitted"""
+        submitted = 0
+        while self._pending:
+            batch = self._pending[0]
+            nbytes = _batch_nbytes(batch) if self._max_in_flight_bytes else 0
+            if not self._has_capacity(nbytes):
+                break
+            self._pending.popleft()
+            self.add(processing_func(batch), batch, nbytes=nbytes)
+            submitted += 1
+        return submitted
+
+    def add(self, future, batch, nbytes=0):
+        self._batches[future] = (batch, nbytes)
+        self.in_flight_bytes += nbytes
+        self._completed.add(future)
+        future.add_done_callback(lambda _: self._ready.set())
+
+    def _retire(self, future):
+        batch, nbytes = self._batches.pop(future)
+        self.in_flight_bytes -= nbytes
+        if future.status == "error":
+            exception = future.exception()
+            logger.error("Batch of {} failed: {}".format(len(batch), exception))
+            self.errors.append((batch, exception))
+        else:
+            self.completed += 1
+            if self._on_result is not None:
+                self._on_result(future.result())
+
+    def wait(self, timeout):
+        """Waits up to timeout seconds for a batch to complete and retires all
+        completed batches. Returns the number of batches retired"""
+        self._ready.wait(timeout)
+        self._ready.clear()
+        completed = self._completed.next_batch(block=False)
+        for future in completed:
+            self._retire(future)
+        return len(completed)
+
+
+def _remove_completed(filenames, manifest, output_folders):
+    remaining = [
+        filename
+        for filename in filenames
+        if not manifest.is_complete(
+            filename,
+            [output_file(output_folder, filename) for output_folder in output_folders],
+        )
+    ]
+    if len(remaining) < len(filenames):
+        logger.info(
+            "Skipping {} files completed by a previous run".format(
+                len(filenames) - len(remaining)
+            )
+        )
+    return remaining
 
 
 def style_images(
-    processing_func, file_reader, batch_size=4, sleep_period=0.1, patience=60
+    processing_func,
+    file_reader,
+    batch_size=4,
+    sleep_period=0.1,
+    patience=60,
+    max_in_flight=None,
+    max_in_flight_bytes=None,
+    report_period=10,
+    bucket_key=None,
+    max_wait=0,
+    manifest=None,
+    output_folders=(),
 ):
+    """Processes the files found by file_reader in batches until no new files
+    have been found for patience seconds
+
+    If a manifest is given files whose outputs in output_folders it records as
+    complete are skipped, and the outputs of each completed batch are recorded.
+    """
     patience_timer = CountdownTimer(duration=patience)
-    all_res = []
+    report_timer = CountdownTimer(duration=report_period)
+    batcher = BucketBatcher(batch_size, key_func=bucket_key, max_wait=max_wait)
+    tracker = BatchTracker(
+        max_in_flight=max_in_flight,
+        max_in_flight_bytes=max_in_flight_bytes,
+        on_result=manifest.record if manifest is not None else None,
+    )
     while True:
         new_files = file_reader.new_files()
         if len(new_files) > 0:
             patience_timer.reset()
-            new_res = list(map(processing_func, chunks(list(new_files), batch_size)))
-            all_res.extend(new_res)
+        if manifest is not None and len(new_files) > 0:
+            new_files = _remove_completed(new_files, manifest, output_folders)
+            manifest.add_pending(new_files)
+        if len(new_files) > 0:
+            batcher.add(sorted(new_files))
+        for batch in batcher.batches(flush=patience_timer.is_expired()):
+            tracker.enqueue(batch)
+        tracker.submit_pending(processing_func)
+
+        # wakes up as soon as a batch completes rather than on the next tick
+        if tracker.wait(sleep_period) > 0:
+            logger.debug("Batches remaining {}".format(len(tracker)))
 
-        for res in all_res:
-            if res.done():
-                all_res.remove(res)
-        logger.debug("Batches remaining {}".format(len(all_res)))
+        if report_timer.is_expired() and (tracker.queue_depth > 0 or len(tracker) > 0):
+            report_timer.reset()
+            logger.info(
+                "Queue depth {} batches | {} batches in flight ({} bytes)".format(
+                    tracker.queue_depth, len(tracker), tracker.in_flight_bytes
+                )
+            )
 
-        if patience_timer.is_expired() and len(all_res) == 0:
-            logger.info("Finished processing images")
+        if (
+            patience_timer.is_expired()
+            and len(batcher) == 0
+            and tracker.queue_depth == 0
+            and len(tracker) == 0
+        ):
+            logger.info(
+                "Finished processing images | {} batches failed".format(
+                    len(tracker.errors)
+                )
+            )
             break
+    return tracker
 
-        sleep(sleep_period)
+
+def _register_worker_plugin(client, plugin):
+    # register_worker_plugin was renamed to register_plugin in newer versions
+    register = getattr(client, "register_plugin", None)
+    if register is None:
+        return client.register_worker_plugin(plugin, name=plugin.name)
+    return register(plugin, name=plugin.name)
+
+
+def _cached_model(client, model_dir, style, cuda=True, memory_budget=2 ** 30, **kwargs):
+    _register_worker_plugin(client, ModelCache())
+    return CachedStyleModel(
+        model_dir, style, cuda=cuda, memory_budget=memory_budget, **kwargs
+    )
 
 
-def _distribute_model_to_workers(client, model_dir, style):
+def _distribute_model_to_workers(client, model_dir, style, cuda=True, **kwargs):
+    if has_weights(model_dir, style):
+        logger.info("Mapping model from {}".format(weights_path(model_dir, style)))
+        return MappedStyleModel(model_dir, style, cuda=cuda, **kwargs)
     logger.info("Loading model...")
     start = default_timer()
-    style_model = client.submit(load_model, model_dir, style, cuda=True)
+    style_model = client.submit(load_model, model_dir, style, cuda=cuda, **kwargs)
     dask.distributed.wait(style_model)
     client.replicate(style_model)
     logger.info(
@@ -77,34 +533,384 @@ def _distribute_model_to_workers(client, model_dir, style):
     return style_model
 
 
+def _check_precision(
+    client,
+    model_dir,
+    styles,
+    reference_paths,
+    precision,
+    min_psnr=None,
+    min_ssim=None,
+    **kwargs
+):
+    """Measures the fidelity of each style at precision on a worker and raises a
+    ValueError if it is below min_psnr or min_ssim"""
+    reports = client.gather(
+        [
+            client.submit(
+                precision_report,
+                model_dir,
+                style,
+                reference_paths,
+                precision,
+                pure=False,
+                **kwargs
+            )
+            for style in styles
+        ]
+    )
+    for report in reports:
+        logger.info(
+            "{style} at {precision} on {images} reference images | "
+            "PSNR mean {psnr_mean:.2f} dB min {psnr_min:.2f} dB | "
+            "SSIM mean {ssim_mean:.4f} min {ssim_min:.4f}".format(**report)
+        )
+        if (min_psnr is not None and report["psnr_min"] < min_psnr) or (
+            min_ssim is not None and report["ssim_min"] < min_ssim
+        ):
+            raise ValueError(
+                "{style} at {precision} precision is below the accuracy guard of "
+                "PSNR {min_psnr} dB SSIM {min_ssim}".format(
+                    min_psnr=min_psnr, min_ssim=min_ssim, **report
+                )
+            )
+    return reports
+
+
 def run_style_transfer_pipeline(
-    client, model_dir, style, filepath, output_path, patience=60, batch_size=4
+    client,
+    model_dir,
+    style,
+    filepath,
+    output_path,
+    patience=60,
+    batch_size=4,
+    watch_mode="scan",
+    max_in_flight=None,
+    max_in_flight_bytes=None,
+    execution_mode="graph",
+    cuda=True,
+    bucket_by=None,
+    max_wait=0,
+    autotune=False,
+    decode_min_size=None,
+    jpeg_quality=75,
+    png_compress_level=6,
+    write_threads=8,
+    model_cache=False,
+    model_cache_size=2 ** 30,
+    inference_backend="eager",
+    precision="fp32",
+    reference_path=None,
+    min_psnr=None,
+    min_ssim=None,
+    tile_size=None,
+    tile_overlap=64,
+    tile_batch_size=4,
+    manifest_path=None,
+    io_resources=False,
+    metrics_port=None,
+    metrics_path=None,
+    metrics_interval=30,
 ):
-    logger.info("Running style transfer with {}".format(style))
+    """Runs style transfer over the jpg files found in filepath
+
+    If autotune is True the workers stylize each batch in sub-batches whose size
+    they tune for throughput, batch_size is then the upper bound of that size.
+    If decode_min_size is given large JPEGs are downscaled while decoding as long
+    as their shortest side stays at least decode_min_size, so the outputs are
+    written at that reduced size. Outputs are encoded with jpeg_quality or
+    png_compress_level on a pool of write_threads threads on each worker.
+    If model_cache is True workers load the model into a cache of up to
+    model_cache_size bytes of weights that outlives the run, so runs with
+    different styles can share a cluster without reloading their models.
+    With inference_backend="compiled" each worker runs a TorchScript version of
+    the model in channels_last memory format, see OptimizedStyleModel.
+
+    precision can be lowered to "bf16" or "int8" for throughput on CPU. The jpg
+    files in reference_path are then stylized at fp32 and at precision before
+    the run, the PSNR and SSIM between the two are logged and the run stops if
+    either is below min_psnr or min_ssim. int8 also calibrates on these images
+    so needs a reference_path.
+
+    If tile_size is given images are stylized in tiles of at most tile_size
+    pixels a side that overlap by tile_overlap pixels, tile_batch_size tiles at a
+    time, so very large images fit in worker memory. autotune does not apply to
+    tiled runs.
+
+    If manifest_path is given every output written is recorded in a SQLite
+    manifest there, see Manifest. Rerunning with the same manifest skips the
+    inputs that are already complete, so an interrupted run resumes where it
+    stopped.
 
-    style_model = _distribute_model_to_workers(client, model_dir, style)
+    style can also be a list of styles, or a comma separated string of them. Each
+    image is then decoded once and stylized with every style, the outputs of
+    each style are written to a subfolder of output_path named after it.
+
+    With io_resources=True the graph execution mode loads and writes images on
+    the "io" resources of the workers and stylizes on their "compute" resources,
+    so inference never waits behind slow storage. Every worker then needs both
+    resources, as dask_mpi.start gives them with io_threads.
+
+    The workers time the load, stack, infer and write stages of every batch and
+    a summary of each stage is logged at the end of the run. If metrics_port is
+    given the stage metrics are served in the Prometheus text format at
+    /metrics on that port during the run. If metrics_path is given they are
+    written there as JSON every metrics_interval seconds. See MetricsReporter.
+    """
+    styles = style.split(",") if isinstance(style, str) else list(style)
+    logger.info("Running style transfer with {}".format(", ".join(styles)))
+
+    model_options = {"backend": inference_backend, "precision": precision}
+    if reference_path is not None:
+        reference_paths = sorted(glob.glob(os.path.join(reference_path, "*.jpg")))
+        if not reference_paths:
+            raise ValueError("No reference images found in {}".format(reference_path))
+        if precision == "int8":
+            model_options["calibration_paths"] = reference_paths
+        if precision != "fp32":
+            _check_precision(
+                client,
+                model_dir,
+                styles,
+                reference_paths,
+                precision,
+                min_psnr=min_psnr,
+                min_ssim=min_ssim,
+                backend=inference_backend,
+                cuda=cuda,
+            )
+
+    if model_cache:
+        style_models = [
+            _cached_model(
+                client,
+                model_dir,
+                name,
+                cuda=cuda,
+                memory_budget=model_cache_size,
+                **model_options
+            )
+            for name in styles
+        ]
+    else:
+        style_models = [
+            _distribute_model_to_workers(
+                client, model_dir, name, cuda=cuda, **model_options
+            )
+            for name in styles
+        ]
+
+    if len(styles) == 1 and isinstance(style, str):
+        output_paths = [output_path]
+    else:
+        output_paths = [os.path.join(output_path, name) for name in styles]
+        for path in output_paths:
+            os.makedirs(path, exist_ok=True)
 
     filepath = os.path.join(filepath, "*.jpg")
     logger.info("Reading files from {}".format(filepath))
-    file_reader = FileReader(filepath)
+    file_reader = create_file_reader(filepath, mode=watch_mode)
 
-    logger.info("Writing files to {}".format(output_path))
-    processing_func = process_batch(client, style_model, output_path)
+    logger.info(
+        "Writing files to {} | {} execution".format(output_path, execution_mode)
+    )
+    manifest = Manifest(manifest_path) if manifest_path else None
+    tiling = None
+    if tile_size:
+        tiling = {
+            "tile_size": tile_size,
+            "overlap": tile_overlap,
+            "tile_batch_size": tile_batch_size,
+        }
+    processing_func = PROCESSING_MODES[execution_mode](
+        client,
+        list(zip(style_models, output_paths)),
+        cuda=cuda,
+        pad=bucket_by == "padded",
+        autotune=autotune,
+        max_batch_size=batch_size,
+        min_size=decode_min_size,
+        write_options={
+            "quality": jpeg_quality,
+            "compress_level": png_compress_level,
+            "max_workers": write_threads,
+        },
+        tiling=tiling,
+        io_resources=io_resources,
+    )
 
     load_thread = Thread(
         target=style_images,
         args=(processing_func, file_reader),
-        kwargs={"patience": patience, "batch_size": batch_size},
+        kwargs={
+            "patience": patience,
+            "batch_size": batch_size,
+            "max_in_flight": max_in_flight,
+            "max_in_flight_bytes": max_in_flight_bytes,
+            "bucket_key": BUCKET_KEYS[bucket_by],
+            "max_wait": max_wait,
+            "manifest": manifest,
+            "output_folders": output_paths,
+        },
     )
+    _register_worker_plugin(client, PipelineMetrics())
+    metrics = MetricsReporter(
+        client, port=metrics_port, path=metrics_path, interval=metrics_interval
+    ).start()
     start = default_timer()
     load_thread.start()
     load_thread.join()
     logger.info("Finished processing images in {}".format(default_timer() - start))
+    metrics.stop()
+    if manifest is not None:
+        manifest.close()
+
+    # Delete models and clear GPU memory
+    if not model_cache:
+        logger.info("Clearing models from GPU")
+        del style_models, processing_func
+        client.run(release_mapped_models)
+        client.run(clean_gpu_mem)
+
+
+def run_style_transfer_video_pipeline(
+    client,
+    model_dir,
+    style,
+    video_path,
+    output_file,
+    segment_duration=10,
+    batch_size=4,
+    cuda=True,
+    crf=20,
+    autotune=False,
+    model_cache=False,
+    model_cache_size=2 ** 30,
+    inference_backend="eager",
+    tile_size=None,
+    tile_overlap=64,
+    tile_batch_size=4,
+):
+    """Runs style transfer over the frames of video_path and writes the styled
+    video to output_file
+
+    The video is split into segments of segment_duration seconds that the
+    workers decode, stylize and encode in parallel, frames never touch the disk
+    as images. The segments are then joined in order with the audio of
+    video_path. The other options are those of run_style_transfer_pipeline.
+    """
+    info = probe(video_path)
+    video_segments = segments(info["frames"], info["fps"], segment_duration)
+    logger.info(
+        "Running style transfer with {} over {} | {} frames at {} fps in {} "
+        "segments".format(
+            style, video_path, info["frames"], info["fps"], len(video_segments)
+        )
+    )
+    if model_cache:
+        style_model = _cached_model(
+            client,
+            model_dir,
+            style,
+            cuda=cuda,
+            memory_budget=model_cache_size,
+            backend=inference_backend,
+        )
+    else:
+        style_model = _distribute_model_to_workers(
+            client, model_dir, style, cuda=cuda, backend=inference_backend
+        )
+
+    tiling = None
+    if tile_size:
+        tiling = {
+            "tile_size": tile_size,
+            "overlap": tile_overlap,
+            "tile_batch_size": tile_batch_size,
+        }
+    segment_folder = output_file + ".segments"
+    os.makedirs(segment_folder, exist_ok=True)
+    start = default_timer()
+    segment_futures = [
+        client.submit(
+            process_segment,
+            style_model,
+            video_path,
+            info,
+            segment,
+            segment_folder,
+            cuda=cuda,
+            batch_size=batch_size,
+            crf=crf,
+            autotune=autotune,
+            tiling=tiling,
+            pure=False,
+        )
+        for segment in video_segments
+    ]
+    for completed, future in enumerate(as_completed(segment_futures), 1):
+        logger.info(
+            "Encoded {} | {} of {} segments".format(
+                future.result(), completed, len(segment_futures)
+            )
+        )
+    # futures are in segment order so the sink joins them in order whatever
+    # order they completed in
+    concat_segments(
+        [future.result() for future in segment_futures],
+        output_file,
+        audio_source=video_path,
+    )
+    shutil.rmtree(segment_folder)
+    logger.info("Wrote {} in {} seconds".format(output_file, default_timer() - start))
 
-    # Delete model and clear GPU memory
-    logger.info("Clearing model from GPU")
-    del style_model
-    client.run(clean_gpu_mem)
+    if not model_cache:
+        logger.info("Clearing model from GPU")
+        del style_model, segment_futures
+        client.run(release_mapped_models)
+        client.run(clean_gpu_mem)
+
+
+@curry
+def start_video(
+    model_dir,
+    style,
+    video_path,
+    output_file,
+    scheduler_address,
+    segment_duration=10,
+    batch_size=4,
+    cuda=True,
+    crf=20,
+    autotune=False,
+    model_cache=False,
+    model_cache_size=2 ** 30,
+    inference_backend="eager",
+    tile_size=None,
+    tile_overlap=64,
+    tile_batch_size=4,
+):
+    client = Client(scheduler_address)
+    run_style_transfer_video_pipeline(
+        client,
+        model_dir,
+        style,
+        video_path,
+        output_file,
+        segment_duration=segment_duration,
+        batch_size=batch_size,
+        cuda=cuda,
+        crf=crf,
+        autotune=autotune,
+        model_cache=model_cache,
+        model_cache_size=model_cache_size,
+        inference_backend=inference_backend,
+        tile_size=tile_size,
+        tile_overlap=tile_overlap,
+        tile_batch_size=tile_batch_size,
+    )
+    client.close()
 
 
 @curry
@@ -116,6 +922,33 @@ def start(
     scheduler_address,
     patience=60,
     batch_size=4,
+    watch_mode="scan",
+    max_in_flight=None,
+    max_in_flight_bytes=None,
+    execution_mode="graph",
+    cuda=True,
+    bucket_by=None,
+    max_wait=0,
+    autotune=False,
+    decode_min_size=None,
+    jpeg_quality=75,
+    png_compress_level=6,
+    write_threads=8,
+    model_cache=False,
+    model_cache_size=2 ** 30,
+    inference_backend="eager",
+    precision="fp32",
+    reference_path=None,
+    min_psnr=None,
+    min_ssim=None,
+    tile_size=None,
+    tile_overlap=64,
+    tile_batch_size=4,
+    manifest_path=None,
+    io_resources=False,
+    metrics_port=None,
+    metrics_path=None,
+    metrics_interval=30,
 ):
     client = Client(scheduler_address)
     run_style_transfer_pipeline(
@@ -126,5 +959,32 @@ def start(
         output_path,
         patience=patience,
         batch_size=batch_size,
+        watch_mode=watch_mode,
+        max_in_flight=max_in_flight,
+        max_in_flight_bytes=max_in_flight_bytes,
+        execution_mode=execution_mode,
+        cuda=cuda,
+        bucket_by=bucket_by,
+        max_wait=max_wait,
+        autotune=autotune,
+        decode_min_size=decode_min_size,
+        jpeg_quality=jpeg_quality,
+        png_compress_level=png_compress_level,
+        write_threads=write_threads,
+        model_cache=model_cache,
+        model_cache_size=model_cache_size,
+        inference_backend=inference_backend,
+        precision=precision,
+        reference_path=reference_path,
+        min_psnr=min_psnr,
+        min_ssim=min_ssim,
+        tile_size=tile_size,
+        tile_overlap=tile_overlap,
+        tile_batch_size=tile_batch_size,
+        manifest_path=manifest_path,
+        io_resources=io_resources,
+        metrics_port=metrics_port,
+        metrics_path=metrics_path,
+        metrics_interval=metrics_interval,
     )
     client.close()
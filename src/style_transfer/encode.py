@@ -0,0 +1,68 @@
+"""Batch encoding and concurrent writing of styled images
+
+The whole output batch is clamped and converted to uint8 HWC in one pass, the
+images are then encoded and written on a thread pool. PIL releases the GIL while
+encoding and writing so throughput to slow mounts scales with the number of
+threads.
+"""
+import hashlib
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import torch
+from PIL import Image
+
+# one pool for each size asked for, so each run writes with its own number of
+# threads while concurrent batches of a run share a pool
+_pools = {}
+_pools_lock = Lock()
+
+
+def _get_pool(max_workers=8):
+    with _pools_lock:
+        if max_workers not in _pools:
+            _pools[max_workers] = ThreadPoolExecutor(max_workers=max_workers)
+        return _pools[max_workers]
+
+
+def to_uint8_hwc(img_batch):
+    """Converts a float NCHW batch in the 0-255 range to a uint8 NHWC array"""
+    img_batch = torch.as_tensor(img_batch)
+    return img_batch.clamp(0, 255).byte().permute(0, 2, 3, 1).contiguous().numpy()
+
+
+def _save(path, img, quality, compress_level):
+    # encoded in memory so the file is written in one go and its hash is free
+    buffer = io.BytesIO()
+    image_format = Image.registered_extensions()[os.path.splitext(path)[1].lower()]
+    # quality only applies to JPEG and compress_level only to PNG
+    Image.fromarray(img).save(
+        buffer, format=image_format, quality=quality, compress_level=compress_level
+    )
+    data = buffer.getvalue()
+    with open(path, "wb") as f:
+        f.write(data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def save_batch(
+    paths, img_batch, sizes=None, quality=75, compress_level=6, max_workers=8
+):
+    """Saves each image of img_batch to the matching path
+
+    If sizes are given each image is first cropped to its (height, width). The
+    images are written on a pool of max_workers threads of the process, created
+    on first use of that size. Returns the SHA-256 of each file written.
+    """
+    img_batch = to_uint8_hwc(img_batch)
+    if sizes is not None:
+        img_batch = [
+            img[:height, :width] for img, (height, width) in zip(img_batch, sizes)
+        ]
+    futures = [
+        _get_pool(max_workers).submit(_save, path, img, quality, compress_level)
+        for path, img in zip(paths, img_batch)
+    ]
+    return [future.result() for future in futures]
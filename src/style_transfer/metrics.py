@@ -0,0 +1,340 @@
+"""Per-stage metrics of the pipelines collected on the workers
+
+The stages of a pipeline time themselves with measure. While a PipelineMetrics
+plugin is registered on the worker running them, each measurement adds the
+stage's latency to a histogram and counts the images and bytes the stage
+handled. Outside a worker, or without the plugin, measure does nothing. The
+bytes of load, calibrate, preprocess, stack, annotate and record are the size
+of the arrays they produce. For infer they are the size of the batch sent to the
+model, and for write the size of the encoded files. Stages that pad images of
+different sizes to one batch shape also count the bytes of padding they add,
+so the share of the work spent on padding shows how well batches are grouped.
+
+On the client, MetricsReporter merges the metrics of every worker. It serves
+them in the Prometheus text format, writes them periodically as JSON, or both,
+so a deployment shows which stage limits its throughput.
+"""
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from timeit import default_timer
+
+from distributed import get_worker
+from distributed.diagnostics.plugin import WorkerPlugin
+
+logger = logging.getLogger(__name__)
+
+# upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_measuring = threading.local()
+
+
+def nbytes(data):
+    """Size in bytes of an array, tensor or list of them"""
+    if isinstance(data, (list, tuple)):
+        return sum(nbytes(item) for item in data)
+    if hasattr(data, "nbytes"):
+        return int(data.nbytes)
+    if hasattr(data, "element_size"):
+        return data.numel() * data.element_size()
+    return 0
+
+
+class Sample(object):
+    def __init__(self):
+        self.images = 0
+        self.nbytes = 0
+        self.padding_bytes = 0
+
+
+def _empty_stats():
+    return {
+        "count": 0,
+        "seconds": 0.0,
+        "images": 0,
+        "bytes": 0,
+        "padding_bytes": 0,
+        "buckets": [0] * len(LATENCY_BUCKETS),
+    }
+
+
+class PipelineMetrics(WorkerPlugin):
+    name = "pipeline-metrics"
+
+    def setup(self, worker):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def observe(self, stage, seconds, images=0, nbytes=0, padding_bytes=0):
+        with self._lock:
+            stats = self._stages.setdefault(stage, _empty_stats())
+            stats["count"] += 1
+            stats["seconds"] += seconds
+            stats["images"] += images
+            stats["bytes"] += nbytes
+            stats["padding_bytes"] += padding_bytes
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+                    break
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: dict(stats, buckets=list(stats["buckets"]))
+                for stage, stats in self._stages.items()
+            }
+
+
+def _worker_metrics():
+    try:
+        return get_worker().plugins.get(PipelineMetrics.name)
+    except ValueError:
+        # not running on a worker
+        return None
+
+
+@contextmanager
+def measure(stage):
+    """Times the body as one batch of stage. Set images, nbytes and, if the
+    stage pads images, padding_bytes on the yielded Sample. A stage measured
+    inside itself, such as autotuned inference calling plain inference, is only
+    recorded once."""
+    sample = Sample()
+    active = getattr(_measuring, "stages", None)
+    if active is None:
+        active = _measuring.stages = set()
+    if stage in active:
+        yield sample
+        return
+    active.add(stage)
+    start = default_timer()
+    try:
+        yield sample
+    finally:
+        active.discard(stage)
+    metrics = _worker_metrics()
+    if metrics is not None:
+        metrics.observe(
+            stage,
+            default_timer() - start,
+            sample.images,
+            sample.nbytes,
+            sample.padding_bytes,
+        )
+
+
+def measured(stage):
+    """Decorates a function taking (model, batch, ...) so each call is measured
+    as a batch of stage"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(model, batch, *args, **kwargs):
+            with measure(stage) as sample:
+                sample.images, sample.nbytes = len(batch), nbytes(batch)
+                return func(model, batch, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _worker_snapshot(dask_worker):
+    metrics = dask_worker.plugins.get(PipelineMetrics.name)
+    return metrics.snapshot() if metrics is not None else {}
+
+
+def _merge(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for stage, stats in snapshot.items():
+            total = merged.setdefault(stage, _empty_stats())
+            for field in ("count", "seconds", "images", "bytes", "padding_bytes"):
+                total[field] += stats[field]
+            total["buckets"] = [
+                a + b for a, b in zip(total["buckets"], stats["buckets"])
+            ]
+    return merged
+
+
+def collect(client):
+    """Merged stage metrics of every worker of client"""
+    return _merge(client.run(_worker_snapshot).values())
+
+
+def to_json(stages):
+    report = {}
+    for stage, stats in stages.items():
+        seconds = stats["seconds"]
+        report[stage] = {
+            "batches": stats["count"],
+            "seconds": seconds,
+            "images": stats["images"],
+            "bytes": stats["bytes"],
+            "padding_bytes": stats["padding_bytes"],
+            "padding_fraction": (
+                stats["padding_bytes"] / stats["bytes"] if stats["bytes"] else 0.0
+            ),
+            "mean_latency": seconds / stats["count"] if stats["count"] else 0.0,
+            # per busy thread, divide the wall clock time instead for the
+            # throughput of the cluster
+            "images_per_sec": stats["images"] / seconds if seconds else 0.0,
+            "bytes_per_sec": stats["bytes"] / seconds if seconds else 0.0,
+            "latency_buckets": dict(
+                zip([str(bound) for bound in LATENCY_BUCKETS], stats["buckets"])
+            ),
+        }
+    return report
+
+
+def to_prometheus(stages):
+    lines = [
+        "# HELP pipeline_stage_seconds Latency of a batch in each pipeline stage",
+        "# TYPE pipeline_stage_seconds histogram",
+    ]
+    for stage, stats in sorted(stages.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+            cumulative += count
+            lines.append(
+                'pipeline_stage_seconds_bucket{{stage="{}",le="{}"}} {}'.format(
+                    stage, bound, cumulative
+                )
+            )
+        lines.append(
+            'pipeline_stage_seconds_bucket{{stage="{}",le="+Inf"}} {}'.format(
+                stage, stats["count"]
+            )
+        )
+        lines.append(
+            'pipeline_stage_seconds_sum{{stage="{}"}} {}'.format(
+                stage, stats["seconds"]
+            )
+        )
+        lines.append(
+            'pipeline_stage_seconds_count{{stage="{}"}} {}'.format(
+                stage, stats["count"]
+            )
+        )
+    for field, help_text in (
+        ("images", "Images handled by each pipeline stage"),
+        ("bytes", "Bytes handled by each pipeline stage"),
+        ("padding_bytes", "Bytes of padding added by each pipeline stage"),
+    ):
+        lines.append("# HELP pipeline_stage_{}_total {}".format(field, help_text))
+        lines.append("# TYPE pipeline_stage_{}_total counter".format(field))
+        for stage, stats in sorted(stages.items()):
+            lines.append(
+                'pipeline_stage_{}_total{{stage="{}"}} {}'.format(
+                    field, stage, stats[field]
+                )
+            )
+    return "\n".join(lines) + "\n"
+
+
+def _handler(reporter):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = to_prometheus(reporter.collect()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return MetricsHandler
+
+
+class MetricsReporter(object):
+    """Reports the stage metrics of the workers of client, which must have the
+    PipelineMetrics plugin registered
+
+    If port is given the metrics are served in the Prometheus text format at
+    /metrics on that port. If path is given they are written there as JSON
+    every interval seconds and once more on stop.
+    """
+
+    def __init__(self, client, port=None, path=None, interval=30):
+        self._client = client
+        self._port = port
+        self._path = path
+        self._interval = interval
+        self._server = None
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def collect(self):
+        return collect(self._client)
+
+    def dump(self):
+        report = {"time": time.time(), "stages": to_json(self.collect())}
+        # written under a temporary name so readers never see a partial file
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(report, f, indent=2)
+        os.replace(tmp_path, self._path)
+
+    def _dump_periodically(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.dump()
+            except Exception as e:
+                logger.warning(
+                    "Could not write metrics to {}: {}".format(self._path, e)
+                )
+
+    def start(self):
+        if self._port is not None:
+            self._server = ThreadingHTTPServer(("", self._port), _handler(self))
+            self._threads.append(
+                threading.Thread(target=self._server.serve_forever, daemon=True)
+            )
+            logger.info("Serving metrics on port {}".format(self._port))
+        if self._path is not None:
+            self._threads.append(
+                threading.Thread(target=self._dump_periodically, daemon=True)
+            )
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Stops reporting and returns the final metrics"""
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        stages = self.collect()
+        if self._path is not None:
+            self.dump()
+        for stage, stats in sorted(to_json(stages).items()):
+            summary = (
+                "{} | {} batches | {} images | {:.4f}s mean latency | "
+                "{:.2f} images/sec per thread | {:.1f} MB".format(
+                    stage,
+                    stats["batches"],
+                    stats["images"],
+                    stats["mean_latency"],
+                    stats["images_per_sec"],
+                    stats["bytes"] / 2 ** 20,
+                )
+            )
+            if stats["padding_bytes"]:
+                summary += " | {:.1%} padding".format(stats["padding_fraction"])
+            logger.info(summary)
+        return stages
@@ -3,13 +3,34 @@
 
 # Original source: https://github.com/pytorch/examples/blob/master/fast_neural_style/neural_style/neural_style.py
 import os
-import re
 import sys
+from threading import Lock
+from timeit import default_timer
 
+import numpy as np
 import torch
 from torchvision import transforms
 
-from style_transfer import load_image, save_image
+from style_transfer import load_image, load_images, save_image
+from style_transfer.autotune import get_tuner
+from style_transfer.metrics import measured
+from style_transfer.weights import (
+    assign_weights,
+    clean_state_dict,
+    has_weights,
+    load_weights,
+    weights_path,
+)
+
+# Fraction of the device or worker memory the autotuner may use
+AUTOTUNE_MEMORY_FRACTION = 0.8
+
+INFERENCE_BACKENDS = ("eager", "compiled")
+
+PRECISIONS = ("fp32", "bf16", "int8")
+
+# torch.inference_mode and torch.jit.freeze are only available in newer versions
+_inference_mode = getattr(torch, "inference_mode", torch.no_grad)
 
 
 class TransformerNet(torch.nn.Module):
@@ -114,29 +135,381 @@ class UpsampleConvLayer(torch.nn.Module):
         return out
 
 
-def load_model(model_dir, style, cuda=True):
+class _ChannelsLast(torch.nn.Module):
+    def __init__(self, model):
+        super(_ChannelsLast, self).__init__()
+        self.model = model
+
+    def forward(self, X):
+        return self.model(X.contiguous(memory_format=torch.channels_last))
+
+
+def _worker_threads():
+    try:
+        from distributed import get_worker
+
+        worker = get_worker()
+    except (ImportError, ValueError):
+        return None
+    # ncores was renamed to nthreads in newer versions of distributed
+    return getattr(worker, "nthreads", None) or getattr(worker, "ncores", None)
+
+
+def compile_model(style_model):
+    """Scripts style_model into a frozen TorchScript module that runs in
+    channels_last memory format, converting its inputs as needed"""
+    style_model.eval()
+    style_model.to(memory_format=torch.channels_last)
+    with torch.no_grad():
+        compiled = torch.jit.script(_ChannelsLast(style_model).eval())
+        if hasattr(torch.jit, "freeze"):
+            compiled = torch.jit.freeze(compiled)
+    return compiled
+
+
+def quantize_model(style_model, calibration_images):
+    """Quantizes the convolutions of style_model to int8 after training
+
+    Activation ranges are observed by running the float model over
+    calibration_images, a list of uint8 CHW arrays that should look like the
+    images that will be stylized. Quantized kernels only run on CPU.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    device = torch.device("cpu")
+    style_model.eval()
+    example = batch_to_device(calibration_images[0][None], device)
+    prepared = prepare_fx(style_model, get_default_qconfig_mapping(), (example,))
+    with torch.no_grad():
+        for img in calibration_images:
+            prepared(batch_to_device(img[None], device))
+    return convert_fx(prepared)
+
+
+class OptimizedStyleModel(object):
+    """Runs a TransformerNet with the inference backend and precision of a run
+
+    With precision "int8" the model is first quantized with quantize_model,
+    calibrated on the images in calibration_paths. With backend "compiled" it is
+    then scripted with compile_model. With precision "bf16" it runs under bf16
+    autocast and its outputs are returned as float32. It always runs under
+    torch.inference_mode.
+
+    Neither TorchScript nor quantized modules can be pickled, so the eager model
+    is what is sent between workers and each process prepares it once on first
+    use. On CPU the intra-op threads are pinned to the threads of the Dask
+    worker so workers sharing a node do not oversubscribe its cores.
+    """
+
+    def __init__(
+        self,
+        style_model,
+        cuda=True,
+        backend="compiled",
+        precision="fp32",
+        calibration_paths=None,
+    ):
+        self.style_model = style_model
+        self.cuda = cuda
+        self.backend = backend
+        self.precision = precision
+        self.calibration_paths = calibration_paths
+        self._prepared = None
+        self._lock = Lock()
+
+    def __getstate__(self):
+        return {
+            "style_model": self.style_model,
+            "cuda": self.cuda,
+            "backend": self.backend,
+            "precision": self.precision,
+            "calibration_paths": self.calibration_paths,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def prepare(self):
+        with self._lock:
+            if self._prepared is None:
+                num_threads = None if self.cuda else _worker_threads()
+                if num_threads:
+                    torch.set_num_threads(num_threads)
+                model = self.style_model
+                if self.precision == "int8":
+                    # measured apart so the load metrics only count the run
+                    model = quantize_model(
+                        model, load_images(self.calibration_paths, stage="calibrate")
+                    )
+                if self.backend == "compiled":
+                    model = compile_model(model)
+                self._prepared = model
+            return self._prepared
+
+    def __call__(self, X):
+        model = self.prepare()
+        with _inference_mode():
+            if self.precision != "bf16":
+                return model(X)
+            with torch.autocast(X.device.type, dtype=torch.bfloat16):
+                return model(X).float()
+
+
+def load_model(
+    model_dir,
+    style,
+    cuda=True,
+    backend="eager",
+    precision="fp32",
+    calibration_paths=None,
+):
+    """Loads the TransformerNet of style from model_dir
+
+    The weights are mapped from the style's .weights file when one was made with
+    style_transfer.weights, otherwise they are read from its .pth checkpoint.
+    backend is one of INFERENCE_BACKENDS and precision one of PRECISIONS. Any
+    other combination than eager fp32 returns the model wrapped in an
+    OptimizedStyleModel. int8 only runs on CPU and needs calibration_paths, a
+    list of images to calibrate the quantized activations on.
+    """
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(
+            "Unknown inference backend {}, expected one of {}".format(
+                backend, INFERENCE_BACKENDS
+            )
+        )
+    if precision not in PRECISIONS:
+        raise ValueError(
+            "Unknown precision {}, expected one of {}".format(precision, PRECISIONS)
+        )
+    if precision == "int8" and (cuda or not calibration_paths):
+        raise ValueError("int8 precision runs on CPU and needs calibration images")
     device = torch.device("cuda" if cuda else "cpu")
     with torch.no_grad():
         style_model = TransformerNet()
-        state_dict = torch.load(os.path.join(model_dir, style + ".pth"))
-        # remove saved deprecated running_* keys in InstanceNorm from the checkpoint
-        for k in list(state_dict.keys()):
-            if re.search(r"in\d+\.running_(mean|var)$", k):
-                del state_dict[k]
-        style_model.load_state_dict(state_dict)
+        if has_weights(model_dir, style):
+            # converted weights are mapped rather than read so on CPU every
+            # process on the node shares them
+            assign_weights(style_model, load_weights(weights_path(model_dir, style)))
+        else:
+            state_dict = torch.load(os.path.join(model_dir, style + ".pth"))
+            style_model.load_state_dict(clean_state_dict(state_dict))
         style_model.to(device)
+    if backend == "eager" and precision == "fp32":
         return style_model
+    return OptimizedStyleModel(
+        style_model,
+        cuda=cuda,
+        backend=backend,
+        precision=precision,
+        calibration_paths=calibration_paths,
+    )
+
+
+_mapped_models = {}
+_mapped_models_lock = Lock()
+
+
+class MappedStyleModel(object):
+    """Stands in for the model of style in model_dir loaded from its .weights file
+
+    Only its arguments are sent to the workers, each worker process loads the
+    model once on first use by mapping the weights on its node, so replicating
+    it costs nothing and the weights are not copied into every process.
+    """
+
+    def __init__(self, model_dir, style, **load_options):
+        self.model_dir = model_dir
+        self.style = style
+        self.load_options = load_options
+
+    def load(self):
+        key = (self.model_dir, self.style, repr(sorted(self.load_options.items())))
+        with _mapped_models_lock:
+            if key not in _mapped_models:
+                _mapped_models[key] = load_model(
+                    self.model_dir, self.style, **self.load_options
+                )
+            return _mapped_models[key]
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __repr__(self):
+        return "MappedStyleModel({!r}, {!r})".format(self.model_dir, self.style)
+
+
+def release_mapped_models():
+    _mapped_models.clear()
 
 
+def batch_to_device(img_batch, device):
+    """Moves a uint8 NCHW batch to device and converts it to float there
+
+    torch.as_tensor shares memory with the numpy batch so only uint8 data is
+    copied to the device and the float conversion runs once on the device.
+    Values are kept in the 0-255 range the models were trained on, the same
+    range stylize uses.
+    """
+    return torch.as_tensor(img_batch).to(device).float()
+
+
+@measured("infer")
 def stylize_batch(style_model, img_batch, cuda=True):
     device = torch.device("cuda" if cuda else "cpu")
     with torch.no_grad():
-        content_batch = torch.FloatTensor(img_batch).mul(1 / 255)
-        content_image = content_batch.to(device)
+        content_image = batch_to_device(img_batch, device)
         output = style_model(content_image).cpu()
         return output
 
 
+def _autotune_memory_limit(cuda):
+    if cuda:
+        total_memory = torch.cuda.get_device_properties(0).total_memory
+        return total_memory * AUTOTUNE_MEMORY_FRACTION
+    try:
+        from distributed import get_worker
+
+        worker = get_worker()
+    except (ImportError, ValueError):
+        return None
+    # the memory limit moved to the memory manager in newer versions of
+    # distributed
+    memory_limit = getattr(worker, "memory_limit", None) or getattr(
+        getattr(worker, "memory_manager", None), "memory_limit", None
+    )
+    return memory_limit * AUTOTUNE_MEMORY_FRACTION if memory_limit else None
+
+
+def _reset_peak_memory(cuda):
+    """Starts measuring the peak memory of a sub-batch, returns False if it
+    cannot be measured"""
+    if cuda:
+        torch.cuda.reset_max_memory_allocated()
+        return True
+    # resets the peak resident set size of the process, Linux only
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def _peak_memory(cuda):
+    if cuda:
+        return torch.cuda.max_memory_allocated()
+    # peak resident set size of the process since _reset_peak_memory
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+@measured("infer")
+def stylize_batch_autotuned(style_model, img_batch, cuda=True, max_batch_size=32):
+    """Stylizes img_batch in sub-batches sized by the batch size tuner of the worker
+
+    The tuner measures the latency and peak memory of each sub-batch and settles
+    on the batch size with the highest throughput for the resolution of img_batch.
+    """
+    tuner = get_tuner(
+        max_batch_size=max_batch_size, memory_limit=_autotune_memory_limit(cuda)
+    )
+    key = tuple(img_batch.shape[2:])
+    outputs = []
+    start = 0
+    while start < len(img_batch):
+        batch_size = tuner.batch_size(key, len(img_batch) - start)
+        measure_memory = _reset_peak_memory(cuda)
+        batch_start = default_timer()
+        try:
+            output = stylize_batch(
+                style_model, img_batch[start : start + batch_size], cuda=cuda
+            )
+        except RuntimeError as e:
+            if "out of memory" not in str(e) or batch_size == 1:
+                raise
+            tuner.out_of_memory(key, batch_size)
+            clean_gpu_mem()
+            continue
+        duration = default_timer() - batch_start
+        peak_memory = _peak_memory(cuda) if measure_memory else None
+        tuner.record(key, batch_size, duration, peak_memory)
+        outputs.append(output)
+        start += batch_size
+    return torch.cat(outputs)
+
+
+def _tile_starts(length, tile_size, overlap):
+    """Starts of the fewest tiles that cover length with each tile overlapping
+    the one before by at least overlap pixels, spread evenly from edge to edge"""
+    if length <= tile_size:
+        return [0]
+    # a ceiling division of the length past the first tile by the tile step
+    steps = -(-(length - tile_size) // (tile_size - overlap))
+    return [step * (length - tile_size) // steps for step in range(steps + 1)]
+
+
+def _blend_window(height, width, overlap):
+    """Tile weights that ramp up linearly over overlap pixels from each edge"""
+
+    def ramp(length):
+        distance = torch.arange(length, dtype=torch.float32)
+        distance = torch.min(distance, distance.flip(0)) + 1
+        return (distance / (overlap + 1)).clamp(max=1)
+
+    return ramp(height)[:, None] * ramp(width)[None, :]
+
+
+@measured("infer")
+def stylize_batch_tiled(
+    style_model, img_batch, cuda=True, tile_size=1024, overlap=64, tile_batch_size=4
+):
+    """Stylizes img_batch in overlapping tiles of at most tile_size pixels a side
+
+    The tiles of all the images of img_batch are stylized tile_batch_size at a
+    time, so the activations held at once depend on the tile size rather than on
+    the image size. Where tiles overlap their outputs are blended with weights
+    that ramp linearly across the overlap, which hides the seams left by
+    instance normalization computing its statistics per tile.
+    """
+    if not 0 <= overlap < tile_size:
+        raise ValueError(
+            "Tile overlap {} must be smaller than the tile size {}".format(
+                overlap, tile_size
+            )
+        )
+    n, _, height, width = img_batch.shape
+    tile_height, tile_width = min(tile_size, height), min(tile_size, width)
+    tiles = [
+        (i, y, x)
+        for i in range(n)
+        for y in _tile_starts(height, tile_size, overlap)
+        for x in _tile_starts(width, tile_size, overlap)
+    ]
+    window = _blend_window(tile_height, tile_width, overlap)
+    output = torch.zeros((n, 3, height, width))
+    weights = torch.zeros((n, 1, height, width))
+    for start in range(0, len(tiles), tile_batch_size):
+        chunk = tiles[start : start + tile_batch_size]
+        tile_batch = np.stack(
+            [
+                img_batch[i, :, y : y + tile_height, x : x + tile_width]
+                for i, y, x in chunk
+            ]
+        )
+        styled = stylize_batch(style_model, tile_batch, cuda=cuda)
+        # the network rounds sizes up to a multiple of 4
+        styled = styled[:, :, :tile_height, :tile_width]
+        for (i, y, x), tile in zip(chunk, styled):
+            output[i, :, y : y + tile_height, x : x + tile_width] += tile * window
+            weights[i, :, y : y + tile_height, x : x + tile_width] += window
+    return output / weights
+
+
 def stylize(style_model, img, cuda=True):
     device = torch.device("cuda" if cuda else "cpu")
     with torch.no_grad():
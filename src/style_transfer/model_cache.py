@@ -0,0 +1,135 @@
+"""Worker resident cache of style transfer models
+
+ModelCache is a worker plugin that keeps the most recently used TransformerNets
+of a worker loaded, evicting the least recently used ones once their weights go
+over the memory budget of the run loading a model. Tasks refer to a model
+through a CachedStyleModel which is cheap to send with every task and behaves
+like the model it names, so one long lived cluster can serve several styles
+without reloading or replicating models between jobs. The device and memory
+budget of a run travel with its CachedStyleModel rather than with the plugin,
+so runs with other options share the cache registered by the first one.
+"""
+import logging
+from collections import OrderedDict
+from threading import Lock
+
+from distributed import get_worker
+from distributed.diagnostics.plugin import WorkerPlugin
+
+from style_transfer.model import load_model, clean_gpu_mem
+
+logger = logging.getLogger(__name__)
+
+
+def model_nbytes(model):
+    # compiled models wrap the eager TransformerNet holding their weights
+    model = getattr(model, "style_model", model)
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+class ModelCache(WorkerPlugin):
+    name = "style-transfer-model-cache"
+    # keep the loaded models when another pipeline run registers the plugin again
+    idempotent = True
+
+    @property
+    def nbytes(self):
+        return sum(nbytes for _, nbytes in self._models.values())
+
+    def setup(self, worker):
+        self._models = OrderedDict()
+        self._lock = Lock()
+
+    def teardown(self, worker):
+        cuda = any(key[2] for key in self._models)
+        self._models.clear()
+        if cuda:
+            clean_gpu_mem()
+
+    def _evict(self, memory_budget):
+        cuda = False
+        while len(self._models) > 1 and self.nbytes > memory_budget:
+            key, _ = self._models.popitem(last=False)
+            logger.info("Evicted model {} from cache".format(key[:5]))
+            cuda = cuda or key[2]
+        if cuda:
+            clean_gpu_mem()
+
+    def get(
+        self,
+        model_dir,
+        style,
+        cuda=True,
+        memory_budget=2 ** 30,
+        backend="eager",
+        precision="fp32",
+        calibration_paths=None,
+    ):
+        key = (
+            model_dir,
+            style,
+            cuda,
+            backend,
+            precision,
+            tuple(calibration_paths or ()),
+        )
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key][0]
+            logger.info("Loading model {} into cache".format(key[:5]))
+            model = load_model(
+                model_dir,
+                style,
+                cuda=cuda,
+                backend=backend,
+                precision=precision,
+                calibration_paths=calibration_paths,
+            )
+            self._models[key] = (model, model_nbytes(model))
+            self._evict(memory_budget)
+            return model
+
+
+class CachedStyleModel(object):
+    """Stands in for the model of style in model_dir held by the ModelCache of
+    the worker that runs the task"""
+
+    def __init__(
+        self,
+        model_dir,
+        style,
+        cuda=True,
+        memory_budget=2 ** 30,
+        backend="eager",
+        precision="fp32",
+        calibration_paths=None,
+    ):
+        self.model_dir = model_dir
+        self.style = style
+        self.cuda = cuda
+        self.memory_budget = memory_budget
+        self.backend = backend
+        self.precision = precision
+        self.calibration_paths = calibration_paths
+
+    def load(self):
+        cache = get_worker().plugins[ModelCache.name]
+        return cache.get(
+            self.model_dir,
+            self.style,
+            cuda=self.cuda,
+            memory_budget=self.memory_budget,
+            backend=self.backend,
+            precision=self.precision,
+            calibration_paths=self.calibration_paths,
+        )
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __repr__(self):
+        return (
+            "CachedStyleModel({!r}, {!r}, cuda={!r}, backend={!r}, precision={!r})"
+        ).format(self.model_dir, self.style, self.cuda, self.backend, self.precision)
@@ -14,6 +14,33 @@ def run(
     memory_limit="auto",
     patience=60,
     batch_size=4,
+    cuda=True,
+    watch_mode="scan",
+    max_in_flight=None,
+    max_in_flight_bytes=None,
+    execution_mode="graph",
+    bucket_by=None,
+    max_wait=0,
+    autotune=False,
+    decode_min_size=None,
+    jpeg_quality=75,
+    png_compress_level=6,
+    write_threads=8,
+    inference_backend="eager",
+    precision="fp32",
+    reference_path=None,
+    min_psnr=None,
+    min_ssim=None,
+    tile_size=None,
+    tile_overlap=64,
+    tile_batch_size=4,
+    manifest_path=None,
+    segment_duration=10,
+    crf=20,
+    io_threads=0,
+    metrics_port=None,
+    metrics_path=None,
+    metrics_interval=30,
 ):
     if debug:
         logging.basicConfig(level=logging.DEBUG)
@@ -22,25 +49,70 @@ def run(
 
     from src.style_transfer import dask_mpi
     from src.style_transfer import dask_pipeline
+    from src.style_transfer.video import is_video
 
     logger = logging.getLogger(__name__)
     logger.debug(os.environ)
 
     os.makedirs(output_path, exist_ok=True)
 
-
-
-    dask_mpi.start(
-        dask_pipeline.start(
+    if is_video(filepath):
+        # a video is streamed to a video of the same name in output_path
+        pipeline = dask_pipeline.start_video(
+            model_dir,
+            style,
+            filepath,
+            os.path.join(output_path, os.path.basename(filepath)),
+            segment_duration=segment_duration,
+            batch_size=batch_size,
+            cuda=cuda,
+            crf=crf,
+            autotune=autotune,
+            inference_backend=inference_backend,
+            tile_size=tile_size,
+            tile_overlap=tile_overlap,
+            tile_batch_size=tile_batch_size,
+        )
+    else:
+        pipeline = dask_pipeline.start(
             model_dir,
             style,
             filepath,
             output_path,
             patience=patience,
             batch_size=batch_size,
-        ),
+            cuda=cuda,
+            watch_mode=watch_mode,
+            max_in_flight=max_in_flight,
+            max_in_flight_bytes=max_in_flight_bytes,
+            execution_mode=execution_mode,
+            bucket_by=bucket_by,
+            max_wait=max_wait,
+            autotune=autotune,
+            decode_min_size=decode_min_size,
+            jpeg_quality=jpeg_quality,
+            png_compress_level=png_compress_level,
+            write_threads=write_threads,
+            inference_backend=inference_backend,
+            precision=precision,
+            reference_path=reference_path,
+            min_psnr=min_psnr,
+            min_ssim=min_ssim,
+            tile_size=tile_size,
+            tile_overlap=tile_overlap,
+            tile_batch_size=tile_batch_size,
+            manifest_path=manifest_path,
+            io_resources=io_threads > 0,
+            metrics_port=metrics_port,
+            metrics_path=metrics_path,
+            metrics_interval=metrics_interval,
+        )
+
+    dask_mpi.start(
+        pipeline,
         cores_per_worker=cores_per_worker,
         memory_limit=memory_limit,
+        io_threads=io_threads,
     )
 
 
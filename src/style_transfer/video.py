@@ -0,0 +1,191 @@
+"""Streams video frames through ffmpeg without extracting them to image files
+
+A video is split into segments of a fixed number of frames so that segments can
+be decoded, processed and encoded on different workers. read_frames decodes a
+segment straight into batches of RGB arrays, SegmentWriter encodes processed
+frames into a video file for the segment, and concat_segments joins the
+segment files in order into the output video together with the audio of the
+source. Frame rates are assumed to be constant.
+"""
+import json
+import logging
+import math
+import os
+import subprocess
+from fractions import Fraction
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm")
+
+
+def is_video(path):
+    return os.path.isfile(path) and path.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def probe(path):
+    """Returns the width, height, frame rate and number of frames of the first
+    video stream of path"""
+    output = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "stream=width,height,r_frame_rate,nb_frames:format=duration",
+            "-of",
+            "json",
+            path,
+        ],
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    info = json.loads(output)
+    stream = info["streams"][0]
+    fps = Fraction(stream["r_frame_rate"])
+    frames = stream.get("nb_frames")
+    if frames is None or not frames.isdigit():
+        # not every container stores the frame count
+        frames = math.floor(float(info["format"]["duration"]) * fps)
+    return {
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "fps": fps,
+        "frames": int(frames),
+    }
+
+
+def segments(frames, fps, segment_duration=10):
+    """Splits frames into (first frame, number of frames) segments of about
+    segment_duration seconds"""
+    segment_frames = max(1, int(round(segment_duration * fps)))
+    return [
+        (start, min(segment_frames, frames - start))
+        for start in range(0, frames, segment_frames)
+    ]
+
+
+def read_frames(path, info, first_frame, frames, batch_size=4):
+    """Decodes frames frames of path starting at first_frame and yields them in
+    uint8 NHWC RGB batches of up to batch_size frames"""
+    start_time = float(Fraction(first_frame) / info["fps"])
+    frame_bytes = info["width"] * info["height"] * 3
+    command = [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-ss",
+        "{:.6f}".format(start_time),
+        "-i",
+        path,
+        "-frames:v",
+        str(frames),
+        "-f",
+        "rawvideo",
+        "-pix_fmt",
+        "rgb24",
+        "-",
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    try:
+        remaining = frames
+        while remaining > 0:
+            count = min(batch_size, remaining)
+            data = process.stdout.read(frame_bytes * count)
+            count = len(data) // frame_bytes
+            if count == 0:
+                break
+            remaining -= count
+            yield np.frombuffer(data[: count * frame_bytes], dtype=np.uint8).reshape(
+                count, info["height"], info["width"], 3
+            )
+    finally:
+        process.stdout.close()
+        process.wait()
+    if remaining > 0:
+        logger.warning(
+            "Segment at frame {} of {} ended {} frames early".format(
+                first_frame, path, remaining
+            )
+        )
+
+
+class SegmentWriter(object):
+    """Encodes uint8 NHWC RGB batches into the video file at path with libx264"""
+
+    def __init__(self, path, width, height, fps, crf=20):
+        self._path = path
+        self._process = subprocess.Popen(
+            [
+                "ffmpeg",
+                "-v",
+                "error",
+                "-y",
+                "-f",
+                "rawvideo",
+                "-pix_fmt",
+                "rgb24",
+                "-s",
+                "{}x{}".format(width, height),
+                "-r",
+                str(fps),
+                "-i",
+                "-",
+                "-c:v",
+                "libx264",
+                "-profile:v",
+                "high",
+                "-crf",
+                str(crf),
+                "-pix_fmt",
+                "yuv420p",
+                path,
+            ],
+            stdin=subprocess.PIPE,
+        )
+
+    def write(self, frames):
+        self._process.stdin.write(np.ascontiguousarray(frames, dtype=np.uint8).data)
+
+    def close(self):
+        self._process.stdin.close()
+        if self._process.wait() != 0:
+            raise RuntimeError("ffmpeg failed to encode {}".format(self._path))
+        return self._path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._process.kill()
+            self._process.wait()
+
+
+def segment_path(segment_folder, first_frame):
+    return os.path.join(segment_folder, "{:010d}.mp4".format(first_frame))
+
+
+def concat_segments(segment_paths, output_file, audio_source=None):
+    """Joins segment_paths in order into output_file without re-encoding them,
+    taking the audio, if any, from audio_source"""
+    list_file = output_file + ".segments.txt"
+    with open(list_file, "w") as f:
+        for path in segment_paths:
+            f.write("file '{}'\n".format(os.path.abspath(path)))
+    command = ["ffmpeg", "-v", "error", "-y", "-f", "concat", "-safe", "0"]
+    command += ["-i", list_file]
+    if audio_source is not None:
+        command += ["-i", audio_source, "-map", "0:v", "-map", "1:a?", "-shortest"]
+    command += ["-c", "copy", output_file]
+    try:
+        subprocess.run(command, check=True)
+    finally:
+        os.remove(list_file)
+    return output_file
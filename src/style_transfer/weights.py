@@ -0,0 +1,147 @@
+"""Memory mapped weight store for style transfer models
+
+convert_weights turns a style's .pth checkpoint into a .weights file once. The
+file holds a JSON index followed by the raw tensors, each aligned so it can be
+mapped in place. load_weights maps that file read only, so the model is
+built without unpickling or copying anything. Every worker process on a node
+that loads the same style shares the physical pages of its weights.
+Convert every style of a model folder with:
+    python -m style_transfer.weights model_dir
+"""
+import glob
+import json
+import os
+import re
+import struct
+import warnings
+from functools import reduce
+
+import numpy as np
+import torch
+
+WEIGHTS_SUFFIX = ".weights"
+_ALIGNMENT = 64
+_HEADER_LENGTH = struct.Struct("<Q")
+
+
+def clean_state_dict(state_dict):
+    # remove saved deprecated running_* keys in InstanceNorm from the checkpoint
+    return {
+        k: v
+        for k, v in state_dict.items()
+        if not re.search(r"in\d+\.running_(mean|var)$", k)
+    }
+
+
+def weights_path(model_dir, style):
+    return os.path.join(model_dir, style + WEIGHTS_SUFFIX)
+
+
+def has_weights(model_dir, style):
+    return os.path.exists(weights_path(model_dir, style))
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def save_weights(path, state_dict):
+    arrays = {
+        k: v.detach().cpu().contiguous().numpy() for k, v in state_dict.items()
+    }
+    index = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _aligned(offset)
+        index[name] = {
+            "dtype": array.dtype.str,
+            "shape": array.shape,
+            "offset": offset,
+        }
+        offset += array.nbytes
+    header = json.dumps(index).encode("utf-8")
+    data_start = _aligned(_HEADER_LENGTH.size + len(header))
+    # written under a temporary name so workers never map a partial file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + index[name]["offset"])
+            f.write(array.tobytes())
+    os.replace(tmp_path, path)
+
+
+def convert_weights(model_dir, style):
+    """Writes the cleaned weights of style in model_dir to its .weights file"""
+    state_dict = torch.load(
+        os.path.join(model_dir, style + ".pth"), map_location="cpu"
+    )
+    path = weights_path(model_dir, style)
+    save_weights(path, clean_state_dict(state_dict))
+    return path
+
+
+def load_weights(path):
+    """Maps the .weights file at path read only and returns its tensors"""
+    mapped = np.memmap(path, dtype=np.uint8, mode="r")
+    (header_length,) = _HEADER_LENGTH.unpack(
+        mapped[: _HEADER_LENGTH.size].tobytes()
+    )
+    header_end = _HEADER_LENGTH.size + header_length
+    index = json.loads(mapped[_HEADER_LENGTH.size : header_end].tobytes())
+    data_start = _aligned(header_end)
+    weights = {}
+    with warnings.catch_warnings():
+        # torch warns that the tensors share memory with a read only array
+        warnings.simplefilter("ignore", UserWarning)
+        for name, entry in index.items():
+            dtype = np.dtype(entry["dtype"])
+            start = data_start + entry["offset"]
+            count = int(np.prod(entry["shape"]))
+            array = mapped[start : start + count * dtype.itemsize].view(dtype)
+            weights[name] = torch.from_numpy(array.reshape(entry["shape"]))
+    return weights
+
+
+def assign_weights(model, weights):
+    """Makes the parameters and buffers of model the tensors of weights
+
+    Unlike load_state_dict nothing is copied, so mapped weights stay shared.
+    """
+    expected = set(model.state_dict())
+    if expected != set(weights):
+        raise ValueError(
+            "Weights do not match the model, missing {} unexpected {}".format(
+                sorted(expected - set(weights)), sorted(set(weights) - expected)
+            )
+        )
+    for name, tensor in weights.items():
+        module_name, _, attr = name.rpartition(".")
+        module = model
+        if module_name:
+            module = reduce(getattr, module_name.split("."), model)
+        if attr in module._parameters:
+            module._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+        else:
+            module._buffers[attr] = tensor
+    return model
+
+
+def main(model_dir, styles=None):
+    """Converts the .pth checkpoints of styles in model_dir, all of them by default"""
+    if styles is None:
+        styles = [
+            os.path.splitext(os.path.basename(path))[0]
+            for path in sorted(glob.glob(os.path.join(model_dir, "*.pth")))
+        ]
+    elif isinstance(styles, str):
+        styles = styles.split(",")
+    for style in styles:
+        print("Converted {}".format(convert_weights(model_dir, style)))
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(main)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the packages are run from src, see the README
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "src"))
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+pytest.importorskip("maskrcnn_benchmark")
+
+from maskrcnn.annotate import _contours  # noqa: E402
+
+
+def _drawn_contours(mask):
+    drawn = np.zeros(mask.shape, dtype=np.uint8)
+    contours, _ = cv2.findContours(
+        mask.astype(np.uint8), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE
+    )[-2:]
+    cv2.drawContours(drawn, contours, -1, 1, 3)
+    return drawn > 0
+
+
+def _masks():
+    rectangle = np.zeros((20, 20), dtype=np.uint8)
+    rectangle[5:15, 4:12] = 1
+    circle = np.zeros((30, 30), dtype=np.uint8)
+    cv2.circle(circle, (15, 15), 8, 1, -1)
+    triangle = np.zeros((30, 30), dtype=np.uint8)
+    cv2.fillPoly(triangle, [np.array([[3, 3], [25, 8], [10, 26]])], 1)
+    return [rectangle, circle, triangle]
+
+
+@pytest.mark.parametrize("mask", _masks())
+def test_contours_match_draw_contours(mask):
+    contours = _contours(mask.astype(np.int32))
+    np.testing.assert_array_equal(contours > 0, _drawn_contours(mask))
+
+
+def _predictions(sizes):
+    import torch
+    from maskrcnn_benchmark.structures.bounding_box import BoxList
+
+    torch.manual_seed(0)
+    predictions = []
+    for height, width in sizes:
+        corners = torch.rand(6, 2) * torch.tensor([width, height])
+        extents = torch.rand(6, 2) * torch.tensor([width, height]) / 3 + 1
+        boxes = torch.cat([corners, corners + extents], 1)
+        prediction = BoxList(boxes, (width, height))
+        prediction.add_field("scores", torch.linspace(0.99, 0.5, 6))
+        prediction.add_field("labels", torch.randint(1, 80, (6,)))
+        prediction.add_field("mask", torch.rand(6, 1, 28, 28))
+        predictions.append(prediction)
+    return predictions
+
+
+def test_annotate_and_record_matches_separate_stages():
+    from maskrcnn.annotate import annotate_batch
+    from maskrcnn.dask_pipeline import annotate_and_record
+    from maskrcnn.detections import detection_records
+
+    sizes = [(60, 80), (90, 70)]
+    images = [np.full(size + (3,), 128, dtype=np.uint8) for size in sizes]
+    predictions = _predictions(sizes)
+    filenames = ["a.jpg", "b.jpg"]
+    annotated, records = annotate_and_record(filenames, images, predictions)
+    for image, expected in zip(annotated, annotate_batch(images, predictions)):
+        np.testing.assert_array_equal(image, expected)
+    expected = detection_records(filenames, images, predictions)["columns"]
+    assert records["columns"].keys() == expected.keys()
+    for name, column in records["columns"].items():
+        if name == "mask":
+            for counts, expected_counts in zip(column, expected[name]):
+                np.testing.assert_array_equal(counts, expected_counts)
+        else:
+            np.testing.assert_array_equal(column, expected[name])
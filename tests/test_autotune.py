@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from distributed import Client, LocalCluster
+
+from style_transfer import autotune
+from style_transfer.autotune import BatchSizeTuner
+from style_transfer.model import (
+    TransformerNet,
+    _autotune_memory_limit,
+    stylize_batch_autotuned,
+)
+
+
+def test_tuner_converges_at_max_batch_size():
+    tuner = BatchSizeTuner(max_batch_size=4, trials=1)
+    key = (32, 32)
+    # each candidate is faster per image than the last
+    for batch_size in (1, 2, 4):
+        assert tuner.batch_size(key, 4) == batch_size
+        tuner.record(key, batch_size, 1.0)
+    state = tuner._states[key]
+    assert state.converged
+    assert state.best_size == 4
+
+
+def test_tuner_stops_over_memory_limit():
+    tuner = BatchSizeTuner(max_batch_size=8, memory_limit=100, trials=1)
+    key = (32, 32)
+    tuner.record(key, 1, 1.0, peak_memory=50)
+    tuner.record(key, 2, 1.0, peak_memory=200)
+    assert tuner._states[key].converged
+    assert tuner.batch_size(key, 8) == 1
+
+
+@pytest.fixture
+def client():
+    with LocalCluster(
+        n_workers=1,
+        threads_per_worker=1,
+        processes=False,
+        memory_limit="4GB",
+        dashboard_address=None,
+    ) as cluster, Client(cluster) as client:
+        yield client
+
+
+def test_autotuned_stylize_on_local_cluster(client):
+    autotune._tuners.clear()
+    model = TransformerNet().eval()
+    img_batch = np.random.RandomState(0).randint(
+        0, 255, (4, 3, 32, 32), dtype=np.uint8
+    )
+    memory_limit = client.submit(_autotune_memory_limit, False).result()
+    assert memory_limit
+    for _ in range(4):
+        output = client.submit(
+            stylize_batch_autotuned, model, img_batch, cuda=False, max_batch_size=4
+        ).result()
+        assert output.shape == (4, 3, 32, 32)
+    # the cluster runs in this process so its tuner is the one here
+    tuner = autotune.get_tuner(max_batch_size=4, memory_limit=memory_limit)
+    state = tuner._states[(32, 32)]
+    assert state.converged
+    assert 1 <= state.best_size <= 4
@@ -0,0 +1,92 @@
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+
+from style_transfer.dask_pipeline import BUCKET_KEYS, BucketBatcher, process_files
+
+
+def _image(folder, name, width, height, seed=0):
+    path = os.path.join(str(folder), name)
+    rng = np.random.RandomState(seed)
+    pixels = rng.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+    return path
+
+
+def test_shape_buckets_batch_images_of_one_size(tmp_path):
+    small = [_image(tmp_path, "s{}.png".format(i), 40, 30) for i in range(3)]
+    large = [_image(tmp_path, "l{}.png".format(i), 80, 60) for i in range(2)]
+    batcher = BucketBatcher(2, key_func=BUCKET_KEYS["shape"], max_wait=60)
+    batcher.add([small[0], large[0], small[1], small[2], large[1]])
+    # full batches are released at once, the partial one waits for max_wait
+    assert list(batcher.batches()) == [small[:2], large]
+    assert len(batcher) == 1
+    assert list(batcher.batches(flush=True)) == [small[2:]]
+    assert len(batcher) == 0
+
+
+def test_padded_buckets_round_sizes_up_to_multiples_of_64(tmp_path):
+    same = [_image(tmp_path, "a.png", 100, 60), _image(tmp_path, "b.png", 128, 33)]
+    other = _image(tmp_path, "c.png", 130, 60)
+    key = BUCKET_KEYS["padded"]
+    assert key(same[0]) == key(same[1]) == (128, 64)
+    assert key(other) == (192, 64)
+    batcher = BucketBatcher(2, key_func=key, max_wait=0)
+    batcher.add(same + [other])
+    assert list(batcher.batches()) == [same, [other]]
+
+
+def test_unreadable_files_get_a_bucket_of_their_own(tmp_path):
+    readable = _image(tmp_path, "a.png", 40, 30)
+    broken = str(tmp_path / "broken.png")
+    with open(broken, "wb") as f:
+        f.write(b"not an image")
+    batcher = BucketBatcher(2, key_func=BUCKET_KEYS["shape"], max_wait=0)
+    batcher.add([readable, broken])
+    assert sorted(batcher.batches()) == sorted([[readable], [broken]])
+
+
+def test_no_bucket_key_chunks_in_arrival_order():
+    batcher = BucketBatcher(2)
+    batcher.add(["a", "b", "c"])
+    assert list(batcher.batches()) == [["a", "b"], ["c"]]
+
+
+class _PixelwiseModel(torch.nn.Module):
+    """Each output pixel only depends on its input pixel, so padding must not
+    change the pixels that are kept after cropping"""
+
+    def __init__(self):
+        super().__init__()
+        self.mix = torch.nn.Conv2d(3, 3, 1)
+        torch.manual_seed(0)
+        torch.nn.init.uniform_(self.mix.weight, 0, 0.5)
+        torch.nn.init.zeros_(self.mix.bias)
+
+    def forward(self, x):
+        return self.mix(x)
+
+
+def test_padded_batches_are_cropped_to_the_unpadded_output(tmp_path):
+    inputs = [
+        _image(tmp_path, "a.png", 40, 30, seed=1),
+        _image(tmp_path, "b.png", 64, 57, seed=2),
+    ]
+    model = _PixelwiseModel()
+    padded, unpadded = tmp_path / "padded", tmp_path / "unpadded"
+    padded.mkdir()
+    unpadded.mkdir()
+    process_files([(model, str(padded))], inputs, cuda=False, pad=True)
+    for path in inputs:
+        process_files([(model, str(unpadded))], [path], cuda=False)
+    for path in inputs:
+        name = os.path.basename(path)
+        with Image.open(str(padded / name)) as img:
+            result = np.asarray(img)
+        with Image.open(str(unpadded / name)) as img:
+            expected = np.asarray(img)
+        with Image.open(path) as img:
+            assert result.shape[:2] == (img.height, img.width)
+        np.testing.assert_array_equal(result, expected)
@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+
+import pytest
+
+import maskrcnn
+import style_transfer
+
+# the readers are copied between the packages
+PACKAGES = [style_transfer, maskrcnn]
+
+
+def _touch(path, mtime=None):
+    open(path, "w").close()
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture(params=PACKAGES, ids=lambda package: package.__name__)
+def package(request):
+    return request.param
+
+
+def _scan_reader(package, folder, **kwargs):
+    return package.ScanFileReader(os.path.join(str(folder), "*.jpg"), **kwargs)
+
+
+def test_scan_reports_new_files_once(package, tmp_path):
+    _touch(str(tmp_path / "a.jpg"))
+    _touch(str(tmp_path / "ignored.txt"))
+    reader = _scan_reader(package, tmp_path)
+    assert reader.new_files() == {str(tmp_path / "a.jpg")}
+    assert reader.new_files() == set()
+    _touch(str(tmp_path / "b.jpg"))
+    assert reader.new_files() == {str(tmp_path / "b.jpg")}
+    assert reader.new_files() == set()
+
+
+def test_scan_reports_files_renamed_in_with_an_old_mtime(package, tmp_path):
+    folder, staging = tmp_path / "in", tmp_path / "staging"
+    folder.mkdir()
+    staging.mkdir()
+    _touch(str(folder / "a.jpg"))
+    reader = _scan_reader(package, folder)
+    assert reader.new_files() == {str(folder / "a.jpg")}
+    # moved in long after it was written, as mv or azcopy leave it
+    _touch(str(staging / "old.jpg"), mtime=time.time() - 3600)
+    os.rename(str(staging / "old.jpg"), str(folder / "old.jpg"))
+    assert reader.new_files() == {str(folder / "old.jpg")}
+    assert reader.new_files() == set()
+
+
+def test_scan_reports_a_removed_file_that_comes_back(package, tmp_path):
+    path = str(tmp_path / "a.jpg")
+    _touch(path)
+    reader = _scan_reader(package, tmp_path)
+    assert reader.new_files() == {path}
+    os.remove(path)
+    assert reader.new_files() == set()
+    _touch(path)
+    assert reader.new_files() == {path}
+
+
+def test_scan_relists_directories_within_the_settle_period(package, tmp_path):
+    # a file system with whole second mtimes, where a file created in the same
+    # second as the listing leaves the directory mtime as it was
+    tick = int(time.time())
+    os.utime(str(tmp_path), (tick, tick))
+    reader = _scan_reader(package, tmp_path, settle_period=60)
+    assert reader.new_files() == set()
+    _touch(str(tmp_path / "a.jpg"))
+    os.utime(str(tmp_path), (tick, tick))
+    assert reader.new_files() == {str(tmp_path / "a.jpg")}
+
+
+def test_scan_skips_unchanged_directories_after_the_settle_period(package, tmp_path):
+    tick = int(time.time()) - 10
+    os.utime(str(tmp_path), (tick, tick))
+    reader = _scan_reader(package, tmp_path, settle_period=1)
+    assert reader.new_files() == set()
+    _touch(str(tmp_path / "a.jpg"))
+    os.utime(str(tmp_path), (tick, tick))
+    # the directory looks unchanged so it is not listed
+    assert reader.new_files() == set()
+    assert reader.new_files(force=True) == {str(tmp_path / "a.jpg")}
+
+
+def test_scan_recursive(package, tmp_path):
+    (tmp_path / "sub").mkdir()
+    _touch(str(tmp_path / "sub" / "a.jpg"))
+    reader = _scan_reader(package, tmp_path, recursive=True)
+    assert reader.new_files() == {str(tmp_path / "sub" / "a.jpg")}
+    assert _scan_reader(package, tmp_path).new_files() == set()
+
+
+def test_inotify_reports_new_and_renamed_files(package, tmp_path):
+    pytest.importorskip("inotify_simple")
+    _touch(str(tmp_path / "a.jpg"))
+    reader = package.InotifyFileReader(os.path.join(str(tmp_path), "*.jpg"))
+    try:
+        assert reader.new_files() == {str(tmp_path / "a.jpg")}
+        assert reader.new_files() == set()
+        _touch(str(tmp_path / "b.jpg"))
+        staging = tmp_path / "staging"
+        staging.mkdir()
+        _touch(str(staging / "c.jpg"), mtime=time.time() - 3600)
+        os.rename(str(staging / "c.jpg"), str(tmp_path / "c.jpg"))
+        assert reader.new_files() == {
+            str(tmp_path / "b.jpg"),
+            str(tmp_path / "c.jpg"),
+        }
+        assert reader.new_files() == set()
+        os.remove(str(tmp_path / "b.jpg"))
+        reader.new_files()
+        assert not reader._scanner.is_seen(str(tmp_path / "b.jpg"))
+    finally:
+        reader.close()
+
+
+def test_create_file_reader_modes(package, tmp_path):
+    path = os.path.join(str(tmp_path), "*.jpg")
+    assert isinstance(package.create_file_reader(path, mode="glob"), package.FileReader)
+    assert isinstance(
+        package.create_file_reader(path, mode="scan"), package.ScanFileReader
+    )
+    assert isinstance(
+        package.create_file_reader(path, mode="auto", recursive=True),
+        package.ScanFileReader,
+    )
+    with pytest.raises(ValueError):
+        package.create_file_reader(path, mode="inotify", recursive=True)
+    with pytest.raises(ValueError):
+        package.create_file_reader(path, mode="unknown")
+
+
+def test_create_file_reader_falls_back_to_scan(package, tmp_path, monkeypatch):
+    # inotify_simple can not be imported
+    monkeypatch.setitem(sys.modules, "inotify_simple", None)
+    path = os.path.join(str(tmp_path), "*.jpg")
+    reader = package.create_file_reader(path, mode="auto")
+    assert isinstance(reader, package.ScanFileReader)
+    with pytest.raises(ImportError):
+        package.create_file_reader(path, mode="inotify")
@@ -0,0 +1,53 @@
+import os
+
+from style_transfer.manifest import Manifest
+
+
+def _touch(path, content=b"x"):
+    with open(path, "wb") as f:
+        f.write(content)
+
+
+def test_deleted_output_is_not_complete(tmp_path):
+    input_path, output_path = str(tmp_path / "in.jpg"), str(tmp_path / "out.jpg")
+    _touch(input_path)
+    _touch(output_path)
+    manifest = Manifest(str(tmp_path / "manifest.db"))
+    manifest.add_pending([input_path])
+    manifest.record([(input_path, output_path, None)])
+    assert manifest.is_complete(input_path, [output_path])
+    os.remove(output_path)
+    assert not manifest.is_complete(input_path, [output_path])
+
+
+def test_input_modified_after_it_was_queued_is_not_complete(tmp_path):
+    input_path, output_path = str(tmp_path / "in.jpg"), str(tmp_path / "out.jpg")
+    _touch(input_path)
+    _touch(output_path)
+    manifest = Manifest(str(tmp_path / "manifest.db"))
+    manifest.add_pending([input_path])
+    _touch(input_path, b"modified")
+    manifest.record([(input_path, output_path, None)])
+    assert not manifest.is_complete(input_path, [output_path])
+
+
+def test_removed_input_is_skipped(tmp_path):
+    manifest = Manifest(str(tmp_path / "manifest.db"))
+    missing = str(tmp_path / "missing.jpg")
+    assert manifest.record([(missing, str(tmp_path / "out.jpg"), None)]) == 0
+    assert len(manifest) == 0
+
+
+def test_recorded_inputs_are_no_longer_pending(tmp_path):
+    input_path = str(tmp_path / "in.jpg")
+    image_path, detections_path = str(tmp_path / "out.jpg"), str(tmp_path / "d")
+    for path in (input_path, image_path, detections_path):
+        _touch(path)
+    manifest = Manifest(str(tmp_path / "manifest.db"))
+    manifest.add_pending([input_path])
+    # more outputs of the input follow, so its queued version is kept for them
+    manifest.record([(input_path, image_path, None)], keep_pending=True)
+    _touch(input_path, b"modified")
+    manifest.record([(input_path, detections_path, None)])
+    assert manifest._pending == {}
+    assert not manifest.is_complete(input_path, [image_path, detections_path])
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn.functional as F
+
+from maskrcnn import masks as mask_module
+from maskrcnn.masks import decode_mask, encode_masks, paste_masks
+
+
+def _pasted_mask(mask, box, height, width, threshold=0.5, padding=1):
+    """paste_mask_in_image of the Masker of maskrcnn_benchmark"""
+    size = mask.shape[-1]
+    scale = (size + 2 * padding) / size
+    mask = F.pad(mask[0], [padding] * 4)
+    half_size = (box[2:] - box[:2]) * 0.5 * scale
+    center = (box[2:] + box[:2]) * 0.5
+    box = torch.cat([center - half_size, center + half_size]).to(torch.int32).tolist()
+    box_width = max(box[2] - box[0] + 1, 1)
+    box_height = max(box[3] - box[1] + 1, 1)
+    mask = F.interpolate(
+        mask[None, None],
+        size=(box_height, box_width),
+        mode="bilinear",
+        align_corners=False,
+    )[0, 0]
+    pasted = np.zeros((height, width), dtype=np.uint8)
+    x_0, x_1 = max(box[0], 0), min(box[2] + 1, width)
+    y_0, y_1 = max(box[1], 0), min(box[3] + 1, height)
+    pasted[y_0:y_1, x_0:x_1] = (
+        mask[y_0 - box[1] : y_1 - box[1], x_0 - box[0] : x_1 - box[0]] > threshold
+    ).numpy()
+    return pasted
+
+
+def _batch():
+    torch.manual_seed(0)
+    sizes = [(60, 80), (45, 30), (50, 50)]
+    boxes = [
+        # inside, past the edges and degenerate boxes
+        torch.tensor(
+            [
+                [10.0, 5.0, 40.0, 30.0],
+                [-8.0, 20.0, 30.0, 70.0],
+                [70.0, 50.0, 95.0, 65.0],
+            ]
+        ),
+        torch.tensor([[3.0, 4.0, 3.5, 4.2], [0.0, 0.0, 29.0, 44.0]]),
+        torch.zeros(0, 4),
+    ]
+    masks = [torch.rand(len(image_boxes), 1, 28, 28) for image_boxes in boxes]
+    return masks, boxes, sizes
+
+
+@pytest.mark.parametrize("max_paste_pixels", [2 ** 22, 500])
+def test_encoded_masks_decode_to_the_masker_masks(monkeypatch, max_paste_pixels):
+    # a small limit pastes the masks in several chunks
+    monkeypatch.setattr(mask_module, "MAX_PASTE_PIXELS", max_paste_pixels)
+    masks, boxes, sizes = _batch()
+    encoded = encode_masks(masks, boxes, sizes)
+    assert [len(counts) for counts in encoded] == [3, 2, 0]
+    for image_masks, image_boxes, (height, width), image_counts in zip(
+        masks, boxes, sizes, encoded
+    ):
+        for mask, box, counts in zip(image_masks, image_boxes, image_counts):
+            assert counts.dtype == np.int32 and counts.sum() == height * width
+            np.testing.assert_array_equal(
+                decode_mask(counts, height, width),
+                _pasted_mask(mask, box, height, width),
+            )
+
+
+def test_encode_masks_of_masks_covering_the_image():
+    masks = torch.ones(2, 1, 28, 28)
+    boxes = torch.tensor([[0.0, 0.0, 9.0, 9.0], [0.0, 0.0, 9.0, 9.0]])
+    encoded = encode_masks([masks], [boxes], [(10, 10)])
+    assert [counts.tolist() for counts in encoded[0]] == [[0, 100], [0, 100]]
+    assert encode_masks([], [], []) == []
+
+
+def test_paste_masks_keeps_the_most_confident_detection():
+    masks, boxes, sizes = _batch()
+    label_maps = paste_masks(masks, boxes, sizes)
+    for image_masks, image_boxes, (height, width), label_map in zip(
+        masks, boxes, sizes, label_maps
+    ):
+        expected = np.zeros((height, width), dtype=np.int32)
+        for label in range(len(image_masks), 0, -1):
+            pasted = _pasted_mask(
+                image_masks[label - 1], image_boxes[label - 1], height, width
+            )
+            expected[pasted > 0] = label
+        np.testing.assert_array_equal(label_map, expected)
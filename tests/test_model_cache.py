@@ -0,0 +1,40 @@
+import torch
+
+from style_transfer import model_cache
+from style_transfer.model_cache import ModelCache, model_nbytes
+
+
+def _cache(monkeypatch):
+    loaded = []
+
+    def load_model(model_dir, style, cuda=True, **kwargs):
+        loaded.append((style, cuda))
+        return torch.nn.Linear(16, 16)
+
+    monkeypatch.setattr(model_cache, "load_model", load_model)
+    monkeypatch.setattr(model_cache, "clean_gpu_mem", lambda: None)
+    cache = ModelCache()
+    cache.setup(None)
+    return cache, loaded
+
+
+def test_models_are_cached_per_device(monkeypatch):
+    cache, loaded = _cache(monkeypatch)
+    gpu = cache.get("model", "mosaic", cuda=True)
+    cpu = cache.get("model", "mosaic", cuda=False)
+    assert gpu is not cpu
+    assert cache.get("model", "mosaic", cuda=False) is cpu
+    assert loaded == [("mosaic", True), ("mosaic", False)]
+
+
+def test_eviction_follows_the_budget_of_the_latest_run(monkeypatch):
+    cache, loaded = _cache(monkeypatch)
+    size = model_nbytes(torch.nn.Linear(16, 16))
+    cache.get("model", "mosaic", memory_budget=3 * size)
+    cache.get("model", "candy", memory_budget=3 * size)
+    assert cache.nbytes == 2 * size
+    # a later run with a smaller budget evicts the least recently used model
+    cache.get("model", "udnie", memory_budget=2 * size)
+    assert cache.nbytes == 2 * size
+    cache.get("model", "candy", memory_budget=2 * size)
+    assert loaded == [("mosaic", True), ("candy", True), ("udnie", True)]
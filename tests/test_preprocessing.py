@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("maskrcnn_benchmark")
+
+from maskrcnn import model  # noqa: E402
+
+
+class _Input:
+    PIXEL_MEAN = [102.9801, 115.9465, 122.7717]
+    PIXEL_STD = [1.0, 1.0, 1.0]
+    TO_BGR255 = True
+
+
+class _Config:
+    INPUT = _Input
+
+
+# upscaled, downscaled and already at the minimum size
+SIZES = [(480, 640), (1080, 1920), (800, 1066)]
+
+
+@pytest.fixture(params=[True, False], ids=["interpolate", "pil"])
+def antialias(request, monkeypatch):
+    if request.param and not model._INTERPOLATE_ANTIALIAS:
+        pytest.skip("F.interpolate has no antialias before torch 1.11")
+    monkeypatch.setattr(model, "_INTERPOLATE_ANTIALIAS", request.param)
+    return request.param
+
+
+def test_batch_transform_matches_transforms(antialias):
+    rng = np.random.RandomState(0)
+    images = [rng.randint(0, 256, size + (3,), dtype=np.uint8) for size in SIZES]
+    batch = model.build_batch_transform(_Config)(images)
+    transform = model.build_transforms(_Config)
+    assert batch.tensors.shape[2] % 32 == 0 and batch.tensors.shape[3] % 32 == 0
+    for image, padded, size in zip(images, batch.tensors, batch.image_sizes):
+        expected = transform(image)
+        assert tuple(expected.shape[1:]) == size
+        height, width = size
+        difference = (padded[:, :height, :width] - expected).abs().max().item()
+        # PIL rounds its output to uint8, torch only the interpolated one
+        assert difference <= (1.0 if antialias else 1e-4)
+        assert not padded[:, height:].any() and not padded[:, :, width:].any()
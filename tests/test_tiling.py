@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+import torch
+
+from style_transfer.model import (
+    _blend_window,
+    _tile_starts,
+    stylize_batch,
+    stylize_batch_tiled,
+)
+
+
+def _assert_close(actual, expected):
+    assert torch.allclose(actual, expected, atol=1e-5), (actual - expected).abs().max()
+
+
+@pytest.mark.parametrize(
+    "length,tile_size,overlap",
+    [
+        (100, 100, 16),
+        (50, 100, 16),
+        (1000, 256, 32),
+        # the pixels past the last tile fit in the overlap of the tile before
+        (500, 256, 64),
+        (466, 256, 64),
+        (257, 256, 0),
+        (4000, 1024, 64),
+    ],
+)
+def test_tiles_cover_the_image_and_overlap(length, tile_size, overlap):
+    starts = _tile_starts(length, tile_size, overlap)
+    assert starts[0] == 0
+    assert starts == sorted(set(starts))
+    stops = [min(start + tile_size, length) for start in starts]
+    # the last tile ends at the edge, every tile overlaps the one before by at
+    # least overlap pixels and lies within the image
+    assert stops[-1] == length
+    assert all(start >= 0 for start in starts)
+    for stop, start in zip(stops, starts[1:]):
+        assert stop - start >= overlap
+    # no fewer tiles could cover the image with that overlap
+    assert len(starts) == max(1, -(-(length - overlap) // (tile_size - overlap)))
+
+
+def test_tiles_are_spread_evenly_without_a_near_copy_at_the_edge():
+    # tiles every 192 pixels would leave 52 pixels for a third tile
+    assert _tile_starts(500, 256, 64) == [0, 122, 244]
+    assert _tile_starts(448, 256, 64) == [0, 192]
+    assert _tile_starts(1000, 256, 32) == [0, 186, 372, 558, 744]
+
+
+@pytest.mark.parametrize("overlap", [0, 8, 16])
+def test_blend_weights_sum_to_one(overlap):
+    height, width, tile_size = 150, 230, 64
+    window = _blend_window(tile_size, tile_size, overlap)
+    assert window.min() > 0 and window.max() == 1
+    total = torch.zeros(height, width)
+    contributions = []
+    for y in _tile_starts(height, tile_size, overlap):
+        for x in _tile_starts(width, tile_size, overlap):
+            weights = torch.zeros(height, width)
+            weights[y : y + tile_size, x : x + tile_size] = window
+            contributions.append(weights)
+            total += weights
+    assert total.min() > 0
+    normalized = sum(weights / total for weights in contributions)
+    _assert_close(normalized, torch.ones(height, width))
+
+
+def _double(x):
+    return 2 * x
+
+
+@pytest.mark.parametrize("size", [(70, 90), (64, 64), (30, 200)])
+def test_tiled_output_of_a_pixelwise_model_matches_untiled(size):
+    rng = np.random.RandomState(0)
+    img_batch = rng.randint(0, 256, (2, 3) + size, dtype=np.uint8)
+    tiled = stylize_batch_tiled(
+        _double, img_batch, cuda=False, tile_size=32, overlap=8, tile_batch_size=3
+    )
+    expected = stylize_batch(_double, img_batch, cuda=False)
+    _assert_close(tiled, expected)
+
+
+def test_overlap_must_be_smaller_than_the_tile():
+    img_batch = np.zeros((1, 3, 40, 40), dtype=np.uint8)
+    with pytest.raises(ValueError):
+        stylize_batch_tiled(_double, img_batch, cuda=False, tile_size=16, overlap=16)
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from style_transfer.model import TransformerNet, load_model
+from style_transfer.weights import (
+    assign_weights,
+    convert_weights,
+    load_weights,
+    save_weights,
+    weights_path,
+)
+
+
+def _checkpoint(model_dir, style):
+    torch.manual_seed(0)
+    state_dict = TransformerNet().state_dict()
+    # the deprecated InstanceNorm buffers of the published checkpoints
+    state_dict["in1.running_mean"] = torch.zeros(32)
+    state_dict["in1.running_var"] = torch.ones(32)
+    torch.save(state_dict, str(model_dir / (style + ".pth")))
+    return state_dict
+
+
+def test_assigned_weights_reproduce_the_state_dict(tmp_path):
+    state_dict = _checkpoint(tmp_path, "mosaic")
+    path = convert_weights(str(tmp_path), "mosaic")
+    assert path == weights_path(str(tmp_path), "mosaic")
+    weights = load_weights(path)
+    assert "in1.running_mean" not in weights
+    # the tensors are aligned views of the one mapping of the file
+    pointers = [tensor.data_ptr() for tensor in weights.values()]
+    assert all(pointer % 64 == 0 for pointer in pointers)
+    assert max(pointers) - min(pointers) < os.path.getsize(path)
+    model = assign_weights(TransformerNet(), weights)
+    loaded = model.state_dict()
+    assert set(loaded) == set(state_dict) - {"in1.running_mean", "in1.running_var"}
+    for name, tensor in loaded.items():
+        assert tensor.dtype == state_dict[name].dtype
+        assert torch.equal(tensor, state_dict[name])
+
+
+def test_mapped_and_checkpoint_models_stylize_alike(tmp_path):
+    _checkpoint(tmp_path, "mosaic")
+    image = torch.rand(1, 3, 32, 48) * 255
+    with torch.no_grad():
+        expected = load_model(str(tmp_path), "mosaic", cuda=False)(image)
+        convert_weights(str(tmp_path), "mosaic")
+        mapped = load_model(str(tmp_path), "mosaic", cuda=False)(image)
+    assert torch.equal(mapped, expected)
+
+
+def test_weights_of_another_model_are_rejected(tmp_path):
+    path = str(tmp_path / "linear.weights")
+    save_weights(path, torch.nn.Linear(2, 2).state_dict())
+    with pytest.raises(ValueError):
+        assign_weights(TransformerNet(), load_weights(path))
+
+
+def test_save_weights_keeps_dtypes_and_shapes(tmp_path):
+    path = str(tmp_path / "mixed.weights")
+    state_dict = {
+        "a": torch.arange(6, dtype=torch.int64).reshape(2, 3),
+        "b": torch.rand(5, dtype=torch.float64),
+        "c": torch.tensor(1.5),
+    }
+    save_weights(path, state_dict)
+    weights = load_weights(path)
+    for name, tensor in state_dict.items():
+        assert weights[name].dtype == tensor.dtype
+        np.testing.assert_array_equal(weights[name].numpy(), tensor.numpy())